@@ -0,0 +1,172 @@
+import sys
+import asyncio
+import argparse
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, List
+from colorama import init, Fore, Style
+
+import config
+import scrubber
+import segment_store
+from protocol import KNOWN_TYPES, type_label
+from cell import Cell, HEARTBEAT_INTERVAL, DIFFERENTIATION_DELAY
+
+init(autoreset=True)
+
+# Message types whose handlers touch the disk, hash chunk data or may block
+# (VERIFY waits when the verifier queue is full). They run on the executor, so
+# the event loop itself only decodes and enqueues datagrams and never stalls
+# behind a slow handler.
+BLOCKING_TYPES = {'STORE', 'VERIFY', 'VERIFY_RESULT', 'REQUEST', 'REPLICATE', 'SYNC', 'SYNC_IDS', 'SABOTAGE',
+                  'MANIFEST', 'MANIFEST_SYNC', 'DELETE', 'CHUNK'}
+
+# Concurrent handlers per blocking message type (cheap types get one, in order).
+# Handlers that update chunk_metadata or the manifests serialize on Cell.data_lock
+BLOCKING_WORKERS = 4
+
+
+class CellProtocol(asyncio.DatagramProtocol):
+    """Receive side of a cell: reassemble, decode and hand off to the runtime."""
+
+    def __init__(self, runtime: "AsyncCellRuntime"):
+        self.runtime = runtime
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        payload = self.runtime.cell.network.process_datagram(data)
+        if payload is not None:
+            self.runtime.dispatch(payload)
+
+    def error_received(self, exc: Exception):
+        print(f"Cell-{self.runtime.cell.port} socket error: {exc}")
+
+
+class AsyncCellRuntime:
+    """Drives one Cell from an asyncio event loop instead of its own threads.
+
+    - receive: a DatagramProtocol on the cell's socket
+    - handling: one bounded asyncio.Queue per known message type, plus one
+      'other' queue shared by every unknown type; when a queue is full new
+      messages of that type are dropped (and counted) instead of backing up
+      the socket for every other type
+    - timers: SWIM ticks, legacy heartbeats, anti-entropy, store fsync,
+      compaction and scrubbing as async tasks
+    - disk and hash work: offloaded to a shared executor
+    """
+
+    def __init__(self, cell: Cell, executor: Executor, queue_size: int = None):
+        self.cell = cell
+        self.executor = executor
+        self.queue_size = queue_size if queue_size is not None else config.HANDLER_QUEUE_SIZE
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.dropped: Dict[str, int] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.transport = None
+
+        # Membership callbacks start healing / anti-entropy, which read chunks
+        # from disk; they run on the shared executor, off the event loop
+        cell.executor = executor
+
+    def _open_queues(self):
+        # All up front: types named by peers must not create queues and tasks
+        for msg_type in sorted(KNOWN_TYPES) + ['other']:
+            queue = self.queues[msg_type] = asyncio.Queue(maxsize=self.queue_size)
+            self.dropped[msg_type] = 0
+            workers = BLOCKING_WORKERS if msg_type in BLOCKING_TYPES else 1
+            for _ in range(workers):
+                self.tasks.append(asyncio.ensure_future(self._worker(msg_type, queue)))
+
+    def dispatch(self, payload: dict):
+        msg_type = type_label(payload.get('type'))
+        try:
+            self.queues[msg_type].put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped[msg_type] += 1
+
+    async def _worker(self, msg_type: str, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        blocking = msg_type in BLOCKING_TYPES
+        while True:
+            payload = await queue.get()
+            try:
+                if blocking:
+                    await loop.run_in_executor(self.executor, self.cell.handle_message, payload)
+                else:
+                    self.cell.handle_message(payload)
+            except Exception as e:
+                print(f"Cell-{self.cell.port} error handling {msg_type}: {e}")
+
+    async def _every(self, interval: float, fn: Callable, blocking: bool = False):
+        loop = asyncio.get_running_loop()
+        while self.cell.running:
+            await asyncio.sleep(interval)
+            try:
+                if blocking:
+                    await loop.run_in_executor(self.executor, fn)
+                else:
+                    fn()
+            except Exception as e:
+                print(f"Cell-{self.cell.port} error in {fn.__name__}: {e}")
+
+    async def _differentiate_later(self):
+        await asyncio.sleep(DIFFERENTIATION_DELAY)
+        self.cell.differentiate()
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {msg_type: queue.qsize() for msg_type, queue in self.queues.items()}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._open_queues()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: CellProtocol(self),
+                                                                sock=self.cell.network.socket)
+        cell = self.cell
+        self.tasks += [
+            asyncio.ensure_future(self._every(cell.membership_period(), cell.membership.tick)),
+            asyncio.ensure_future(self._every(HEARTBEAT_INTERVAL, cell.heartbeat_tick)),
+            asyncio.ensure_future(self._every(config.ANTI_ENTROPY_INTERVAL, cell.anti_entropy_tick, blocking=True)),
+            asyncio.ensure_future(self._every(segment_store.FSYNC_INTERVAL, cell.store.sync, blocking=True)),
+            asyncio.ensure_future(self._every(segment_store.COMPACT_INTERVAL, cell.store.compact, blocking=True)),
+            asyncio.ensure_future(self._every(scrubber.TICK_INTERVAL, cell.scrubber.tick, blocking=True)),
+            asyncio.ensure_future(self._every(config.TELEMETRY_INTERVAL, cell.report_stats, blocking=True)),
+            asyncio.ensure_future(self._differentiate_later()),
+        ]
+        print(f"{Fore.GREEN}🟢 Cell-{cell.port} STARTED as {cell.role} (asyncio){Style.RESET_ALL}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        if self.transport:
+            self.transport.close()
+        self.cell.stop()
+
+
+async def run_cells(ports: List[int], peers: List[int]):
+    """Host several cells in one process, sharing one event loop and executor."""
+    executor = ThreadPoolExecutor(max_workers=config.EXECUTOR_WORKERS)
+    everyone = set(ports) | set(peers)
+    runtimes = []
+    for port in ports:
+        neighbors = sorted(everyone - {port})
+        cell = Cell(f"cell-{port}", port, neighbors, background_threads=False)
+        runtime = AsyncCellRuntime(cell, executor)
+        await runtime.start()
+        runtimes.append(runtime)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runtime in runtimes:
+            await runtime.stop()
+        executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one or more cells on an asyncio event loop")
+    parser.add_argument("ports", type=int, nargs="+", help="ports of the cells hosted by this process")
+    parser.add_argument("--peers", type=int, nargs="*", default=[], help="ports of cells running elsewhere")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_cells(args.ports, args.peers))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,422 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import select
+import shutil
+import socket
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import config
+import placement
+from network import UDPNetwork
+from upload_client import UploadClient
+from download_client import DownloadClient
+from protocol import PROTOCOL_VERSION
+from colorama import init, Fore, Style
+
+init(autoreset=True)
+
+# Reproducible performance runs: for each cluster size, start the cells on
+# free ports, upload a generated dataset, read it back, then kill cells and
+# time failure detection and re-replication. Results go out as JSON (with
+# the commit and parameters), and --compare prints the change against an
+# earlier results file.
+#
+# Cells run in their own processes (or --per-process of them on one asyncio
+# event loop, for clusters of 100+), in a scratch directory, reporting to a
+# telemetry port of the harness's own. Their snapshots tell when the cluster
+# has converged, when a dead cell is noticed and when its copies are back.
+# Timings taken from telemetry have a resolution of --telemetry-interval.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Metrics compared by --compare: (section, key, higher is better)
+COMPARED = [
+    ('startup', 'seconds', False),
+    ('upload', 'bytes_per_sec', True),
+    ('download', 'bytes_per_sec', True),
+    ('reads', 'p50_ms', False),
+    ('reads', 'p99_ms', False),
+    ('failure', 'detect_first_s', False),
+    ('failure', 'detect_all_s', False),
+    ('failure', 'heal_s', False),
+]
+
+
+def parse_size(text: str) -> int:
+    """'512', '64K', '8M', '1G' -> bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def free_ports(count: int) -> List[int]:
+    """Ports free for UDP right now (held together, so they are distinct)."""
+    sockets = []
+    try:
+        for _ in range(count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind(('localhost', 0))
+            sockets.append(s)
+        return sorted(s.getsockname()[1] for s in sockets)
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def make_dataset(size: int, kind: str, seed: int) -> bytes:
+    """Deterministic test data: 'random' (incompressible) or 'text' (compresses well)."""
+    rng = random.Random(seed)
+    if kind == 'random':
+        return rng.randbytes(size)
+    words = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10))) for _ in range(2000)]
+    out = bytearray()
+    while len(out) < size:
+        out += b" ".join(rng.choices(words, k=64)) + b"\n"
+    return bytes(out[:size])
+
+
+def percentiles(samples: List[float]) -> dict:
+    """p50 / p90 / p99 / max of latencies in seconds, as milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 3)
+    return {'p50_ms': pick(0.5), 'p90_ms': pick(0.9), 'p99_ms': pick(0.99),
+            'max_ms': round(ordered[-1] * 1000, 3), 'samples': len(ordered)}
+
+
+class Telemetry:
+    """Keeps the latest STATS snapshot of every cell, received on our own port."""
+
+    def __init__(self):
+        self.network = UDPNetwork(0, default_peer_version=PROTOCOL_VERSION)
+        self.port = self.network.port
+        self.latest: Dict[int, Tuple[float, dict]] = {} # port -> (received at, snapshot)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        sock = self.network.socket
+        while self.network.running:
+            try:
+                if not select.select([sock], [], [], 0.2)[0]:
+                    continue
+            except (OSError, ValueError):
+                return # Socket closed
+            msg = self.network.receive_message()
+            if msg is None:
+                continue
+            payload, _ = msg
+            if payload.get('type') == 'STATS':
+                snapshot = payload.get('data') or {}
+                snapshot.pop('metrics', None)
+                with self.lock:
+                    self.latest[payload.get('sender_port')] = (time.time(), snapshot)
+
+    def snapshots(self, ports: List[int], since: float = 0.0) -> Dict[int, dict]:
+        """Latest snapshot of each of ports, if one arrived after `since`."""
+        with self.lock:
+            return {port: self.latest[port][1] for port in ports
+                    if port in self.latest and self.latest[port][0] > since}
+
+    def wait_for(self, ports: List[int], condition, timeout: float, since: float = 0.0) -> Optional[float]:
+        """Seconds until condition(snapshots of ports) held, or None after timeout."""
+        started = time.time()
+        while time.time() - started < timeout:
+            snapshots = self.snapshots(ports, since)
+            if len(snapshots) == len(ports) and condition(snapshots):
+                return time.time() - started
+            time.sleep(config.TELEMETRY_INTERVAL / 4)
+        return None
+
+    def close(self):
+        self.network.close()
+
+
+class Cluster:
+    """N cells on free ports, run from a scratch directory."""
+
+    def __init__(self, cells: int, per_process: int, telemetry_port: int, env: Dict[str, str]):
+        self.ports = free_ports(cells)
+        self.workdir = tempfile.mkdtemp(prefix="cellsync-bench-")
+        self.env = dict(os.environ, CELLSYNC_TELEMETRY_PORT=str(telemetry_port), **env)
+        self.processes: List[Tuple[subprocess.Popen, List[int]]] = []
+        for i in range(0, cells, per_process):
+            group = self.ports[i:i + per_process]
+            if per_process == 1:
+                args = [sys.executable, os.path.join(BACKEND_DIR, "cell.py"), str(group[0])]
+                args += [str(p) for p in self.ports if p != group[0]]
+            else:
+                args = [sys.executable, os.path.join(BACKEND_DIR, "async_runtime.py")] + [str(p) for p in group]
+                args += ["--peers"] + [str(p) for p in self.ports if p not in group]
+            p = subprocess.Popen(args, cwd=self.workdir, env=self.env,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.processes.append((p, group))
+
+    def kill(self, count: int, rng: random.Random) -> List[int]:
+        """Crash (SIGKILL) processes holding at least `count` cells; returns the dead ports.
+
+        One process always survives, so with --per-process fewer cells may die.
+        """
+        alive = [entry for entry in self.processes if entry[0].poll() is None]
+        rng.shuffle(alive)
+        dead: List[int] = []
+        for p, group in alive[:-1]:
+            if len(dead) >= count:
+                break
+            p.kill()
+            dead.extend(group)
+        return sorted(dead)
+
+    def stop(self):
+        for p, _ in self.processes:
+            p.terminate()
+        for p, _ in self.processes:
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run(cells: int, args, data: bytes) -> dict:
+    """One benchmark run against a fresh cluster of `cells` cells."""
+    print(f"{Fore.CYAN}- {cells} cells: starting cluster...{Style.RESET_ALL}", file=sys.stderr)
+    result = {'cells': cells}
+    rng = random.Random(args.seed)
+    env = {'CELLSYNC_TELEMETRY_INTERVAL': str(config.TELEMETRY_INTERVAL)}
+    telemetry = Telemetry()
+    cluster = Cluster(cells, args.per_process, telemetry.port, env)
+    ports = cluster.ports
+    try:
+        # Startup: every cell reporting, membership converged and (optionally) roles assigned
+        started = time.time()
+        converged = telemetry.wait_for(ports, lambda s: all(
+            len(c.get('alive', [])) >= cells - 1 and (not args.wait_roles or c.get('role') != 'STEM')
+            for c in s.values()), args.startup_timeout)
+        result['startup'] = {'seconds': round(converged, 3) if converged is not None else None}
+        if converged is None:
+            result['error'] = f"cluster did not converge within {args.startup_timeout}s"
+            return result
+
+        # Upload
+        print(f"  uploading {len(data)} bytes...", file=sys.stderr)
+        filename = f"bench-{args.seed}.bin"
+        erasure = (config.ERASURE_DATA_SHARDS, config.ERASURE_PARITY_SHARDS) if args.erasure else None
+        with UploadClient(ports, erasure=erasure, compression=args.compression, chunking=args.chunking) as client:
+            report = client.upload_stream(io.BytesIO(data), filename, len(data), args.chunk_size)
+        result['upload'] = {k: report[k] for k in ('seconds', 'bytes_per_sec', 'chunks', 'unique_chunks',
+                                                   'replicas', 'under_replicated', 'retransmits', 'stored_bytes')}
+
+        # Full read back, checked against the dataset
+        with DownloadClient(ports) as client:
+            manifest = None
+            deadline = time.time() + 10
+            while manifest is None and time.time() < deadline:
+                manifest = client.get_manifest(filename)
+            if manifest is None:
+                result['error'] = "manifest not found after upload"
+                return result
+            started = time.time()
+            digest = hashlib.sha256()
+            for piece in client.iter_file(manifest):
+                digest.update(piece)
+            elapsed = time.time() - started
+            result['download'] = {'seconds': round(elapsed, 3),
+                                  'bytes_per_sec': int(len(data) / elapsed) if elapsed > 0 else 0,
+                                  'intact': digest.hexdigest() == hashlib.sha256(data).hexdigest()}
+
+            # Random range reads
+            read_size = min(args.read_size, len(data))
+            latencies = []
+            for _ in range(args.reads):
+                start = rng.randrange(0, len(data) - read_size + 1)
+                began = time.perf_counter()
+                for _ in client.iter_file(manifest, start, start + read_size):
+                    pass
+                latencies.append(time.perf_counter() - began)
+            result['reads'] = dict(percentiles(latencies), read_size=read_size)
+
+        if args.kill:
+            result['failure'] = measure_failure(cluster, telemetry, args, rng, manifest, report['target_replicas'])
+        return result
+    finally:
+        cluster.stop()
+        telemetry.close()
+
+
+def expected_copies(manifest: dict, ports: List[int], dead: List[int], target: int) -> Tuple[int, int]:
+    """(stored units the cluster should hold once healed, chunks lost for good).
+
+    A replicated chunk is lost when every cell of its replica set died,
+    otherwise it gets min(target, survivors) copies back. An erasure-coded
+    stripe is lost when more than m of its shard holders died; the shards of
+    the others are all rebuilt.
+    """
+    dead = set(dead)
+    survivors = len(ports) - len(dead)
+    wanted = lost = 0
+    if 'stripes' in manifest:
+        m = manifest['erasure']['m']
+        shards = set()
+        for stripe in manifest['stripes']:
+            dead_holders = sum(1 for holder in stripe['holders'] if holder in dead)
+            if dead_holders > m:
+                lost += 1
+                shards.update(s for s, holder in zip(stripe['shards'], stripe['holders']) if holder not in dead)
+            else:
+                shards.update(stripe['shards'])
+        return len(shards), lost
+    for chunk_id in set(manifest['chunks']):
+        if set(placement.replica_set(chunk_id, ports, target)) <= dead:
+            lost += 1
+        else:
+            wanted += min(target, survivors)
+    return wanted, lost
+
+
+def measure_failure(cluster: Cluster, telemetry: Telemetry, args, rng: random.Random,
+                    manifest: dict, target: int) -> dict:
+    """Kill cells and time how long until the survivors notice and restore every copy."""
+    ports = cluster.ports
+    stored = lambda s: sum(c.get('chunks', 0) for c in s.values())
+    # Wait for the cluster to hold every copy the upload placed (stragglers, retries)
+    copies, _ = expected_copies(manifest, ports, [], target)
+    telemetry.wait_for(ports, lambda s: stored(s) >= copies, args.heal_timeout)
+
+    dead = cluster.kill(args.kill, rng)
+    killed_at = time.time()
+    survivors = [p for p in ports if p not in dead]
+    print(f"  killed {len(dead)} cells, waiting for healing...", file=sys.stderr)
+    wanted, lost = expected_copies(manifest, ports, dead, target)
+    failure = {'killed': len(dead), 'survivors': len(survivors), 'lost_chunks': lost}
+    if not dead:
+        return failure
+
+    noticed = lambda c: not set(dead) & set(c.get('alive', []))
+    first = all_ = None
+    healed = None
+    while time.time() - killed_at < args.heal_timeout:
+        snapshots = telemetry.snapshots(survivors, killed_at)
+        now = time.time() - killed_at
+        if first is None and any(noticed(c) for c in snapshots.values()):
+            first = now
+        if all_ is None and len(snapshots) == len(survivors) and all(noticed(c) for c in snapshots.values()):
+            all_ = now
+        if all_ is not None and healed is None and len(snapshots) == len(survivors) and stored(snapshots) >= wanted:
+            healed = now
+        if healed is not None:
+            break
+        time.sleep(config.TELEMETRY_INTERVAL / 4)
+
+    snapshots = telemetry.snapshots(survivors)
+    failure.update({
+        'detect_first_s': round(first, 3) if first is not None else None,
+        'detect_all_s': round(all_, 3) if all_ is not None else None,
+        'heal_s': round(healed, 3) if healed is not None else None,
+        'copies_wanted': wanted,
+        'copies_stored': stored(snapshots),
+    })
+    return failure
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline: dict, results: dict):
+    """Print the change of the main metrics against an earlier results file, per cluster size."""
+    before = {run['cells']: run for run in baseline.get('runs', [])}
+    print(f"{Fore.CYAN}Against {baseline.get('commit') or 'baseline'}:{Style.RESET_ALL}")
+    for run in results['runs']:
+        old = before.get(run['cells'])
+        if old is None:
+            continue
+        print(f"  {run['cells']} cells")
+        for section, key, higher_is_better in COMPARED:
+            a = (old.get(section) or {}).get(key)
+            b = (run.get(section) or {}).get(key)
+            if a is None or b is None:
+                continue
+            if not a:
+                print(f"    {section}.{key:<16} {a:>14} -> {b}")
+                continue
+            change = (b - a) / a * 100
+            better = change > 0 if higher_is_better else change < 0
+            color = Fore.GREEN if better else Fore.RED if change else ''
+            print(f"    {section}.{key:<16} {a:>14} -> {b:<14} {color}{change:+.1f}%{Style.RESET_ALL}")
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark upload, read, failure detection and healing")
+    parser.add_argument("--cells", type=int, nargs="+", default=[4], help="cluster sizes to run, e.g. 4 16 64 128")
+    parser.add_argument("--per-process", type=int, default=1,
+                        help="cells per process (above 1 they share an asyncio event loop)")
+    parser.add_argument("--size", default="8M", help="dataset size (e.g. 512K, 8M, 1G)")
+    parser.add_argument("--chunk-size", default="64K", help="chunk size (the average with --chunking cdc)")
+    parser.add_argument("--data", choices=['random', 'text'], default='random', help="generated dataset")
+    parser.add_argument("--compression", default=None, help=f"codec (default {config.COMPRESSION_CODEC})")
+    parser.add_argument("--chunking", default=None, help=f"fixed or cdc (default {config.CHUNKING})")
+    parser.add_argument("--erasure", action="store_true", help="store erasure-coded shards instead of replicas")
+    parser.add_argument("--reads", type=int, default=200, help="random range reads timed")
+    parser.add_argument("--read-size", default="64K", help="bytes per range read")
+    parser.add_argument("--kill", type=int, default=1, help="cells killed to time detection and healing (0: skip)")
+    parser.add_argument("--no-wait-roles", dest="wait_roles", action="store_false",
+                        help="start measuring before the cells differentiate")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--heal-timeout", type=float, default=60.0)
+    parser.add_argument("--telemetry-interval", type=float, default=0.1, help="seconds between cell snapshots")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+    args.size = parse_size(args.size)
+    args.chunk_size = parse_size(args.chunk_size)
+    args.read_size = parse_size(args.read_size)
+    config.TELEMETRY_INTERVAL = args.telemetry_interval # Passed on to the cells' environment
+
+    data = make_dataset(args.size, args.data, args.seed)
+    results = {
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'config': {'replication_factor': config.REPLICATION_FACTOR, 'swim_probe_interval': config.SWIM_PROBE_INTERVAL,
+                   'swim_suspicion_timeout': config.SWIM_SUSPICION_TIMEOUT, 'protocol': PROTOCOL_VERSION},
+        'runs': [],
+    }
+    for cells in args.cells:
+        results['runs'].append(run(cells, args, data))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+        print(f"{Fore.GREEN}- Results written to {args.output}{Style.RESET_ALL}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+import hashlib
+from typing import BinaryIO, Iterator, List, Optional
+
+import numpy as np
+
+# Content-defined chunking (FastCDC). Boundaries are cut where a rolling gear
+# hash of the last 32 bytes matches a mask, so they depend on the content
+# around them, not on their offset: inserting or deleting bytes only changes
+# the chunks next to the edit, and the rest of the file keeps its chunk ids.
+#
+# The gear hash h[i] = (h[i-1] << 1) + GEAR[byte i] (mod 2^32) only depends on
+# the last 32 bytes, so it is computed for a whole buffer at once:
+#   h[i] = sum over j < 32 of GEAR[byte i-j] << j
+# is built by doubling the window (2, 4, 8, 16, 32 bytes) in five NumPy
+# passes, and the masks are tested on every position in one vectorized step.
+
+# 256 fixed pseudo-random 32-bit values; every client must cut the same way
+GEAR = np.frombuffer(b"".join(hashlib.sha256(bytes([i])).digest()[:4] for i in range(256)),
+                     dtype=">u4").astype(np.uint32)
+
+WINDOW = 32 # bytes a boundary depends on
+
+# Bytes read from a stream per boundary scan (at least two maximum chunks)
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def gear_hashes(data: bytes) -> np.ndarray:
+    """Gear hash at every position of data (window clipped at the start)."""
+    h = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    width = 1
+    while width < WINDOW:
+        h[width:] += h[:-width] << np.uint32(width)
+        width *= 2
+    return h
+
+
+def _mask(bits: int) -> np.uint32:
+    # Top bits of the hash: they depend on the whole 32-byte window
+    return np.uint32(((1 << bits) - 1) << (32 - bits))
+
+
+class Chunker:
+    """Splits data into chunks of min_size..max_size bytes, avg_size on average.
+
+    Normalized chunking, as in FastCDC: before the average size a boundary
+    needs a harder mask (2 more bits), after it an easier one (2 fewer), which
+    pulls chunk sizes towards the average.
+    """
+
+    def __init__(self, avg_size: int, min_size: Optional[int] = None, max_size: Optional[int] = None):
+        self.avg_size = avg_size
+        self.min_size = min_size if min_size is not None else avg_size // 4
+        self.max_size = max_size if max_size is not None else avg_size * 4
+        if not WINDOW <= self.min_size <= self.avg_size <= self.max_size:
+            raise ValueError(f"content-defined chunk sizes need {WINDOW} <= min <= avg <= max, "
+                             f"got {self.min_size}/{self.avg_size}/{self.max_size}")
+        bits = max(3, min(28, round(np.log2(avg_size))))
+        self.mask_small = _mask(bits + 2)
+        self.mask_large = _mask(bits - 2)
+        self.block_size = max(BLOCK_SIZE, 2 * self.max_size)
+
+    def split(self, data: bytes, final: bool = True) -> List[int]:
+        """End offsets of the chunks in data.
+
+        Unless final, the bytes after the last offset are left over: their
+        boundary may depend on data not seen yet.
+        """
+        size = len(data)
+        if not size:
+            return []
+        h = gear_hashes(data)
+        small = np.flatnonzero((h & self.mask_small) == 0)
+        large = np.flatnonzero((h & self.mask_large) == 0)
+
+        def first(hits: np.ndarray, lo: int, hi: int) -> Optional[int]:
+            k = int(np.searchsorted(hits, lo))
+            return int(hits[k]) if k < len(hits) and hits[k] < hi else None
+
+        ends = []
+        pos = 0
+        while pos < size:
+            # A chunk ending at e means a match on its last byte, e - 1
+            hit = first(small, pos + self.min_size - 1, min(pos + self.avg_size - 1, size))
+            if hit is None:
+                hit = first(large, pos + self.avg_size - 1, min(pos + self.max_size - 1, size))
+            if hit is not None:
+                end = hit + 1
+            elif pos + self.max_size <= size:
+                end = pos + self.max_size
+            elif final:
+                end = size
+            else:
+                break
+            ends.append(end)
+            pos = end
+        return ends
+
+    def iter_chunks(self, stream: BinaryIO) -> Iterator[bytes]:
+        """Read a stream block by block and yield its chunks in order."""
+        buffer = b""
+        while True:
+            block = stream.read(self.block_size)
+            final = not block
+            buffer = buffer + block if buffer else block
+            if not buffer:
+                return
+            start = 0
+            view = memoryview(buffer)
+            for end in self.split(buffer, final):
+                yield bytes(view[start:end])
+                start = end
+            view.release()
+            buffer = buffer[start:] # Carried over: starts at a chunk start
+            if final:
+                return
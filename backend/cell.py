@@ -1,56 +1,148 @@
 import time
+import hashlib
 import threading
 import random
-import hashlib
 import os
-import json
+from concurrent.futures import Executor, ThreadPoolExecutor
 from typing import Dict, List, Set, Optional
 from network import UDPNetwork
+from manifest_store import ManifestStore
+from segment_store import SegmentStore, FLAG_SHARD
+from cache import LRUCache
+from verifier import Verifier
+from metrics import Registry, COUNT_BUCKETS
+from scrubber import Scrubber, TICK_INTERVAL as SCRUB_TICK_INTERVAL
+import config
+import placement
+import erasure
+import codec
+import tracing
+from merkle import MerkleTree, children, depth_for, DEPTH as MERKLE_DEPTH
+from membership import Membership
+from protocol import PROTOCOL_JSON, PROTOCOL_VERSION, type_label
 from colorama import init, Fore, Style
 
 init(autoreset=True)
 
+HEARTBEAT_INTERVAL = 2 # seconds; legacy heartbeats and HAVE announcements
+DIFFERENTIATION_DELAY = 10 # seconds a cell stays a STEM cell
+MEMBERSHIP_WORKERS = 2 # threads healing / syncing after membership changes
+
 class Cell:
-    def __init__(self, cell_id: str, port: int, neighbors: List[int]):
+    def __init__(self, cell_id: str, port: int, neighbors: List[int], background_threads: bool = True):
         self.cell_id = cell_id
         self.port = port
         self.neighbors = neighbors
-        self.network = UDPNetwork(port)
+        self.metrics = Registry() # Shipped to the manager with the telemetry snapshots
+        self.network = UDPNetwork(port, metrics=self.metrics)
+        if config.TELEMETRY_PORT:
+            self.network.peer_versions[config.TELEMETRY_PORT] = PROTOCOL_VERSION # The manager speaks binary
         
         # Persistence
         self.storage_dir = f"storage_{port}"
         os.makedirs(self.storage_dir, exist_ok=True)
         
         # Storage (Metadata in RAM, Data on Disk)
-        self.chunks: Dict[str, str] = {} # chunk_id -> hex_data (Cache/Index)
-        self.chunk_metadata: Dict[str, dict] = {} # chunk_id -> metadata
+        # Chunks are content-addressed: chunk_id is the sha256 of the chunk bytes
+        # chunk bytes live in append-only segments; without background threads
+        # the owner (e.g. the asyncio runtime) schedules fsync and compaction
+        self.store = SegmentStore(self.storage_dir, background=background_threads, metrics=self.metrics)
+        self.chunk_metadata: Dict[str, dict] = {} # chunk_id -> metadata (no data)
+        # Messages are handled on several threads (verifier callbacks, the asyncio
+        # runtime's executor): this serializes the check-then-act updates of
+        # chunk_metadata and the manifests (STORE dedup, MANIFEST, DELETE, GC)
+        self.data_lock = threading.RLock()
+        self.cache = LRUCache(config.CACHE_MAX_BYTES) # hot chunk bytes, loaded on demand
+        self.manifests = ManifestStore(os.path.join(self.storage_dir, "manifests"))
+        self.verifier = Verifier(metrics=self.metrics) # Integrity checks off the receive path (started by GUARD cells)
+        self.tracer = tracing.get_tracer(f"cell-{port}", pid=port) # Spans of traced STOREs (see tracing.py)
+        
+        # Replica tracking: which cells hold each of our chunks (self included)
+        self.chunk_holders: Dict[str, Set[int]] = {}
+        self.pending_have: Set[str] = set() # chunk ids to announce to their other holders
+        self.holders_lock = threading.Lock()
+        
+        # Chunk bytes fetched from other cells (stripe rebuilds), keyed by chunk id
+        self.fetched: Dict[str, Optional[bytes]] = {}
+        self.fetch_cond = threading.Condition()
+
+        # Membership events start healing and anti-entropy, which read chunks
+        # from disk and send them; they run here, so SWIM's probes and acks are
+        # never held up. Without background threads the owner hands in its
+        # executor (see async_runtime.py)
+        self.owns_executor = background_threads
+        self.executor: Optional[Executor] = ThreadPoolExecutor(max_workers=MEMBERSHIP_WORKERS) if background_threads else None
         
         self.load_from_disk()
+
+        # Chunks waiting out GC_GRACE_PERIOD before being reclaimed (chunk id -> unreferenced since).
+        # After a restart every unreferenced chunk starts waiting: its manifest may still be on its way
+        self.gc_pending: Dict[str, float] = {chunk_id: time.time() for chunk_id in self.chunk_metadata
+                                             if not self.manifests.is_referenced(chunk_id)}
+        
+        # Integrity: stored chunks are re-verified in the background, rate limited
+        self.scrubber = Scrubber(self.store, os.path.join(self.storage_dir, "scrub.state"), on_corrupt=self.repair_chunk,
+                                 metrics=self.metrics)
         
         # State
         self.alive_neighbors: Set[int] = set(neighbors)
         self.blacklist: Set[int] = set() # Nodes to ignore (Isolation)
-        self.last_heartbeat: Dict[int, float] = {n: time.time() for n in neighbors}
         self.running = True
         self.role = "STEM"
+        self.guards: List[int] = [] # GUARD cells, each verifying one range of hash space
+        self.verify_forwarded = 0
+        self.chunks_served = 0 # REQUESTs answered with a chunk (load, for the telemetry view)
         self.start_time = time.time()
+        self.metrics_reported_at = 0.0 # Last telemetry push that carried the metrics registry
+
+        # Metrics of the hot paths (the network, store and verifier record their own)
+        self.handle_seconds = self.metrics.histogram('cellsync_handle_seconds', 'Time to handle a message, by type')
+        self.store_put_seconds = self.metrics.histogram('cellsync_store_put_seconds', 'Time to persist a new chunk')
+        self.heal_seconds = self.metrics.histogram('cellsync_heal_seconds', 'Time to re-replicate the chunks of a dead cell')
+        self.replicate_fanout = self.metrics.histogram('cellsync_replicate_fanout', 'Chunk copies sent per heal or REPLICATE',
+                                                       buckets=COUNT_BUCKETS)
+        self.replicated = self.metrics.counter('cellsync_replicated_chunks_total', 'Chunk copies sent to restore redundancy, by cause')
+        self.metrics.gauge('cellsync_chunks', 'Chunks stored', lambda: len(self.chunk_metadata))
+        self.metrics.gauge('cellsync_alive_neighbors', 'Neighbors believed alive', lambda: len(self.alive_neighbors))
+        self.metrics.gauge('cellsync_cache_bytes', 'Bytes in the chunk cache', lambda: self.cache.stats()['bytes'])
+        self.metrics.gauge('cellsync_verify_queue_depth', 'Chunks waiting for verification', self.verifier.queue_depth)
+        
+        # Failure detection: SWIM probes, with membership updates piggybacked on all traffic
+        self.membership = Membership(port, neighbors, self.network.send_message,
+                                     on_alive=self.on_member_alive, on_dead=self.on_member_dead)
+        self.network.piggyback = self.membership.take_updates
         
         # Threads
         self.threads = []
 
     def load_from_disk(self):
-        """Load existing chunks from disk on startup."""
-        if os.path.exists(self.storage_dir):
-            for filename in os.listdir(self.storage_dir):
-                if filename.endswith(".json"):
-                    try:
-                        with open(os.path.join(self.storage_dir, filename), 'r') as f:
-                            data = json.load(f)
-                            chunk_id = data.get('id')
-                            self.chunks[chunk_id] = data.get('data')
-                            self.chunk_metadata[chunk_id] = data
-                    except Exception as e:
-                        print(f"Error loading {filename}: {e}")
+        """Load the chunk index on startup (chunk data stays on disk)."""
+        # MIGRATION: older cells kept one JSON file per chunk
+        migrated = self.store.migrate_json_dir(self.storage_dir)
+        if migrated:
+            print(f"Cell-{self.port} migrated {migrated} chunk files into segment storage")
+        for chunk_id, entry in self.store.entries():
+            shard = bool(entry.flags & FLAG_SHARD)
+            self.chunk_metadata[chunk_id] = {'id': chunk_id, 'hash': entry.hash, 'size': entry.length, 'shard': shard,
+                                             'codec': codec.from_flags(entry.flags)}
+            self.chunk_holders[chunk_id] = {self.port}
+            # Holder knowledge is not persisted; re-announce everything we have (shards have no other holders)
+            if not shard:
+                self.pending_have.add(chunk_id)
+
+    def read_chunk(self, chunk_id: str) -> Optional[dict]:
+        """Load a stored chunk (metadata plus bytes), through the LRU cache."""
+        data = self.cache.get(chunk_id)
+        if data is None:
+            data = self.store.get(chunk_id)
+            if data is None:
+                return None
+            self.cache.put(chunk_id, data)
+        meta = self.chunk_metadata[chunk_id]
+        chunk = {'id': chunk_id, 'hash': meta['hash'], 'data': data}
+        if meta.get('codec', codec.NONE) != codec.NONE:
+            chunk['codec'] = meta['codec'] # Served as stored; the reader inflates it
+        return chunk
 
     def start(self):
         """Start all cell processes."""
@@ -58,10 +150,13 @@ class Cell:
         
         t_listen = threading.Thread(target=self.listen_loop)
         t_heartbeat = threading.Thread(target=self.heartbeat_loop)
-        t_check_dead = threading.Thread(target=self.check_dead_neighbors_loop)
+        t_membership = threading.Thread(target=self.membership_loop)
         t_differentiate = threading.Thread(target=self.differentiation_loop)
+        t_anti_entropy = threading.Thread(target=self.anti_entropy_loop)
+        t_scrub = threading.Thread(target=self.scrub_loop)
+        t_telemetry = threading.Thread(target=self.telemetry_loop)
         
-        self.threads = [t_listen, t_heartbeat, t_check_dead, t_differentiate]
+        self.threads = [t_listen, t_heartbeat, t_membership, t_differentiate, t_anti_entropy, t_scrub, t_telemetry]
         for t in self.threads:
             t.daemon = True
             t.start()
@@ -75,6 +170,11 @@ class Cell:
     def stop(self):
         self.running = False
         self.network.close()
+        self.verifier.close()
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
+        self.scrubber.close()
+        self.store.close()
         print(f"{Fore.RED}🔴 Cell-{self.port} STOPPED{Style.RESET_ALL}")
 
     def listen_loop(self):
@@ -86,6 +186,13 @@ class Cell:
                 self.handle_message(payload)
 
     def handle_message(self, payload: dict):
+        started = time.perf_counter()
+        try:
+            self.dispatch_message(payload)
+        finally:
+            self.handle_seconds.observe(time.perf_counter() - started, {'type': type_label(payload.get('type'))})
+
+    def dispatch_message(self, payload: dict):
         msg_type = payload.get('type')
         sender = payload.get('sender_port')
         data = payload.get('data')
@@ -94,52 +201,140 @@ class Cell:
         if sender in self.blacklist:
             return
 
+        # MEMBERSHIP: apply piggybacked gossip; any message from a member proves it is alive
+        if payload.get('gossip'):
+            self.membership.merge(payload['gossip'])
+        if self.membership.handle(msg_type, sender, data or {}):
+            return
+        self.membership.heard_from(sender)
+
         if msg_type == 'HEARTBEAT':
-            self.last_heartbeat[sender] = time.time()
-            self.alive_neighbors.add(sender)
+            # Legacy peers (JSON protocol) still heartbeat instead of answering probes
+            self.membership.heard_from(sender, join=True)
             
         elif msg_type == 'STORE':
-            chunk_id = data.get('id')
-            
-            # GUARD LOGIC: Check for corruption if we are a GUARD
-            if self.role == "GUARD":
-                chunk_data_hex = data.get('data')
-                expected_hash = data.get('hash')
-                try:
-                    chunk_bytes = bytes.fromhex(chunk_data_hex)
-                    actual_hash = hashlib.sha256(chunk_bytes).hexdigest()
-                    actual_hash = hashlib.sha256(chunk_bytes).hexdigest()
-                    if actual_hash != expected_hash:
-                        print(f"{Fore.MAGENTA}🛡️  GUARD-{self.port}: {Fore.RED}⚠️  CORRUPTION DETECTED from Cell-{sender}{Style.RESET_ALL}")
-                        # Broadcast alert to isolate the sender
-                        self.network.broadcast(list(self.alive_neighbors), 'ALERT', {'culprit': sender, 'chunk': chunk_id})
-                        return # Reject storage
-                except Exception as e:
-                    print(f"Error verifying chunk: {e}")
-
-            self.chunks[chunk_id] = data.get('data')
-            self.chunk_metadata[chunk_id] = data
-            
-            # PERSISTENCE: Save to disk
-            with open(os.path.join(self.storage_dir, f"{chunk_id}.json"), 'w') as f:
-                json.dump(data, f)
+            chunk_id = data.get('hash') or data.get('id')
+            trace = payload.get('trace')
             
-            # print(f"💾 Cell-{self.port} stored chunk {chunk_id}")
+            # GUARD LOGIC: Check for corruption if we are a GUARD. Hashing runs on
+            # the verifier's worker pool; the chunk is stored once it checks out.
+            # Only an exact copy of a chunk we already hold skips the hash
+            if self.role == "GUARD" and not self.matches_stored(chunk_id, data):
+                span = self.tracer.start('verify', trace, chunk=chunk_id) if trace else None
+
+                def verified(ok: bool):
+                    if span:
+                        span.end(ok=ok)
+                    if ok:
+                        self.store_chunk(sender, data, chunk_id, trace)
+                    else:
+                        self.reject_chunk(sender, data, chunk_id, trace)
+
+                self.verifier.submit(chunk_id, data.get('hash'), data.get('data'), verified, data.get('codec'))
+                return
+            if self.store_chunk(sender, data, chunk_id, trace):
+                self.forward_to_guard(sender, data, chunk_id, trace)
+            elif chunk_id in self.chunk_metadata and not self.matches_stored(chunk_id, data):
+                # Other bytes under the id of a chunk we hold: ours stays, but the guard judges the sender
+                self.forward_to_guard(sender, data, chunk_id, trace, stored=False)
+
+        elif msg_type == 'VERIFY':
+            # A storage cell forwarded a chunk from our hash range; if it is
+            # corrupt, blame the cell that sent it the bytes, and tell the
+            # storage cell so it replaces its copy
+            chunk_id = data.get('hash') or data.get('id')
+            origin = data.get('origin', sender)
+            span = self.tracer.start('verify', payload['trace'], chunk=chunk_id, forwarded=True) if payload.get('trace') else None
+
+            def verified(ok: bool):
+                if span:
+                    span.end(ok=ok)
+                if not ok:
+                    self.reject_chunk(origin, data, chunk_id)
+                    if data.get('stored', True):
+                        self.network.send_message(sender, 'VERIFY_RESULT', {'id': chunk_id, 'ok': False})
+
+            self.verifier.submit(chunk_id, data.get('hash'), data.get('data'), verified, data.get('codec'))
             
+        elif msg_type == 'VERIFY_RESULT':
+            # A GUARD found the copy we forwarded corrupt: we stored those bytes
+            chunk_id = data.get('id')
+            if not data.get('ok') and chunk_id in self.chunk_metadata:
+                self.scrubber.expect_repair(chunk_id) # The replacement must check out (see store_chunk)
+                self.repair_chunk(chunk_id, cause="GUARD")
+
         elif msg_type == 'REQUEST':
             chunk_id = data.get('chunk_id')
             requestor = data.get('requestor_port')
-            if chunk_id in self.chunks:
-                self.network.send_message(requestor, 'STORE', self.chunk_metadata[chunk_id])
+            chunk = self.read_chunk(chunk_id) if chunk_id in self.chunk_metadata else None
+            if chunk:
+                self.chunks_served += 1
+            if data.get('reply') == 'CHUNK':
+                # Read path: a client wants the bytes back, not a replica. Say so
+                # when we lack the chunk, so it can ask another holder right away
+                self.network.send_message(requestor, 'CHUNK', chunk or {'id': chunk_id, 'missing': True})
+            elif chunk:
+                self.network.send_message(requestor, 'STORE', chunk, trace=self.trace_copy(chunk_id, 'request'))
                 
         elif msg_type == 'REPLICATE':
             # A neighbor died, we need to check if we hold chunks that need replication
-            # For simplicity in this demo, if we receive a REPLICATE request, 
-            # we broadcast our chunks to the sender so they can restore redundancy
-            # In a real system, this would be more targeted.
+            # If we receive a REPLICATE request, we send the sender the chunks
+            # that placement now assigns to it, so it can restore redundancy
             target_port = sender
-            for chunk_data in self.chunk_metadata.values():
-                self.network.send_message(target_port, 'STORE', chunk_data)
+            sent = 0
+            for chunk_id in list(self.chunk_metadata):
+                if self.is_shard(chunk_id) or target_port not in self.replica_set(chunk_id):
+                    continue
+                chunk = self.read_chunk(chunk_id)
+                if chunk:
+                    self.network.send_message(target_port, 'STORE', chunk, trace=self.trace_copy(chunk_id, 'replicate'))
+                    sent += 1
+            self.replicate_fanout.observe(sent, {'cause': 'replicate'})
+            self.replicated.inc(sent, {'cause': 'replicate'})
+                
+        elif msg_type == 'CHUNK':
+            # Reply to fetch_chunks (stripe rebuilds): keep intact copies we asked for
+            chunk_id = data.get('id')
+            chunk_bytes = data.get('data')
+            if chunk_id in self.fetched and chunk_bytes is not None and hashlib.sha256(chunk_bytes).hexdigest() == chunk_id:
+                with self.fetch_cond:
+                    if chunk_id in self.fetched:
+                        self.fetched[chunk_id] = chunk_bytes
+                        self.fetch_cond.notify_all()
+
+        elif msg_type == 'HAVE':
+            # A peer announces chunks it holds; we only track holders of our own chunks
+            with self.holders_lock:
+                for chunk_id in data.get('chunks', []):
+                    if chunk_id in self.chunk_holders:
+                        self.chunk_holders[chunk_id].add(sender)
+
+        elif msg_type == 'SYNC':
+            self.handle_sync(sender, data)
+
+        elif msg_type == 'SYNC_IDS':
+            self.handle_sync_ids(sender, data)
+
+        elif msg_type == 'MANIFEST':
+            # Stale copies (reordered, or pushed by a peer that is behind) are ignored
+            with self.data_lock:
+                if self.manifests.is_newer(data):
+                    self.collect_garbage(self.manifests.put(data))
+            if sender not in self.membership.members:
+                # Uploaders retry until every cell has the manifest
+                self.network.send_message(sender, 'MANIFEST_ACK', {'filename': data.get('filename'), 'version': data.get('version')})
+
+        elif msg_type == 'MANIFEST_SYNC':
+            self.handle_manifest_sync(sender, data)
+
+        elif msg_type == 'GET_MANIFEST':
+            filename = data.get('filename')
+            self.network.send_message(sender, 'MANIFEST_REPLY', {'filename': filename, 'manifest': self.manifests.get(filename)})
+
+        elif msg_type == 'DELETE':
+            with self.data_lock:
+                released = self.manifests.delete(data.get('filename'), data.get('version'))
+                self.collect_garbage(released)
                 
         elif msg_type == 'ALERT':
             culprit = data.get('culprit')
@@ -151,54 +346,560 @@ class Cell:
             print(f"{Fore.BLUE}- Cell-{self.port} Installing Firmware Update v2.0...{Style.RESET_ALL}")
             time.sleep(1)
             # Simulate a bug: Corrupt our own data
-            if self.chunks:
-                target_id = list(self.chunks.keys())[0]
-                self.chunks[target_id] = "deadbeef" * 10
+            if self.chunk_metadata:
+                target_id = list(self.chunk_metadata.keys())[0]
+                corrupted = dict(self.chunk_metadata[target_id], data=b"\xde\xad\xbe\xef" * 10)
+                self.store.put(target_id, corrupted['data'], corrupted['hash'])
+                self.cache.invalidate(target_id)
                 print(f"{Fore.YELLOW}⚠️  Cell-{self.port} UPDATE FAILED: Memory Corruption Detected!{Style.RESET_ALL}")
                 print(f"{Fore.YELLOW}- Cell-{self.port} BUG ACTIVATED: Broadcasting corrupted data...{Style.RESET_ALL}")
                 # Trigger a sync so the network notices
-                self.network.broadcast(list(self.alive_neighbors), 'STORE', self.chunk_metadata[target_id])
+                self.network.broadcast(list(self.alive_neighbors), 'STORE', corrupted)
+
+    def store_chunk(self, sender: int, data: dict, chunk_id: str, trace: Optional[list] = None) -> bool:
+        """Keep a chunk sent to us (STORE), unless we already have it. True if its bytes were stored."""
+        with self.data_lock:
+            return self._store_chunk(sender, data, chunk_id, trace)
+
+    def _store_chunk(self, sender: int, data: dict, chunk_id: str, trace: Optional[list]) -> bool:
+        span = self.tracer.start('store', trace, chunk=chunk_id, source=sender) if trace else None
+        # REPLICA TRACKING: the uploader names the replica set, and a cell
+        # sending us a chunk is itself a holder
+        holders = set(data.get('replicas') or [])
+        if sender in self.membership.members:
+            holders.add(sender)
+        holders.add(self.port)
+        with self.holders_lock:
+            self.chunk_holders.setdefault(chunk_id, set()).update(holders)
+
+        # DEDUPLICATION: identical content is stored (and replicated) once
+        if chunk_id in self.chunk_metadata:
+            if span:
+                self.trace_durable(chunk_id, span, known=True)
+            self.ack_store(sender, data, chunk_id, known=True, trace=trace)
+            return False
+
+        # REPAIR: a replacement for a chunk the scrubber found corrupt must itself be intact
+        chunk_bytes = data.get('data')
+        chunk_codec = data.get('codec', codec.NONE)
+        if self.scrubber.is_repairing(chunk_id) and not codec.matches(chunk_bytes, chunk_codec, data.get('hash')):
+            if span:
+                span.end(ok=False)
+            return False
+        if not codec.available(chunk_codec):
+            print(f"{Fore.RED}❌ Cell-{self.port} cannot store chunk {chunk_id[:8]}: codec {chunk_codec} is not installed{Style.RESET_ALL}")
+            if span:
+                span.end(ok=False)
+            self.ack_store(sender, data, chunk_id, ok=False, trace=trace)
+            return False
+
+        # PERSISTENCE: Append raw bytes to the segment store (fsync is batched).
+        # Write-around: the cache only fills on reads, so uploads do not evict hot chunks.
+        # Only content-level fields are kept; which files use a chunk lives in the manifests
+        # Erasure-coded shards are single copies: flagged, and never announced or replicated
+        # Compressed chunks stay compressed on disk; the codec goes into the index flags
+        shard = bool(data.get('shard'))
+        started = time.perf_counter()
+        self.store.put(chunk_id, chunk_bytes, data.get('hash'), (FLAG_SHARD if shard else 0) | codec.to_flags(chunk_codec))
+        self.store_put_seconds.observe(time.perf_counter() - started)
+        self.chunk_metadata[chunk_id] = {'id': chunk_id, 'hash': data.get('hash'), 'size': len(chunk_bytes), 'shard': shard,
+                                         'codec': chunk_codec}
+        if not shard:
+            with self.holders_lock:
+                self.pending_have.add(chunk_id)
+        self.scrubber.note_stored(chunk_id)
+        if span:
+            self.trace_durable(chunk_id, span)
+        self.ack_store(sender, data, chunk_id, trace=trace)
+        return True
+
+    def reject_chunk(self, sender: int, data: dict, chunk_id: str, trace: Optional[list] = None):
+        """A GUARD found a chunk whose bytes do not match its hash: isolate the sender."""
+        print(f"{Fore.MAGENTA}🛡️  GUARD-{self.port}: {Fore.RED}⚠️  CORRUPTION DETECTED from Cell-{sender}{Style.RESET_ALL}")
+        # Broadcast alert to isolate the sender
+        self.network.broadcast(list(self.alive_neighbors), 'ALERT', {'culprit': sender, 'chunk': chunk_id})
+        self.ack_store(sender, data, chunk_id, ok=False, trace=trace)
+
+    def forward_to_guard(self, sender: int, data: dict, chunk_id: str, trace: Optional[list] = None, stored: bool = True):
+        """Send (a sample of) newly stored chunks to the GUARD owning their hash range.
+
+        Only the chunk's primary replica forwards, so a chunk crosses to its
+        guard once rather than once per replica. Bytes we did not store
+        (they differ from our copy of the chunk) are always forwarded.
+        """
+        if not self.guards:
+            return
+        if stored and (random.random() >= config.VERIFY_SAMPLE_RATE or self.replica_set(chunk_id)[0] != self.port):
+            return
+        guard = placement.guard_for(chunk_id, [g for g in self.guards if g in self.alive_neighbors])
+        if guard is None or guard == sender:
+            return
+        verify = {'id': chunk_id, 'hash': data.get('hash'), 'data': data.get('data'), 'origin': sender}
+        if data.get('codec'):
+            verify['codec'] = data['codec']
+        if not stored:
+            verify['stored'] = False # Nothing to repair on our side
+        self.network.send_message(guard, 'VERIFY', verify, trace=trace)
+        self.verify_forwarded += 1
+
+    def matches_stored(self, chunk_id: str, data: dict) -> bool:
+        """Whether a received chunk is byte for byte (and codec) the copy we hold."""
+        meta = self.chunk_metadata.get(chunk_id)
+        if meta is None or meta.get('codec', codec.NONE) != data.get('codec', codec.NONE):
+            return False
+        # Straight from the store: a duplicate STORE is no read, and must not churn the cache
+        return self.store.get(chunk_id) == data.get('data')
+
+    def ack_store(self, sender: int, data: dict, chunk_id: str, ok: bool = True, known: bool = False,
+                  trace: Optional[list] = None):
+        """Answer an uploader that asked for an acknowledgement of its STORE."""
+        # The chunk is in the segment store (page cache) at this point; the
+        # batched fsync makes it durable within FSYNC_INTERVAL
+        if data.get('ack'):
+            ack = {'id': chunk_id, 'ok': ok}
+            if known:
+                ack['known'] = True # Already stored (e.g. by an earlier version of the file)
+            self.network.send_message(sender, 'STORE_ACK', ack, trace=trace)
+
+    # --- Tracing -----------------------------------------------------------
+
+    def trace_durable(self, chunk_id: str, span: tracing.Span, known: bool = False):
+        """Close a traced STORE's span, and time its copy until the group commit makes it durable."""
+        span.end(known=known)
+        self.tracer.remember(chunk_id, span.context())
+        durable = self.tracer.start('durable', span.context(), chunk=chunk_id)
+        self.store.when_durable(durable.end)
+
+    def trace_copy(self, chunk_id: str, cause: str) -> Optional[list]:
+        """Context for a copy of a traced chunk sent to restore redundancy (None if untraced)."""
+        context = self.tracer.context_of(chunk_id)
+        if context is None:
+            return None
+        span = self.tracer.start(cause, context, chunk=chunk_id)
+        span.end()
+        return span.context()
+
+    def collect_garbage(self, chunk_ids: List[str]):
+        """Schedule chunks whose last manifest reference was dropped for deletion.
+
+        This cell may have missed a manifest that still uses them, so they
+        are only reclaimed GC_GRACE_PERIOD later (reclaim_garbage), if no
+        manifest learned meanwhile refers to them.
+        """
+        now = time.time()
+        for chunk_id in chunk_ids:
+            if chunk_id in self.chunk_metadata:
+                self.gc_pending.setdefault(chunk_id, now)
+
+    def reclaim_garbage(self):
+        """Delete the chunks still unreferenced a grace period after their last reference went."""
+        cutoff = time.time() - config.GC_GRACE_PERIOD
+        with self.data_lock:
+            for chunk_id, since in list(self.gc_pending.items()):
+                if since > cutoff:
+                    continue
+                del self.gc_pending[chunk_id]
+                if self.manifests.is_referenced(chunk_id) or chunk_id not in self.chunk_metadata:
+                    continue
+                del self.chunk_metadata[chunk_id]
+                self.store.delete(chunk_id) # Space is reclaimed by segment compaction
+                self.cache.invalidate(chunk_id)
+                with self.holders_lock:
+                    self.chunk_holders.pop(chunk_id, None)
+                    self.pending_have.discard(chunk_id)
+
+    def repair_chunk(self, chunk_id: str, cause: str = "SCRUB"):
+        """Drop a chunk found corrupt (by the scrubber, or a GUARD) and fetch a healthy copy from another holder."""
+        print(f"{Fore.YELLOW}⚠️  Cell-{self.port} {cause}: chunk {chunk_id[:8]} is corrupt, repairing{Style.RESET_ALL}")
+        with self.data_lock:
+            shard = self.is_shard(chunk_id)
+            # Stop serving it at once, so REQUEST / REPLICATE / anti-entropy cannot spread the rot
+            self.chunk_metadata.pop(chunk_id, None)
+            self.store.delete(chunk_id)
+            self.cache.invalidate(chunk_id)
+        if shard:
+            # A shard has no replicas: recompute it from the rest of its stripe
+            self.rebuild_in_background(self.stripe_jobs(chunk_id)[:1])
+            return
+        with self.holders_lock:
+            holders = self.chunk_holders.get(chunk_id, set())
+            holders.discard(self.port)
+            sources = [h for h in holders if h in self.alive_neighbors]
+        if not sources:
+            sources = [n for n in self.replica_set(chunk_id) if n != self.port]
+        for source in sources[:2]:
+            self.network.send_message(source, 'REQUEST', {'chunk_id': chunk_id, 'requestor_port': self.port})
+
+    def is_shard(self, chunk_id: str) -> bool:
+        return self.chunk_metadata.get(chunk_id, {}).get('shard', False)
+
+    def replica_set(self, chunk_id: str) -> List[int]:
+        """Cells that should hold a chunk, computed locally from the current membership."""
+        return placement.replica_set(chunk_id, self.alive_neighbors | {self.port})
 
     def heartbeat_loop(self):
-        """Send heartbeats to neighbors."""
+        """Send heartbeats to legacy neighbors and announce new holdings."""
         while self.running:
-            self.network.broadcast(self.neighbors, 'HEARTBEAT')
-            time.sleep(2)
+            self.heartbeat_tick()
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def heartbeat_tick(self):
+        # Upgraded peers are covered by SWIM probes; only JSON-protocol peers need heartbeats
+        legacy = [n for n in self.neighbors if self.network.version_for(n) == PROTOCOL_JSON]
+        self.network.broadcast(legacy, 'HEARTBEAT')
+        self.announce_holdings()
 
-    def check_dead_neighbors_loop(self):
-        """Check for dead neighbors."""
+    def membership_loop(self):
+        """Drive SWIM probes and suspicion timers."""
         while self.running:
-            time.sleep(3)
-            now = time.time()
-            dead_nodes = []
-            
-            for neighbor in list(self.alive_neighbors):
-                if now - self.last_heartbeat.get(neighbor, 0) > 6: # 3 missed heartbeats (2s interval)
-                    print(f"{Fore.YELLOW}⚠️  Cell-{self.port} detected DEAD neighbor: {neighbor}{Style.RESET_ALL}")
-                    dead_nodes.append(neighbor)
-            
-            for dead in dead_nodes:
-                self.alive_neighbors.remove(dead)
-                self.trigger_healing(dead)
+            self.membership.tick()
+            time.sleep(self.membership_period())
+
+    def membership_period(self) -> float:
+        return min(self.membership.probe_interval, self.membership.probe_timeout) / 4
+
+    def on_member_alive(self, port: int):
+        if port not in self.alive_neighbors:
+            # A neighbor came (back) to life: reconcile with it right away
+            self.alive_neighbors.add(port)
+            self.executor.submit(self.start_sync, port)
+
+    def on_member_dead(self, port: int):
+        if port in self.alive_neighbors:
+            print(f"{Fore.YELLOW}⚠️  Cell-{self.port} detected DEAD neighbor: {port}{Style.RESET_ALL}")
+            self.alive_neighbors.discard(port)
+            self.executor.submit(self.trigger_healing, port)
+
+    def announce_holdings(self):
+        """Tell other holders (and placement targets) about chunks we stored since the last round."""
+        with self.holders_lock:
+            pending, self.pending_have = self.pending_have, set()
+            by_peer: Dict[int, List[str]] = {}
+            for chunk_id in pending:
+                peers = self.chunk_holders.get(chunk_id, set()) | set(self.replica_set(chunk_id))
+                for peer in peers - {self.port}:
+                    by_peer.setdefault(peer, []).append(chunk_id)
+        for peer, chunk_ids in by_peer.items():
+            self.network.send_message(peer, 'HAVE', {'chunks': chunk_ids})
 
     def trigger_healing(self, dead_node: int):
-        """Trigger healing process when a node dies."""
-        # Ask surviving neighbors to send their chunks so we can ensure redundancy
-        # In this simple demo, we ask everyone to send us what they have, 
-        # and we store it if we don't have it (increasing redundancy count effectively)
+        """Re-replicate only the chunks that lost a copy on dead_node.
+
+        Every surviving holder of such a chunk runs the same deterministic
+        computation: the best-ranked survivor is the single source, and it
+        copies the chunk to the best-ranked live cells that do not hold it
+        yet, until the replication factor is met again. Heal traffic is
+        therefore proportional to the dead node's data.
+        """
         print(f"{Fore.CYAN}- Cell-{self.port} initiating healing for Node {dead_node}...{Style.RESET_ALL}")
-        self.network.broadcast(list(self.alive_neighbors), 'REPLICATE')
+        started = time.perf_counter()
+        members = self.alive_neighbors | {self.port}
+        transfers: List[tuple] = []
+        with self.holders_lock:
+            for chunk_id, holders in self.chunk_holders.items():
+                if dead_node not in holders or self.is_shard(chunk_id):
+                    continue
+                holders.discard(dead_node)
+                survivors = holders & members
+                missing = config.REPLICATION_FACTOR - len(survivors)
+                if missing <= 0:
+                    continue
+                targets = [n for n in placement.rank(chunk_id, members) if n not in survivors][:missing]
+                source = placement.rank(chunk_id, survivors)[0]
+                holders.update(targets) # All survivors agree on the new holders
+                if source == self.port and targets:
+                    transfers.append((chunk_id, targets, sorted(survivors | set(targets))))
+
+        sent = 0
+        for chunk_id, targets, replicas in transfers:
+            chunk = self.read_chunk(chunk_id)
+            if chunk:
+                for target in targets:
+                    self.network.send_message(target, 'STORE', dict(chunk, replicas=replicas),
+                                              trace=self.trace_copy(chunk_id, 'heal'))
+                    sent += 1
+        self.replicate_fanout.observe(sent, {'cause': 'heal'})
+        self.replicated.inc(sent, {'cause': 'heal'})
+        self.heal_seconds.observe(time.perf_counter() - started)
+        if transfers:
+            print(f"{Fore.CYAN}- Cell-{self.port} re-replicated {len(transfers)} under-replicated chunks{Style.RESET_ALL}")
+        self.heal_stripes(dead_node)
+
+    # --- Erasure-coded stripes -------------------------------------------
+
+    def heal_stripes(self, dead_node: int):
+        """Rebuild the erasure-coded shards that lived on dead_node.
+
+        As with replicas, every cell runs the same computation on its copy of
+        the manifests, so all agree on the new holders (and persist them).
+        Only the surviving holder of the lowest shard index of a stripe
+        rebuilds it: it gathers k shards, decodes and re-encodes the lost ones.
+        """
+        members = self.alive_neighbors | {self.port}
+        jobs = {}
+        for manifest in self.manifests.erasure_coded():
+            k, m = manifest['erasure']['k'], manifest['erasure']['m']
+            changed = False
+            for chunk_id, stripe in zip(manifest['chunks'], manifest['stripes']):
+                holders = stripe['holders']
+                lost = [i for i, holder in enumerate(holders) if holder == dead_node]
+                if not lost:
+                    continue
+                survivors = [i for i, holder in enumerate(holders) if holder in members]
+                if len(survivors) < k:
+                    print(f"{Fore.RED}❌ Cell-{self.port} stripe of chunk {chunk_id[:8]} lost {len(lost)} shards, "
+                          f"only {len(survivors)} of {k} needed survive{Style.RESET_ALL}")
+                    continue
+                # New holders: best-ranked cells without a shard of this stripe, then any (stacked)
+                used = {holders[i] for i in survivors}
+                ranked = placement.rank(chunk_id, members)
+                targets = ([n for n in ranked if n not in used] + ranked)[:len(lost)]
+                for index, target in zip(lost, targets):
+                    holders[index] = target
+                changed = True
+                if holders[survivors[0]] == self.port:
+                    jobs[tuple(stripe['shards'])] = (stripe['shards'], list(holders), k, m, lost)
+            if changed:
+                with self.data_lock:
+                    self.manifests.put(manifest)
+        self.rebuild_in_background(list(jobs.values()))
+
+    def stripe_jobs(self, shard_id: str) -> List[tuple]:
+        """Rebuild jobs for a shard of ours (e.g. found corrupt by the scrubber)."""
+        jobs = []
+        for manifest in self.manifests.erasure_coded():
+            k, m = manifest['erasure']['k'], manifest['erasure']['m']
+            for stripe in manifest['stripes']:
+                for index, (shard, holder) in enumerate(zip(stripe['shards'], stripe['holders'])):
+                    if shard == shard_id and holder == self.port:
+                        jobs.append((stripe['shards'], stripe['holders'], k, m, [index]))
+        return jobs
+
+    def rebuild_in_background(self, jobs: List[tuple]):
+        if jobs:
+            # Rebuilding waits on other cells; keep it off the listen / membership threads
+            threading.Thread(target=self.rebuild_stripes, args=(jobs,), daemon=True).start()
+
+    def rebuild_stripes(self, jobs: List[tuple]):
+        rebuilt = 0
+        for shards, holders, k, m, lost in jobs:
+            have = {}
+            for index, shard_id in enumerate(shards):
+                if index not in lost and holders[index] == self.port and shard_id in self.chunk_metadata:
+                    data = self.store.get(shard_id)
+                    if data is not None:
+                        have[index] = data
+            if len(have) < k:
+                wanted = {shards[i]: holders[i] for i in range(len(shards))
+                          if i not in have and i not in lost and holders[i] != self.port}
+                fetched = self.fetch_chunks(wanted, k - len(have))
+                for index, shard_id in enumerate(shards):
+                    if index not in lost and shard_id in fetched:
+                        have.setdefault(index, fetched[shard_id])
+            if len(have) < k:
+                print(f"{Fore.RED}❌ Cell-{self.port} could not gather {k} shards to rebuild a stripe{Style.RESET_ALL}")
+                continue
+            for index, data in erasure.reconstruct(have, k, m, lost).items():
+                shard = {'id': shards[index], 'hash': shards[index], 'data': data, 'replicas': [holders[index]], 'shard': True}
+                if holders[index] == self.port:
+                    self.store_chunk(self.port, shard, shards[index])
+                else:
+                    self.network.send_message(holders[index], 'STORE', shard)
+                rebuilt += 1
+        if rebuilt:
+            print(f"{Fore.CYAN}- Cell-{self.port} rebuilt {rebuilt} erasure-coded shards{Style.RESET_ALL}")
+
+    def fetch_chunks(self, wanted: Dict[str, int], need: int, timeout: float = None) -> Dict[str, bytes]:
+        """Ask other cells for chunks ({chunk id: port}); return once `need` intact ones arrived."""
+        timeout = timeout if timeout is not None else config.DOWNLOAD_TIMEOUT
+        with self.fetch_cond:
+            for chunk_id in wanted:
+                self.fetched.setdefault(chunk_id, None)
+        for chunk_id, port in wanted.items():
+            self.network.send_message(port, 'REQUEST', {'chunk_id': chunk_id, 'requestor_port': self.port, 'reply': 'CHUNK'})
+        deadline = time.time() + timeout
+        with self.fetch_cond:
+            while True:
+                got = {c: self.fetched[c] for c in wanted if self.fetched.get(c) is not None}
+                remaining = deadline - time.time()
+                if len(got) >= need or remaining <= 0:
+                    break
+                self.fetch_cond.wait(remaining)
+            for chunk_id in wanted:
+                self.fetched.pop(chunk_id, None)
+        return got
+
+    def sync_scope(self, peer: int) -> List[str]:
+        """Chunks we hold that placement assigns to both us and peer.
+
+        Both sides compute the same scope for the pair, so their Merkle
+        trees match exactly when neither is missing anything.
+        """
+        members = self.alive_neighbors | {self.port, peer}
+        scope = []
+        for chunk_id in list(self.chunk_metadata):
+            if self.is_shard(chunk_id):
+                continue # Shards are rebuilt from their stripe, never copied
+            replicas = placement.replica_set(chunk_id, members)
+            if peer in replicas and self.port in replicas:
+                scope.append(chunk_id)
+        return scope
+
+    def start_sync(self, peer: int):
+        scope = self.sync_scope(peer)
+        tree = MerkleTree(scope, depth_for(len(scope)))
+        self.network.send_message(peer, 'SYNC', {'level': 0, 'depth': tree.depth, 'nodes': {'': tree.root}})
+        with self.data_lock:
+            digest = self.manifests.digest()
+        self.network.send_message(peer, 'MANIFEST_SYNC', {'digest': digest})
+
+    def handle_manifest_sync(self, peer: int, data: dict):
+        """Reconcile manifests and deletions with a peer; the newest version of each file wins.
+
+        A digest goes first. When it differs, the peer answers with its
+        versions; each side then pushes what it has newer (MANIFEST, or
+        DELETE for a deletion), and asks once for the other's versions if
+        the peer is ahead on anything.
+        """
+        with self.data_lock:
+            mine = self.manifests.versions()
+            digest = self.manifests.digest()
+        if 'versions' not in data:
+            if data.get('digest') != digest:
+                self.network.send_message(peer, 'MANIFEST_SYNC', dict(mine, reply=True))
+            return
+        theirs, their_deleted = data.get('versions', {}), data.get('deleted', {})
+        known = lambda filename: max(theirs.get(filename, -1), their_deleted.get(filename, -1))
+        for filename, version in mine['versions'].items():
+            if known(filename) < version:
+                self.network.send_message(peer, 'MANIFEST', self.manifests.get(filename))
+        for filename, version in mine['deleted'].items():
+            if known(filename) < version:
+                self.network.send_message(peer, 'DELETE', {'filename': filename, 'version': version})
+        mine_known = lambda filename: max(mine['versions'].get(filename, -1), mine['deleted'].get(filename, -1))
+        behind = any(mine_known(f) < v for f, v in list(theirs.items()) + list(their_deleted.items()))
+        if behind and data.get('reply'):
+            self.network.send_message(peer, 'MANIFEST_SYNC', dict(mine, reply=False))
+
+    def handle_sync(self, peer: int, data: dict):
+        """Compare the peer's Merkle nodes with ours and descend only into differing ones."""
+        tree = MerkleTree(self.sync_scope(peer), data.get('depth', MERKLE_DEPTH))
+        differing = tree.diff(data.get('nodes', {}))
+        if not differing:
+            return
+        level = data.get('level', 0)
+        if level < tree.depth:
+            nodes = {child: tree.node(child) for prefix in differing for child in children(prefix)}
+            self.network.send_message(peer, 'SYNC', {'level': level + 1, 'depth': tree.depth, 'nodes': nodes})
+        else:
+            leaves = {prefix: tree.leaf_ids(prefix) for prefix in differing}
+            self.network.send_message(peer, 'SYNC_IDS', {'depth': tree.depth, 'leaves': leaves})
+
+    def handle_sync_ids(self, peer: int, data: dict):
+        """Resolve differing leaves: push what the peer lacks, request what we lack."""
+        tree = MerkleTree(self.sync_scope(peer), data.get('depth', MERKLE_DEPTH))
+        pushed = requested = 0
+        for prefix, remote_ids in data.get('leaves', {}).items():
+            mine = set(tree.leaf_ids(prefix))
+            theirs = set(remote_ids)
+            for chunk_id in mine - theirs:
+                chunk = self.read_chunk(chunk_id)
+                if chunk:
+                    self.network.send_message(peer, 'STORE', dict(chunk, replicas=self.replica_set(chunk_id)),
+                                              trace=self.trace_copy(chunk_id, 'anti_entropy'))
+                    pushed += 1
+            for chunk_id in theirs - mine:
+                if chunk_id not in self.chunk_metadata:
+                    self.network.send_message(peer, 'REQUEST', {'chunk_id': chunk_id, 'requestor_port': self.port})
+                    requested += 1
+        if pushed or requested:
+            print(f"{Fore.CYAN}- Cell-{self.port} anti-entropy with Cell-{peer}: pushed {pushed}, requested {requested}{Style.RESET_ALL}")
+
+    def telemetry_loop(self):
+        """Push a stats snapshot to the manager every TELEMETRY_INTERVAL."""
+        while self.running:
+            time.sleep(config.TELEMETRY_INTERVAL)
+            self.report_stats()
+
+    def report_stats(self):
+        if not config.TELEMETRY_PORT:
+            return
+        snapshot = self.telemetry_snapshot()
+        now = time.time()
+        if now - self.metrics_reported_at >= config.TELEMETRY_METRICS_INTERVAL:
+            # The registry (every series, with help texts) dwarfs the status fields
+            snapshot['metrics'] = self.metrics.snapshot()
+            self.metrics_reported_at = now
+        self.network.send_message(config.TELEMETRY_PORT, 'STATS', snapshot)
+
+    def telemetry_snapshot(self) -> dict:
+        """Compact view of this cell for the manager's cluster status."""
+        target = min(config.REPLICATION_FACTOR, len(self.alive_neighbors) + 1)
+        with self.holders_lock:
+            # Chunks we hold with fewer known copies than the placement target
+            under_replicated = sum(1 for chunk_id, holders in self.chunk_holders.items()
+                                   if len(holders) < target and chunk_id in self.chunk_metadata
+                                   and not self.is_shard(chunk_id))
+        cache = self.cache.stats()
+        return {
+            'role': self.role,
+            'chunks': len(self.chunk_metadata),
+            'bytes_stored': self.store.bytes_stored(),
+            'alive': sorted(self.alive_neighbors),
+            'blacklist': sorted(self.blacklist),
+            'guards': list(self.guards),
+            'under_replicated': under_replicated,
+            'served': self.chunks_served,
+            'cache_hit_ratio': round(cache['hit_ratio'], 3),
+            'cache_hits': cache['hits'],
+            'cache_misses': cache['misses'],
+            'cache_evictions': cache['evictions'],
+            'verify_failed': self.verifier.failed,
+            'scrub_mismatches': self.scrubber.mismatches,
+            'scrub_bytes': self.scrubber.bytes_scrubbed,
+            'scrub_bytes_per_sec': self.scrubber.bytes_per_sec(),
+            'uptime': round(time.time() - self.start_time, 1),
+        }
+
+    def scrub_loop(self):
+        """Re-verify stored chunks within the scrub byte budget."""
+        while self.running:
+            time.sleep(SCRUB_TICK_INTERVAL)
+            try:
+                self.scrubber.tick()
+            except (OSError, ValueError) as e:
+                print(f"Cell-{self.port} scrub error: {e}")
+
+    def anti_entropy_loop(self):
+        """Periodically reconcile chunk sets with a random live neighbor."""
+        while self.running:
+            time.sleep(config.ANTI_ENTROPY_INTERVAL)
+            self.anti_entropy_tick()
+
+    def anti_entropy_tick(self):
+        peers = list(self.alive_neighbors)
+        if peers:
+            self.start_sync(random.choice(peers))
+        self.reclaim_garbage()
 
     def differentiation_loop(self):
         """Differentiate role after 10 seconds."""
-        time.sleep(10)
+        time.sleep(DIFFERENTIATION_DELAY)
+        self.differentiate()
+
+    def differentiate(self):
         if self.role == "STEM":
-            # Simple logic: Lowest port becomes GUARD, others STORAGE
+            # Simple logic: the highest ports become GUARDs, others STORAGE.
+            # GUARD_FRACTION of the cells guard, each owning one range of hash
+            # space, so verification capacity grows with the cluster.
             # In a real distributed system, this would be a consensus algorithm
             # Here we just use the sorted list of neighbors + self
             all_nodes = sorted(self.neighbors + [self.port])
-            if self.port == all_nodes[-1]: # Highest port is GUARD (arbitrary choice)
+            count = max(1, round(len(all_nodes) * config.GUARD_FRACTION))
+            self.guards = all_nodes[-count:] # Highest ports are GUARDs (arbitrary choice)
+            if self.port in self.guards:
                 self.role = "GUARD"
+                self.verifier.start()
             else:
                 self.role = "STORAGE"
             
@@ -0,0 +1,110 @@
+import bz2
+import lzma
+import zlib
+import hashlib
+from typing import Callable, Dict, Optional, Tuple
+
+# Per-chunk compression. A chunk is compressed once, where it is cut from the
+# file, and travels, is stored, replicated and healed compressed; it is only
+# inflated to be verified or read back. Chunk ids and hashes stay defined on
+# the uncompressed content, so deduplication and GUARD verification do not
+# depend on the codec.
+#
+# The codec is recorded in the chunk dict ('codec', absent when stored raw)
+# and, on disk, in the upper bits of the segment index flags.
+
+NONE = 'none'
+
+# Bytes compressed as a probe before committing to the whole chunk
+PROBE_BYTES = 4096
+
+# Chunks below this are not worth a codec
+MIN_SIZE = 256
+
+# name -> (wire / index id, compress, decompress)
+CODECS: Dict[str, Tuple[int, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    'zlib': (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (2, lambda data: lzma.compress(data, preset=1), lzma.decompress),
+    'bz2': (3, lambda data: bz2.compress(data, 9), bz2.decompress),
+}
+
+# zstd when available: stdlib from Python 3.14, else the zstandard package
+try:
+    from compression import zstd as _zstd
+    CODECS['zstd'] = (4, lambda data: _zstd.compress(data, 3), _zstd.decompress)
+except ImportError:
+    try:
+        import zstandard as _zstd
+        CODECS['zstd'] = (4, lambda data: _zstd.ZstdCompressor(level=3).compress(data),
+                          lambda data: _zstd.ZstdDecompressor().decompress(data))
+    except ImportError:
+        pass
+
+_BY_ID = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+# Index flags: codec id in the upper nibble (the lower bits are SegmentStore's own flags)
+FLAG_SHIFT = 4
+FLAG_MASK = 0xF0
+
+
+class CodecError(ValueError):
+    pass
+
+
+def available(name: Optional[str]) -> bool:
+    return not name or name == NONE or name in CODECS
+
+
+def compress(data: bytes, name: Optional[str], min_ratio: float) -> Tuple[str, bytes]:
+    """(codec, payload): data compressed with `name` if that saves enough, else (NONE, data).
+
+    A sample is compressed first, so incompressible chunks (media, archives,
+    encrypted data) cost one small probe instead of a full pass.
+    """
+    if not name or name == NONE or len(data) < MIN_SIZE:
+        return NONE, data
+    if name not in CODECS:
+        raise CodecError(f"unknown codec {name!r}")
+    _, pack, _ = CODECS[name]
+    if len(data) > 2 * PROBE_BYTES:
+        middle = len(data) // 2 # The header of a file often compresses better than its body
+        sample = data[middle:middle + PROBE_BYTES]
+        if len(pack(sample)) > len(sample) * min_ratio:
+            return NONE, data
+    payload = pack(data)
+    if len(payload) > len(data) * min_ratio:
+        return NONE, data
+    return name, payload
+
+
+def decompress(name: Optional[str], payload: bytes) -> bytes:
+    if not name or name == NONE:
+        return payload
+    if name not in CODECS:
+        raise CodecError(f"unknown codec {name!r}")
+    try:
+        return CODECS[name][2](payload)
+    except Exception as e: # Each library has its own error type
+        raise CodecError(f"corrupt {name} payload: {e}") from e
+
+
+def matches(payload: bytes, name: Optional[str], expected_hash: str) -> bool:
+    """Whether a stored or received payload inflates to content with the expected sha256."""
+    try:
+        return hashlib.sha256(decompress(name, payload)).hexdigest() == expected_hash
+    except CodecError:
+        return False
+
+
+def to_flags(name: Optional[str]) -> int:
+    if not name or name == NONE:
+        return 0
+    return CODECS[name][0] << FLAG_SHIFT
+
+
+def from_flags(flags: int) -> str:
+    codec_id = (flags & FLAG_MASK) >> FLAG_SHIFT
+    if not codec_id:
+        return NONE
+    # A codec this build lacks (e.g. zstd) still reads back as compressed, and fails to inflate
+    return _BY_ID.get(codec_id, f"codec-{codec_id}")
@@ -0,0 +1,109 @@
+import os
+
+# Tunables, overridable through the environment (cells inherit the
+# manager's environment, so a .env file configures the whole cluster).
+
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+def _float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+# Byte budget of each cell's in-memory chunk cache
+CACHE_MAX_BYTES = _int("CELLSYNC_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+
+# Copies kept of every chunk (placement target for uploads and healing)
+REPLICATION_FACTOR = _int("CELLSYNC_REPLICATION_FACTOR", 2)
+
+# Seconds between Merkle anti-entropy rounds with a random peer
+ANTI_ENTROPY_INTERVAL = _float("CELLSYNC_ANTI_ENTROPY_INTERVAL", 10.0)
+
+# Seconds a chunk stays on disk after its last manifest reference went, so a
+# manifest this cell missed (lost datagram, cell down) can still arrive
+# through anti-entropy and keep it
+GC_GRACE_PERIOD = _float("CELLSYNC_GC_GRACE_PERIOD", 300.0)
+
+# SWIM failure detector. Detection takes roughly one probe interval plus the
+# suspicion timeout; e.g. 0.2 / 0.1 / 0.5 gives sub-second detection.
+SWIM_PROBE_INTERVAL = _float("CELLSYNC_SWIM_PROBE_INTERVAL", 1.0)
+SWIM_PROBE_TIMEOUT = _float("CELLSYNC_SWIM_PROBE_TIMEOUT", 0.3)
+SWIM_INDIRECT_PROBES = _int("CELLSYNC_SWIM_INDIRECT_PROBES", 3)
+SWIM_SUSPICION_TIMEOUT = _float("CELLSYNC_SWIM_SUSPICION_TIMEOUT", 3.0)
+
+# asyncio runtime: bound of each per-message-type handler queue, and the
+# size of the executor that runs disk and hashing work
+HANDLER_QUEUE_SIZE = _int("CELLSYNC_HANDLER_QUEUE_SIZE", 1024)
+EXECUTOR_WORKERS = _int("CELLSYNC_EXECUTOR_WORKERS", 8)
+
+# Upload client: STOREs in flight at the start (the window then adapts, up to
+# the maximum), cap on unacknowledged bytes so bursts fit the socket buffers,
+# and attempts per chunk and replica before giving up on that copy
+UPLOAD_WINDOW = _int("CELLSYNC_UPLOAD_WINDOW", 32)
+UPLOAD_MAX_WINDOW = _int("CELLSYNC_UPLOAD_MAX_WINDOW", 1024)
+UPLOAD_WINDOW_BYTES = _int("CELLSYNC_UPLOAD_WINDOW_BYTES", 8 * 1024 * 1024)
+UPLOAD_RETRIES = _int("CELLSYNC_UPLOAD_RETRIES", 5)
+
+# Download client: chunk requests in flight and bytes buffered ahead of the
+# reader; a request is hedged to another replica once it is slower than the
+# recent 95th-percentile latency (but never sooner than the minimum delay),
+# and re-sent elsewhere after the timeout
+DOWNLOAD_WINDOW = _int("CELLSYNC_DOWNLOAD_WINDOW", 64)
+DOWNLOAD_WINDOW_BYTES = _int("CELLSYNC_DOWNLOAD_WINDOW_BYTES", 16 * 1024 * 1024)
+DOWNLOAD_HEDGE_MIN_DELAY = _float("CELLSYNC_DOWNLOAD_HEDGE_MIN_DELAY", 0.01)
+DOWNLOAD_TIMEOUT = _float("CELLSYNC_DOWNLOAD_TIMEOUT", 1.0)
+DOWNLOAD_RETRIES = _int("CELLSYNC_DOWNLOAD_RETRIES", 3)
+
+# API gateway: byte budget of its cache of recently read chunks, how long
+# a fetched manifest is reused before the cells are asked again, and how many
+# manifests it keeps (least recently used go first)
+GATEWAY_CACHE_MAX_BYTES = _int("CELLSYNC_GATEWAY_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+GATEWAY_MANIFEST_TTL = _float("CELLSYNC_GATEWAY_MANIFEST_TTL", 5.0)
+GATEWAY_MANIFEST_ENTRIES = _int("CELLSYNC_GATEWAY_MANIFEST_ENTRIES", 1024)
+
+# Integrity verification on GUARD cells: hashing threads, chunks a worker
+# takes per wake-up, and the queue bound (backpressure)
+VERIFY_WORKERS = _int("CELLSYNC_VERIFY_WORKERS", 4)
+VERIFY_BATCH_SIZE = _int("CELLSYNC_VERIFY_BATCH_SIZE", 32)
+VERIFY_QUEUE_SIZE = _int("CELLSYNC_VERIFY_QUEUE_SIZE", 4096)
+
+# Sharded verification: share of the cells that differentiate into GUARDs
+# (at least one), and the share of the chunks a STORAGE cell stores as their
+# primary replica that it forwards to the guard owning the chunk's hash range
+GUARD_FRACTION = _float("CELLSYNC_GUARD_FRACTION", 0.25)
+VERIFY_SAMPLE_RATE = _float("CELLSYNC_VERIFY_SAMPLE_RATE", 1.0)
+
+# Background scrubber: read budget for re-verifying stored chunks, and the
+# pause between full passes over the store
+SCRUB_BYTES_PER_SEC = _int("CELLSYNC_SCRUB_BYTES_PER_SEC", 4 * 1024 * 1024)
+SCRUB_INTERVAL = _float("CELLSYNC_SCRUB_INTERVAL", 60.0)
+
+# Erasure-coded storage mode (cold tier): data and parity shards per chunk.
+# Survives ERASURE_PARITY_SHARDS lost cells at parity/data storage overhead
+ERASURE_DATA_SHARDS = _int("CELLSYNC_ERASURE_DATA_SHARDS", 4)
+ERASURE_PARITY_SHARDS = _int("CELLSYNC_ERASURE_PARITY_SHARDS", 2)
+
+# Per-chunk compression: codec (zlib, lzma, bz2, zstd where installed, or
+# none), and the compressed/raw size ratio a chunk (and its probe sample)
+# must reach to be stored compressed
+COMPRESSION_CODEC = os.getenv("CELLSYNC_COMPRESSION_CODEC", "zlib")
+COMPRESSION_MIN_RATIO = _float("CELLSYNC_COMPRESSION_MIN_RATIO", 0.9)
+
+# Chunking mode for uploads: "fixed" offsets, or "cdc" (content-defined, the
+# chunk size being the average). CDC chunk bounds in bytes; 0 derives them
+# from the average (a quarter of it, and four times it)
+CHUNKING = os.getenv("CELLSYNC_CHUNKING", "fixed")
+CDC_MIN_SIZE = _int("CELLSYNC_CDC_MIN_SIZE", 0)
+CDC_MAX_SIZE = _int("CELLSYNC_CDC_MAX_SIZE", 0)
+
+# Telemetry: cells push a stats snapshot to the manager's UDP port this often
+# (port 0 turns it off); the manager serves the aggregate as /status. The
+# port must stay clear of the cells and of the tools' fixed ports (4998, 4999).
+# The full metrics registry (for /metrics) rides along less often
+TELEMETRY_PORT = _int("CELLSYNC_TELEMETRY_PORT", 4990)
+TELEMETRY_INTERVAL = _float("CELLSYNC_TELEMETRY_INTERVAL", 1.0)
+TELEMETRY_METRICS_INTERVAL = _float("CELLSYNC_TELEMETRY_METRICS_INTERVAL", 10.0)
+
+# Tracing: directory of the per-process trace files (Chrome trace format),
+# and the share of uploads traced end to end when the caller does not say
+TRACE_DIR = os.getenv("CELLSYNC_TRACE_DIR", "traces")
+TRACE_SAMPLE_RATE = _float("CELLSYNC_TRACE_SAMPLE_RATE", 0.0)
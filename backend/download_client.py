@@ -0,0 +1,429 @@
+import time
+import random
+import select
+import bisect
+import hashlib
+import itertools
+from collections import Counter, deque
+from typing import Deque, Dict, Iterator, List, Optional, Set
+
+import codec
+import config
+import erasure
+import placement
+from cache import LRUCache
+from network import UDPNetwork
+from protocol import PROTOCOL_VERSION
+
+# Recent request latencies the hedge delay is computed from
+LATENCY_SAMPLES = 256
+
+# Replies drained per receive pass before timers are checked again
+MAX_REPLIES_PER_PASS = 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Fetch:
+    """One chunk being fetched: who was asked, when, and who turned out not to have it."""
+    __slots__ = ('chunk_id', 'candidates', 'targets', 'asked', 'failed', 'first_sent', 'last_sent', 'hedged',
+                 'rounds', 'shard', 'gave_up')
+
+    def __init__(self, chunk_id: str, candidates: List[int], targets: int, shard: bool = False):
+        self.chunk_id = chunk_id
+        self.candidates = candidates # All cells, best placement rank first
+        self.targets = targets # How many of the candidates are placement targets
+        self.asked: Dict[int, float] = {} # port -> time the request went out
+        self.failed: Set[int] = set()
+        self.first_sent = 0.0
+        self.last_sent = 0.0
+        self.hedged = shard # Shards are hedged per stripe, with another shard
+        self.rounds = 1
+        self.shard = shard
+        self.gave_up = False
+
+
+class Stripe:
+    """An erasure-coded chunk being fetched: any k of its shards decode it."""
+    __slots__ = ('chunk_id', 'shards', 'holders', 'k', 'm', 'size', 'codec', 'length', 'asked', 'got', 'started',
+                 'hedged')
+
+    def __init__(self, chunk_id: str, stripe: dict, erasure_code: dict, size: int, now: float):
+        self.chunk_id = chunk_id
+        self.shards: List[str] = stripe['shards']
+        self.holders: List[int] = stripe['holders']
+        self.k = erasure_code['k']
+        self.m = erasure_code['m']
+        self.size = size
+        self.codec = stripe.get('codec', codec.NONE)
+        self.length = stripe.get('length', size) # What the shards decode to (compressed size, if compressed)
+        self.asked: Set[int] = set() # shard indices requested
+        self.got: Dict[int, bytes] = {} # shard index -> verified bytes
+        self.started = now
+        self.hedged = False
+
+
+class DownloadClient:
+    """Reads files back from the cluster, chunks fetched in parallel from their replicas.
+
+    - the manifest comes from any cell (every cell keeps all manifests)
+    - chunk requests go to the least loaded of each chunk's replicas, with up
+      to `window` requests and `window_bytes` of read-ahead outstanding
+    - a request slower than the recent p95 latency is hedged: the same chunk
+      is requested from another replica and the first valid copy wins
+    - every chunk is inflated (if stored compressed) and checked against its
+      hash on arrival; a bad or missing copy is fetched from another holder
+    - iter_file yields the file's bytes (or a byte range of it, touching only
+      the covering chunks) in order while later chunks are still in flight,
+      so callers can stream it
+    - with a cache, verified chunks are kept in memory and hot chunks are
+      served from it without asking any cell
+    - an erasure-coded chunk is read from its k data shards; when they are
+      slow (the hedge delay) or lost, parity shards are requested too, and
+      the chunk is decoded from the first k that arrive
+    """
+
+    def __init__(self, cell_ports: List[int], port: int = 0, window: int = None, window_bytes: int = None,
+                 hedge_min_delay: float = None, timeout: float = None, retries: int = None,
+                 cache: Optional[LRUCache] = None):
+        self.cell_ports = list(cell_ports)
+        self.network = UDPNetwork(port, default_peer_version=PROTOCOL_VERSION)
+        self.window = window if window is not None else config.DOWNLOAD_WINDOW
+        self.window_bytes = window_bytes if window_bytes is not None else config.DOWNLOAD_WINDOW_BYTES
+        self.hedge_min_delay = hedge_min_delay if hedge_min_delay is not None else config.DOWNLOAD_HEDGE_MIN_DELAY
+        self.timeout = timeout if timeout is not None else config.DOWNLOAD_TIMEOUT
+        self.retries = retries if retries is not None else config.DOWNLOAD_RETRIES
+        self.replicas = min(config.REPLICATION_FACTOR, len(self.cell_ports))
+        self.cache = cache # Shared chunk cache (e.g. the gateway's), keyed by chunk hash
+
+        self.load: Counter = Counter() # port -> our requests it has not answered yet
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.counters: Counter = Counter() # requests, hedges, hedge_wins, corrupt, missing, timeouts
+
+    # --- Manifest ----------------------------------------------------------
+
+    def get_manifest(self, filename: str) -> Optional[dict]:
+        """Ask the cells for a file's manifest; None if no cell knows the file."""
+        self.network.broadcast(self.cell_ports, 'GET_MANIFEST', {'filename': filename})
+        waiting = set(self.cell_ports)
+        deadline = time.time() + self.timeout
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([self.network.socket], [], [], remaining)[0]:
+                break
+            msg = self.network.receive_message()
+            if msg is None:
+                continue
+            payload, _ = msg
+            data = payload.get('data') or {}
+            if payload.get('type') != 'MANIFEST_REPLY' or data.get('filename') != filename:
+                continue
+            if data.get('manifest'):
+                return data['manifest']
+            waiting.discard(payload.get('sender_port'))
+        return None
+
+    # --- Chunk requests ----------------------------------------------------
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < 20:
+            return max(self.hedge_min_delay, self.timeout / 10)
+        ordered = sorted(self.latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95)])
+
+    def _ask(self, fetch: Fetch, now: float) -> bool:
+        """Request the chunk from the best replica not asked yet. False if none is left."""
+        untried = [p for p in fetch.candidates if p not in fetch.asked and p not in fetch.failed]
+        if not untried:
+            return False
+        # Placement targets first, least loaded among them; other cells only
+        # as a fallback (the chunk may have moved during healing)
+        preferred = [p for p in untried if p in fetch.candidates[:fetch.targets]] or untried[:1]
+        port = min(preferred, key=lambda p: (self.load[p], random.random()))
+        self.network.send_message(port, 'REQUEST', {'chunk_id': fetch.chunk_id, 'requestor_port': self.network.port,
+                                                    'reply': 'CHUNK'})
+        fetch.asked[port] = now
+        fetch.first_sent = fetch.first_sent or now
+        fetch.last_sent = now
+        self.load[port] += 1
+        self.counters['requests'] += 1
+        return True
+
+    def _answered(self, fetch: Fetch, port: int):
+        if port in fetch.asked:
+            self.load[port] -= 1
+
+    def _abandon(self, fetch: Fetch):
+        for port in fetch.asked:
+            if port not in fetch.failed:
+                self.load[port] -= 1
+
+    def _retry(self, fetch: Fetch, now: float):
+        """Ask another holder; start a new round over all cells when everyone was tried."""
+        if self._ask(fetch, now):
+            return
+        if fetch.shard:
+            fetch.gave_up = True # Its stripe asks for another shard instead
+            return
+        if fetch.rounds >= self.retries:
+            raise DownloadError(f"chunk {fetch.chunk_id} is unavailable on every cell")
+        self._abandon(fetch)
+        fetch.asked.clear()
+        fetch.failed.clear()
+        fetch.rounds += 1
+        self._ask(fetch, now)
+
+    # --- Download ----------------------------------------------------------
+
+    def iter_file(self, manifest: dict, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """Yield bytes [start, stop) of the file in order, fetching ahead in parallel."""
+        stop = manifest['size'] if stop is None else min(stop, manifest['size'])
+        if start >= stop:
+            return
+        # Only the chunks covering the range are fetched
+        ends = list(itertools.accumulate(manifest['sizes']))
+        first = bisect.bisect_right(ends, start)
+        last = bisect.bisect_left(ends, stop)
+        order: List[str] = manifest['chunks'][first:last + 1]
+        sizes: List[int] = manifest['sizes'][first:last + 1]
+        skip = start - (ends[first] - sizes[0]) # leading bytes of the first chunk outside the range
+        remaining = stop - start
+        code = manifest.get('erasure')
+        layout: List[dict] = manifest['stripes'][first:last + 1] if code else []
+        stripes: Dict[str, Stripe] = {} # erasure-coded chunks being fetched, by chunk id
+        users: Counter = Counter() # shard id -> stripes waiting for it
+        fetching: Dict[str, Fetch] = {}
+        ready: Dict[str, bytes] = {} # verified chunk bytes not yet yielded
+        needed: Counter = Counter() # chunk id -> scheduled uses not yet yielded
+        next_yield = next_fetch = 0
+        buffered = 0 # bytes scheduled but not yet yielded
+
+        try:
+            while next_yield < len(order):
+                now = time.time()
+                # Schedule ahead while the window allows
+                while next_fetch < len(order) and len(fetching) < self.window:
+                    size = sizes[next_fetch]
+                    if buffered and buffered + size > self.window_bytes:
+                        break
+                    chunk_id = order[next_fetch]
+                    needed[chunk_id] += 1
+                    buffered += size
+                    next_fetch += 1
+                    if chunk_id in ready or chunk_id in fetching or chunk_id in stripes:
+                        continue
+                    cached = self.cache.get(chunk_id) if self.cache else None
+                    if cached is not None:
+                        ready[chunk_id] = cached
+                        self.counters['cache_hits'] += 1
+                    elif code:
+                        stripe = stripes[chunk_id] = Stripe(chunk_id, layout[next_fetch - 1], code, size, now)
+                        self._widen(stripe, stripe.k, fetching, ready, users, now)
+                    else:
+                        fetch = fetching[chunk_id] = Fetch(chunk_id, placement.rank(chunk_id, self.cell_ports),
+                                                           self.replicas)
+                        self._retry(fetch, now)
+
+                # Hand over everything that is complete, in order
+                while next_yield < next_fetch and order[next_yield] in ready:
+                    chunk_id = order[next_yield]
+                    data = ready[chunk_id]
+                    needed[chunk_id] -= 1
+                    if not needed[chunk_id]:
+                        del needed[chunk_id], ready[chunk_id]
+                    buffered -= sizes[next_yield]
+                    next_yield += 1
+                    if skip:
+                        data, skip = data[skip:], 0
+                    data = data[:remaining]
+                    remaining -= len(data)
+                    yield data
+                if next_yield >= len(order):
+                    break
+
+                hedge_after = self.hedge_delay()
+                wake = min((s.started + hedge_after for s in stripes.values() if not s.hedged), default=None)
+                self._receive(fetching, ready, wake)
+
+                # Hedge slow requests, re-send timed out ones
+                now = time.time()
+                for fetch in list(fetching.values()):
+                    if fetch.gave_up:
+                        continue
+                    if now - fetch.last_sent > self.timeout:
+                        self.counters['timeouts'] += 1
+                        self._retry(fetch, now)
+                    elif not fetch.hedged and now - fetch.first_sent > hedge_after:
+                        fetch.hedged = True
+                        if self._ask(fetch, now):
+                            self.counters['hedges'] += 1
+                if stripes:
+                    self._collect(stripes, fetching, ready, users, needed, now)
+        finally:
+            for fetch in fetching.values():
+                self._abandon(fetch)
+
+    def _widen(self, stripe: Stripe, count: int, fetching: Dict[str, Fetch], ready: Dict[str, bytes],
+               users: Counter, now: float) -> int:
+        """Request up to count more shards of a stripe, data shards first. Returns how many."""
+        added = 0
+        for index, shard_id in enumerate(stripe.shards):
+            if added == count:
+                break
+            if index in stripe.asked:
+                continue
+            stripe.asked.add(index)
+            users[shard_id] += 1
+            added += 1
+            if shard_id in fetching or shard_id in ready:
+                continue # Identical shards are fetched once
+            # Only its holder has it; if that fails, another shard is cheaper than a search
+            fetch = fetching[shard_id] = Fetch(shard_id, [stripe.holders[index]], 1, shard=True)
+            self._retry(fetch, now)
+        return added
+
+    def _collect(self, stripes: Dict[str, Stripe], fetching: Dict[str, Fetch], ready: Dict[str, bytes],
+                 users: Counter, needed: Counter, now: float):
+        """Decode every stripe that has k shards; request more shards for slow or broken ones."""
+        hedge_after = self.hedge_delay()
+        for stripe in list(stripes.values()):
+            pending = 0
+            for index in stripe.asked:
+                shard_id = stripe.shards[index]
+                fetch = fetching.get(shard_id)
+                if index in stripe.got:
+                    continue
+                if shard_id in ready:
+                    stripe.got[index] = ready[shard_id]
+                elif fetch is not None and fetch.gave_up:
+                    self._abandon(fetch)
+                    del fetching[shard_id]
+                elif fetch is not None:
+                    pending += 1
+
+            if len(stripe.got) >= stripe.k:
+                try:
+                    data = codec.decompress(stripe.codec, erasure.decode(stripe.got, stripe.k, stripe.m, stripe.length))
+                except codec.CodecError as e:
+                    raise DownloadError(f"chunk {stripe.chunk_id} does not decode from its shards: {e}")
+                if hashlib.sha256(data).hexdigest() != stripe.chunk_id:
+                    raise DownloadError(f"chunk {stripe.chunk_id} does not decode from its shards")
+                del stripes[stripe.chunk_id]
+                self._release(stripe, fetching, ready, users, needed)
+                ready[stripe.chunk_id] = data
+                if self.cache:
+                    self.cache.put(stripe.chunk_id, data)
+                continue
+
+            short = stripe.k - len(stripe.got) - pending
+            extra = short
+            if not stripe.hedged and now - stripe.started > hedge_after:
+                stripe.hedged = True
+                extra = max(short, 1) # Race a parity shard against the slowest data shard
+            if extra > 0:
+                added = self._widen(stripe, extra, fetching, ready, users, now)
+                if added and stripe.hedged and short <= 0:
+                    self.counters['hedges'] += 1
+                if added < short:
+                    raise DownloadError(f"chunk {stripe.chunk_id}: fewer than {stripe.k} of its shards are available")
+
+    def _release(self, stripe: Stripe, fetching: Dict[str, Fetch], ready: Dict[str, bytes],
+                 users: Counter, needed: Counter):
+        """Drop a decoded stripe's shards, cancelling requests no other stripe waits for."""
+        for index in stripe.asked:
+            shard_id = stripe.shards[index]
+            users[shard_id] -= 1
+            if users[shard_id] > 0:
+                continue
+            del users[shard_id]
+            fetch = fetching.pop(shard_id, None)
+            if fetch is not None:
+                self._abandon(fetch)
+            if not needed[shard_id]:
+                ready.pop(shard_id, None)
+
+    def _receive(self, fetching: Dict[str, Fetch], ready: Dict[str, bytes], wake: Optional[float] = None):
+        """Wait briefly for CHUNK replies (or until `wake`) and apply every one that arrived."""
+        now = time.time()
+        hedge_after = self.hedge_delay()
+        deadlines = [f.last_sent + self.timeout if f.hedged else f.first_sent + hedge_after
+                     for f in fetching.values() if not f.gave_up]
+        if wake is not None:
+            deadlines.append(wake)
+        timeout = max(0.0, min(deadlines, default=now + self.timeout) - now)
+        sock = self.network.socket
+        for _ in range(MAX_REPLIES_PER_PASS):
+            if not select.select([sock], [], [], timeout)[0]:
+                return
+            timeout = 0
+            msg = self.network.receive_message()
+            if msg is None:
+                continue
+            payload, _ = msg
+            if payload.get('type') != 'CHUNK':
+                continue
+            port = payload.get('sender_port')
+            data = payload.get('data') or {}
+            fetch = fetching.get(data.get('id'))
+            if fetch is None or port not in fetch.asked or port in fetch.failed:
+                continue # Loser of a hedge, or a reply to an abandoned round
+            self._answered(fetch, port)
+
+            chunk_bytes = data.get('data')
+            if data.get('missing') or chunk_bytes is None:
+                self.counters['missing'] += 1
+                fetch.failed.add(port)
+                if len(fetch.failed) == len(fetch.asked):
+                    self._retry(fetch, time.time())
+                continue
+            try:
+                chunk_bytes = codec.decompress(data.get('codec'), chunk_bytes) # Cells serve chunks as stored
+            except codec.CodecError:
+                chunk_bytes = None
+            if chunk_bytes is None or hashlib.sha256(chunk_bytes).hexdigest() != fetch.chunk_id:
+                self.counters['corrupt'] += 1
+                fetch.failed.add(port)
+                if len(fetch.failed) == len(fetch.asked):
+                    self._retry(fetch, time.time())
+                continue
+
+            self.latencies.append(time.time() - fetch.asked[port])
+            if fetch.hedged and port != min(fetch.asked, key=fetch.asked.get):
+                self.counters['hedge_wins'] += 1
+            for other in fetch.asked:
+                if other != port and other not in fetch.failed:
+                    self.load[other] -= 1 # Outstanding duplicates are simply ignored
+            del fetching[fetch.chunk_id]
+            ready[fetch.chunk_id] = chunk_bytes
+            if self.cache and not fetch.shard:
+                self.cache.put(fetch.chunk_id, chunk_bytes)
+
+    def download(self, filename: str, output_path: str) -> dict:
+        """Download a file to output_path and report how the fetch went."""
+        manifest = self.get_manifest(filename)
+        if manifest is None:
+            raise FileNotFoundError(filename)
+        self.counters.clear()
+        started = time.time()
+        with open(output_path, 'wb') as f:
+            for data in self.iter_file(manifest):
+                f.write(data)
+        elapsed = time.time() - started
+        return dict(self.stats(), filename=filename, size=manifest['size'], chunks=len(manifest['chunks']),
+                    seconds=round(elapsed, 3), bytes_per_sec=int(manifest['size'] / elapsed) if elapsed > 0 else 0)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+        percentile = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 3) if ordered else None
+        return dict(self.counters, latency_p50_ms=percentile(0.5), latency_p99_ms=percentile(0.99))
+
+    def close(self):
+        self.network.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,121 @@
+import math
+import functools
+from typing import Dict, List
+
+import numpy as np
+
+# Reed-Solomon erasure coding over GF(256), systematic: a stripe of k data
+# shards (the chunk split in k) plus m parity shards, any k of which rebuild
+# the chunk. Survives m lost shards at m/k storage overhead (e.g. 4+2: two
+# failures for 50%, where replication needs 200%).
+#
+# Field arithmetic is table driven. MUL[c] is a 256-entry lookup row, so
+# multiplying a whole shard by a coefficient is one NumPy fancy-indexing
+# step, and a matrix-times-shards product is a few XORs of whole arrays.
+
+PRIMITIVE = 0x11d # x^8 + x^4 + x^3 + x^2 + 1
+
+EXP = np.zeros(512, dtype=np.uint8)
+LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    EXP[_i] = _x
+    LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= PRIMITIVE
+EXP[255:510] = EXP[:255]
+
+# MUL[a, b] = a * b in GF(256)
+MUL = EXP[(LOG[:, None] + LOG[None, :]) % 255]
+MUL[0, :] = 0
+MUL[:, 0] = 0
+
+
+def _inverse(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return int(EXP[255 - LOG[a]])
+
+
+@functools.lru_cache(maxsize=32)
+def generator(k: int, m: int) -> np.ndarray:
+    """(k+m) x k encoding matrix: identity on top, a Cauchy matrix below.
+
+    Every k x k submatrix of it is invertible, so any k shards decode.
+    """
+    if k < 1 or m < 0 or k + m > 256:
+        raise ValueError(f"unsupported erasure code {k}+{m}")
+    matrix = np.zeros((k + m, k), dtype=np.uint8)
+    matrix[:k] = np.eye(k, dtype=np.uint8)
+    for i in range(m):
+        for j in range(k):
+            matrix[k + i, j] = _inverse((k + i) ^ j)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def matmul(matrix: np.ndarray, shards: np.ndarray) -> np.ndarray:
+    """GF(256) product of a small coefficient matrix with a stack of shards (one row each)."""
+    out = np.zeros((matrix.shape[0], shards.shape[1]), dtype=np.uint8)
+    for i in range(matrix.shape[0]):
+        row = out[i]
+        for j in range(matrix.shape[1]):
+            coef = matrix[i, j]
+            if coef == 1:
+                row ^= shards[j]
+            elif coef:
+                row ^= MUL[coef][shards[j]]
+    return out
+
+
+def invert(matrix: np.ndarray) -> np.ndarray:
+    """Inverse of a square GF(256) matrix (Gauss-Jordan, whole rows at a time)."""
+    n = matrix.shape[0]
+    work = np.concatenate([matrix, np.eye(n, dtype=np.uint8)], axis=1)
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if work[r, col]), None)
+        if pivot is None:
+            raise ValueError("singular matrix")
+        if pivot != col:
+            work[[col, pivot]] = work[[pivot, col]]
+        work[col] = MUL[_inverse(int(work[col, col]))][work[col]]
+        for r in range(n):
+            if r != col and work[r, col]:
+                work[r] ^= MUL[work[r, col]][work[col]]
+    return work[:, n:]
+
+
+def encode(data: bytes, k: int, m: int) -> List[bytes]:
+    """Split data into k equal data shards (zero padded) and compute m parity shards."""
+    shard_size = max(1, math.ceil(len(data) / k))
+    buffer = np.zeros(k * shard_size, dtype=np.uint8)
+    buffer[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    data_shards = buffer.reshape(k, shard_size)
+    parity = matmul(generator(k, m)[k:], data_shards)
+    return [row.tobytes() for row in data_shards] + [row.tobytes() for row in parity]
+
+
+def _solve(shards: Dict[int, bytes], k: int, m: int) -> np.ndarray:
+    """Recover the k x shard_size data matrix from any k shards."""
+    if len(shards) < k:
+        raise ValueError(f"need {k} shards to decode, have {len(shards)}")
+    indices = sorted(shards)[:k] # Data shards sort first: fewer parity rows to undo
+    stack = np.stack([np.frombuffer(shards[i], dtype=np.uint8) for i in indices])
+    if indices == list(range(k)):
+        return stack
+    return matmul(invert(generator(k, m)[indices]), stack)
+
+
+def decode(shards: Dict[int, bytes], k: int, m: int, size: int) -> bytes:
+    """Rebuild the original data (of length size) from any k shards, keyed by shard index."""
+    if all(i in shards for i in range(k)):
+        return b"".join(shards[i] for i in range(k))[:size] # Systematic: no math needed
+    return _solve(shards, k, m).tobytes()[:size]
+
+
+def reconstruct(shards: Dict[int, bytes], k: int, m: int, missing: List[int]) -> Dict[int, bytes]:
+    """Recompute the shards at the `missing` indices from any k others."""
+    data_shards = _solve(shards, k, m)
+    rebuilt = matmul(generator(k, m)[missing], data_shards)
+    return {index: row.tobytes() for index, row in zip(missing, rebuilt)}
@@ -1,62 +1,234 @@
 import os
 import math
+import time
 import hashlib
-from typing import List, Dict, Tuple
+import placement
+import config
+import codec
+import cdc
+from typing import BinaryIO, List, Dict, Tuple, Iterable, Iterator, Optional, Set
+
+# Chunks above one datagram are fragmented by the network layer (binary peers
+# only), so chunk sizes of a few MB are fine.
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Chunking modes: fixed-size chunks, or content-defined boundaries (cdc.py)
+FIXED = 'fixed'
+CDC = 'cdc'
+CHUNKING_MODES = (FIXED, CDC)
+
+# How many bytes FileReconstructor lets accumulate before flushing to disk
+DEFAULT_WRITE_WINDOW = 16 * 1024 * 1024
+
+class FileReconstructor:
+    """Writes chunks straight to their offset in the output file as they arrive.
+
+    Chunks may arrive in any order; nothing but the chunk being written is held
+    in memory, and at most `window_bytes` of written data is left unflushed.
+    """
+
+    def __init__(self, output_path: str, total_chunks: Optional[int] = None, window_bytes: int = DEFAULT_WRITE_WINDOW):
+        self.output_path = output_path
+        self.total_chunks = total_chunks
+        self.window_bytes = window_bytes
+        self.received: Set[int] = set()
+        self.bytes_written = 0
+        self._unflushed = 0
+        self._file = open(output_path, 'wb')
+
+    def write_chunk(self, chunk: Dict):
+        index = chunk['index']
+        if index in self.received:
+            return
+        data = chunk['data']
+        if isinstance(data, str): # Legacy hex-encoded chunk
+            data = bytes.fromhex(data)
+        data = codec.decompress(chunk.get('codec'), data)
+        if self.total_chunks is None:
+            self.total_chunks = chunk.get('total_chunks')
+
+        self._file.seek(chunk['offset'])
+        self._file.write(data)
+        self.received.add(index)
+        self.bytes_written += len(data)
+        self._unflushed += len(data)
+        if self._unflushed >= self.window_bytes:
+            self._file.flush()
+            self._unflushed = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.total_chunks is not None and len(self.received) >= self.total_chunks
+
+    def missing(self) -> List[int]:
+        if self.total_chunks is None:
+            return []
+        return [i for i in range(self.total_chunks) if i not in self.received]
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 class FileManager:
     @staticmethod
-    def chunk_file(filepath: str, chunk_size: int = 1024) -> List[Dict]:
-        """Reads a file and splits it into chunks."""
-        chunks = []
-        filename = os.path.basename(filepath)
-        file_size = os.path.getsize(filepath)
-        
+    def iter_chunks(filepath: str, chunk_size: int = 1024, compression: str = codec.NONE,
+                    chunking: str = FIXED) -> Iterator[Dict]:
+        """Reads a file lazily and yields its chunks (up to MAX_CHUNK_SIZE bytes each) one at a time.
+
+        With a compression codec, each chunk whose probe compresses well is
+        carried compressed ('codec' names it, 'size' is the raw length); its
+        id and hash are still those of the raw bytes.
+
+        With chunking=CDC, chunk_size is the average: boundaries follow the
+        content (between CDC_MIN_SIZE and CDC_MAX_SIZE, by default a quarter
+        and four times the average), so an edited file shares all but the
+        chunks around the edit with its previous version.
+        """
         with open(filepath, 'rb') as f:
-            chunk_index = 0
-            while True:
-                data = f.read(chunk_size)
-                if not data:
-                    break
-                
-                chunk_id = f"{filename}_{chunk_index}"
-                chunk_hash = hashlib.sha256(data).hexdigest()
-                
-                chunks.append({
-                    'id': chunk_id,
-                    'index': chunk_index,
-                    'filename': filename,
-                    'data': data.hex(), # Encode bytes to hex for JSON serialization
-                    'hash': chunk_hash,
-                    'total_chunks': math.ceil(file_size / chunk_size)
-                })
-                chunk_index += 1
-        return chunks
+            yield from FileManager.iter_stream(f, os.path.basename(filepath), os.path.getsize(filepath),
+                                               chunk_size, compression, chunking)
+
+    @staticmethod
+    def iter_stream(stream: BinaryIO, filename: str, file_size: int, chunk_size: int = 1024,
+                    compression: str = codec.NONE, chunking: str = FIXED) -> Iterator[Dict]:
+        """Like iter_chunks, for an already open binary stream (e.g. an HTTP upload) of known size."""
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"chunk_size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+        if not codec.available(compression):
+            raise ValueError(f"unknown compression codec {compression!r}")
+        if chunking not in CHUNKING_MODES:
+            raise ValueError(f"chunking must be one of {', '.join(CHUNKING_MODES)}")
+
+        if chunking == CDC:
+            chunker = cdc.Chunker(chunk_size, config.CDC_MIN_SIZE or None,
+                                  min(config.CDC_MAX_SIZE or chunk_size * 4, MAX_CHUNK_SIZE))
+            pieces = chunker.iter_chunks(stream)
+            total_chunks = None # Known only at the end
+        else:
+            pieces = iter(lambda: stream.read(chunk_size), b"")
+            total_chunks = math.ceil(file_size / chunk_size)
+
+        offset = 0
+        for chunk_index, data in enumerate(pieces):
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            chunk_codec, payload = codec.compress(data, compression, config.COMPRESSION_MIN_RATIO)
+            
+            chunk = {
+                'id': chunk_hash, # Content-addressed: identical chunks share one id
+                'index': chunk_index,
+                'offset': offset,
+                'filename': filename,
+                'data': payload, # Raw bytes; the network layer picks the wire encoding
+                'hash': chunk_hash,
+                'total_chunks': total_chunks
+            }
+            if chunk_codec != codec.NONE:
+                chunk['codec'] = chunk_codec
+                chunk['size'] = len(data)
+            yield chunk
+            offset += len(data)
+
+    @staticmethod
+    def chunk_file(filepath: str, chunk_size: int = 1024, compression: str = codec.NONE,
+                   chunking: str = FIXED) -> List[Dict]:
+        """Reads a file and splits it into chunks. Use iter_chunks for large files."""
+        return list(FileManager.iter_chunks(filepath, chunk_size, compression, chunking))
+
+    @staticmethod
+    def new_manifest(filename: str, erasure: Optional[Tuple[int, int]] = None) -> Dict:
+        """An empty manifest: filename -> ordered list of chunk hashes (and their sizes).
+
+        Erasure-coded files (k data + m parity shards per chunk) also list, per
+        chunk, the stripe of shard hashes and the cell holding each shard.
+        """
+        manifest = {'filename': filename, 'size': 0, 'chunks': [], 'sizes': [],
+                    'version': time.time()} # Newest upload of a filename wins on every cell
+        if erasure:
+            manifest['erasure'] = {'k': erasure[0], 'm': erasure[1]}
+            manifest['stripes'] = []
+        return manifest
+
+    @staticmethod
+    def add_to_manifest(manifest: Dict, chunk: Dict):
+        """Appends a chunk to a manifest; chunks must be added in file order."""
+        size = chunk.get('size', len(chunk['data'])) # Uncompressed length
+        manifest['chunks'].append(chunk['hash'])
+        manifest['sizes'].append(size)
+        manifest['size'] += size
+
+    @staticmethod
+    def add_stripe(manifest: Dict, shard_hashes: List[str], holders: List[int],
+                   chunk_codec: str = codec.NONE, length: Optional[int] = None):
+        """Records the stripe of the chunk last added to an erasure-coded manifest.
+
+        A compressed chunk is striped compressed: the stripe then names the
+        codec and the compressed length the shards decode to.
+        """
+        stripe = {'shards': shard_hashes, 'holders': holders}
+        if chunk_codec != codec.NONE:
+            stripe['codec'] = chunk_codec
+            stripe['length'] = length
+        manifest['stripes'].append(stripe)
+
+    @staticmethod
+    def build_manifest(filename: str, chunks: Iterable[Dict]) -> Dict:
+        manifest = FileManager.new_manifest(filename)
+        for chunk in sorted(chunks, key=lambda x: x['index']):
+            FileManager.add_to_manifest(manifest, chunk)
+        return manifest
+
+    @staticmethod
+    def reconstruct_stream(chunks: Iterable[Dict], output_path: str, window_bytes: int = DEFAULT_WRITE_WINDOW) -> FileReconstructor:
+        """Writes chunks to output_path as they are produced, in any order."""
+        with FileReconstructor(output_path, window_bytes=window_bytes) as writer:
+            for chunk in chunks:
+                writer.write_chunk(chunk)
+        return writer
 
     @staticmethod
     def reconstruct_file(chunks: List[Dict], output_path: str):
         """Reconstructs a file from a list of chunks."""
-        # Sort chunks by index
+        if all('offset' in chunk for chunk in chunks):
+            FileManager.reconstruct_stream(chunks, output_path)
+            return
+
+        # Legacy chunks carry no offset: sort by index and write sequentially
         sorted_chunks = sorted(chunks, key=lambda x: x['index'])
         
         with open(output_path, 'wb') as f:
             for chunk in sorted_chunks:
-                data = bytes.fromhex(chunk['data'])
-                f.write(data)
+                data = chunk['data']
+                if isinstance(data, str): # Legacy hex-encoded chunk
+                    data = bytes.fromhex(data)
+                f.write(codec.decompress(chunk.get('codec'), data))
 
     @staticmethod
-    def distribute_chunks(chunks: List[Dict], cell_ports: List[int], redundancy: int = 2) -> Dict[int, List[Dict]]:
-        """Distributes chunks to cells with specified redundancy."""
+    def distribute_chunks(chunks: List[Dict], cell_ports: List[int], redundancy: int = config.REPLICATION_FACTOR) -> Dict[int, List[Dict]]:
+        """Distributes chunks to cells with specified redundancy. Identical chunks are placed once."""
         distribution = {port: [] for port in cell_ports}
         num_cells = len(cell_ports)
         
-        for i, chunk in enumerate(chunks):
-            # Primary holder
-            primary_idx = i % num_cells
-            distribution[cell_ports[primary_idx]].append(chunk)
-            
-            # Redundant holders
-            for r in range(1, redundancy):
-                replica_idx = (primary_idx + r) % num_cells
-                distribution[cell_ports[replica_idx]].append(chunk)
+        seen = set()
+        unique_chunks = []
+        for chunk in chunks:
+            if chunk['id'] not in seen:
+                seen.add(chunk['id'])
+                unique_chunks.append(chunk)
+        
+        # Rendezvous placement: independent of list order, and a membership
+        # change only moves ~1/N of the chunks
+        for chunk in unique_chunks:
+            replicas = placement.replica_set(chunk['id'], cell_ports, min(redundancy, num_cells))
+            chunk['replicas'] = replicas # Lets each holder know where the other copies are
+            for port in replicas:
+                distribution[port].append(chunk)
                 
         return distribution
@@ -25,13 +25,13 @@ def attack(filepath="demo_test.txt"):
         original_data = target_chunk['data']
         
         # Malicious modification
-        target_chunk['data'] = "DEADBEEF" * 100 # Obvious garbage
+        target_chunk['data'] = bytes.fromhex("DEADBEEF" * 100) # Obvious garbage
         chunk_id = target_chunk['id']
         
         print(f"\n{Fore.YELLOW}- Crafting Malicious Payload...{Style.RESET_ALL}")
         print(f"   Target Chunk: {chunk_id}")
-        print(f"   Original Data (First 20 chars): {original_data[:20]}...")
-        print(f"   Injected Data: {target_chunk['data'][:20]}...")
+        print(f"   Original Data (First 20 chars): {original_data[:10].hex()}...")
+        print(f"   Injected Data: {target_chunk['data'][:10].hex()}...")
         
         # 3. Send to the network
         net = UDPNetwork(4999) # Hacker uses port 4999
@@ -1,13 +1,26 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import uvicorn
 import os
-from manager import manager
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
-load_dotenv()
+load_dotenv() # Before config is imported, so .env tunables apply to the gateway too
+
+import config
+from manager import manager
+from upload_client import UploadClient
+from download_client import DownloadClient
+from cache import LRUCache
+from metrics import Registry, render
 
 app = FastAPI(title="CellSync API")
 
@@ -20,6 +33,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gateway-side read cache: hot chunks (and recently used manifests) are served
+# from here without touching the cells
+chunk_cache = LRUCache(config.GATEWAY_CACHE_MAX_BYTES)
+manifest_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict() # filename -> (fetched at, manifest), LRU order
+manifest_cache_lock = threading.Lock() # Sync endpoints run on the threadpool
+
+# Gateway metrics; /metrics also renders every cell's, from their telemetry
+gateway_metrics = Registry()
+upload_seconds = gateway_metrics.histogram('cellsync_gateway_upload_seconds', 'Time to upload a file through the gateway')
+upload_bytes = gateway_metrics.counter('cellsync_gateway_upload_bytes_total', 'File bytes uploaded through the gateway')
+download_bytes = gateway_metrics.counter('cellsync_gateway_download_bytes_total', 'File bytes served by the gateway')
+gateway_metrics.gauge('cellsync_gateway_cache_bytes', 'Bytes in the gateway chunk cache', lambda: chunk_cache.stats()['bytes'])
+gateway_metrics.gauge('cellsync_gateway_cache_hit_ratio', 'Hit ratio of the gateway chunk cache', lambda: chunk_cache.stats()['hit_ratio'])
+
+# Log stream: how often a subscriber checks for new lines, and how often an
+# idle stream sends a keep-alive comment (so proxies do not close it)
+LOG_STREAM_POLL = 0.25
+LOG_STREAM_KEEPALIVE = 15.0
+
 class CommandRequest(BaseModel):
     port: Optional[int] = None
 
@@ -51,8 +83,151 @@ def revive_cell(port: int):
     return {"message": f"Cell {port} revived"}
 
 @app.get("/logs")
-def get_logs():
-    return {"logs": manager.get_logs()}
+def get_logs(since: int = 0):
+    """Log lines after sequence number `since` (all kept lines by default).
+
+    'seq' is the sequence number to pass as `since` next time; 'missed'
+    counts lines that were dropped from the buffer before being read.
+    """
+    lines, seq, missed = manager.read_logs(since)
+    return {"logs": lines, "seq": seq, "missed": missed}
+
+@app.get("/logs/stream")
+async def stream_logs(request: Request, since: Optional[int] = None,
+                      last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """Server-sent events: new log lines as they are logged.
+
+    Each event carries {"logs", "missed"} and the sequence number as its id,
+    so a reconnecting EventSource resumes where it left off. Without `since`
+    a new subscriber first gets every line still kept.
+    """
+    if since is None:
+        since = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def events():
+        seq = since
+        idle = 0.0
+        while not await request.is_disconnected():
+            if manager.log_seq != seq: # Idle streams only compare two integers
+                lines, seq, missed = manager.read_logs(seq)
+                idle = 0.0
+                yield f"id: {seq}\ndata: {json.dumps({'logs': lines, 'missed': missed})}\n\n"
+            elif idle >= LOG_STREAM_KEEPALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(LOG_STREAM_POLL)
+            idle += LOG_STREAM_POLL
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/files")
+def upload_file(file: UploadFile = File(...), chunk_size: int = 64 * 1024, erasure: bool = False,
+                compression: Optional[str] = None, chunking: Optional[str] = None, trace: Optional[bool] = None):
+    ports = manager.get_status()["active_ports"]
+    if not ports:
+        raise HTTPException(status_code=503, detail="No active cells to upload to")
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    try:
+        code = (config.ERASURE_DATA_SHARDS, config.ERASURE_PARITY_SHARDS) if erasure else None
+        with UploadClient(ports, erasure=code, compression=compression, chunking=chunking,
+                          trace=trace) as client:
+            report = client.upload_stream(file.file, file.filename, size, chunk_size)
+        upload_seconds.observe(report['seconds'])
+        upload_bytes.inc(size)
+        with manifest_cache_lock:
+            manifest_cache.pop(file.filename, None) # The file may have been replaced
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return report
+
+def get_manifest(client: DownloadClient, filename: str) -> Optional[dict]:
+    with manifest_cache_lock:
+        cached = manifest_cache.get(filename)
+        if cached and time.time() - cached[0] < config.GATEWAY_MANIFEST_TTL:
+            manifest_cache.move_to_end(filename)
+            return cached[1]
+    manifest = client.get_manifest(filename) # Outside the lock: asks the cells
+    if manifest is not None:
+        with manifest_cache_lock:
+            manifest_cache[filename] = (time.time(), manifest)
+            manifest_cache.move_to_end(filename)
+            while len(manifest_cache) > config.GATEWAY_MANIFEST_ENTRIES:
+                manifest_cache.popitem(last=False)
+    return manifest
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Single 'bytes=' range -> [start, stop). None means serve the whole file."""
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or not any(match.groups()):
+        return None # Multiple or malformed ranges: ignoring Range is allowed
+    first, last = match.groups()
+    if not first:
+        start, stop = max(0, size - int(last)), size # Suffix: the last N bytes
+    else:
+        start = int(first)
+        stop = min(size, int(last) + 1) if last else size
+    if start >= size or start >= stop:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, stop
+
+@app.get("/files/{filename}")
+def download_file(filename: str, range_header: Optional[str] = Header(None, alias="Range")):
+    ports = manager.get_status()["active_ports"]
+    if not ports:
+        raise HTTPException(status_code=503, detail="No active cells to download from")
+    client = DownloadClient(ports, cache=chunk_cache)
+    manifest = get_manifest(client, filename)
+    if manifest is None:
+        client.close()
+        raise HTTPException(status_code=404, detail=f"File {filename} not found")
+
+    size = manifest['size']
+    try:
+        span = parse_range(range_header, size) if range_header else None
+    except HTTPException:
+        client.close()
+        raise
+    start, stop = span or (0, size)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(stop - start),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    if span:
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+
+    def stream():
+        with client:
+            for data in client.iter_file(manifest, start, stop):
+                download_bytes.inc(len(data))
+                yield data
+
+    return StreamingResponse(stream(), status_code=206 if span else 200,
+                             media_type="application/octet-stream", headers=headers)
+
+@app.get("/gateway/cache")
+def gateway_cache_stats():
+    with manifest_cache_lock:
+        manifests = len(manifest_cache)
+    return dict(chunk_cache.stats(), manifests=manifests)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(cell: Optional[int] = None):
+    """Prometheus text exposition: the gateway's metrics and every reporting cell's (label cell).
+
+    With `cell`, only that cell's metrics.
+    """
+    cells = manager.get_cell_metrics()
+    if cell is not None:
+        if cell not in cells:
+            raise HTTPException(status_code=404, detail=f"No metrics from cell {cell}")
+        return render([(cells[cell], {'cell': str(cell)})])
+    return render([(gateway_metrics.snapshot(), {})] +
+                  [(snapshot, {'cell': str(port)}) for port, snapshot in sorted(cells.items())])
 
 @app.post("/agent/chat")
 def agent_chat(req: ChatRequest):
@@ -5,29 +5,78 @@ import time
 import signal
 import shutil
 import random
+import select
 import threading
-from typing import Dict, List, Optional, Any
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Optional, Any, Tuple
+
+import config
+from network import UDPNetwork
+from protocol import PROTOCOL_VERSION
 
 # Configuration
 ALL_PORTS = [5000, 5001, 5002, 5003]
 
+# Log lines kept for the dashboard (older ones are dropped)
+MAX_LOGS = 1000
+
+# Seconds between rebuilds of the cluster view when no stats arrive (ages, staleness)
+STATUS_REFRESH = 1.0
+
+# A cell whose last stats are older than this many intervals is reported stale
+STALE_INTERVALS = 3
+
+# A cell serving more than this many times the cluster's mean request rate is hot
+HOT_FACTOR = 2.0
+
 class CellManager:
     def __init__(self):
         self.running_cells: Dict[int, subprocess.Popen] = {}
-        self.logs: List[str] = []
+        # Ring buffer of (sequence number, line); sequence numbers only grow,
+        # so readers ask for what came after the last line they saw
+        self.logs: Deque[Tuple[int, str]] = deque(maxlen=MAX_LOGS)
+        self.log_seq = 0
         self.log_lock = threading.Lock()
 
+        # Telemetry: latest snapshot pushed by each cell, folded into a cached
+        # cluster view that /status returns as is
+        self.cell_stats: Dict[int, dict] = {}
+        self.cell_metrics: Dict[int, dict] = {} # port -> latest metrics snapshot (kept out of /status)
+        self.stats_lock = threading.Lock()
+        self.status: Dict[str, Any] = {}
+        self.telemetry: Optional[UDPNetwork] = None
+        self._refresh_status()
+        self.start_telemetry()
+
     def _log(self, message: str):
+        timestamp = time.strftime("%H:%M:%S")
         with self.log_lock:
-            timestamp = time.strftime("%H:%M:%S")
-            self.logs.append(f"[{timestamp}] {message}")
-            # Keep only last 1000 logs
-            if len(self.logs) > 1000:
-                self.logs.pop(0)
+            self.log_seq += 1
+            self.logs.append((self.log_seq, f"[{timestamp}] {message}"))
 
     def get_logs(self) -> List[str]:
         with self.log_lock:
-            return list(self.logs)
+            return [line for _, line in self.logs]
+
+    def read_logs(self, since: int = 0) -> Tuple[List[str], int, int]:
+        """Lines logged after sequence number `since`: (lines, last sequence number, lines missed).
+
+        Lines missed were dropped from the ring before the reader got to them.
+        Costs O(new lines) when the reader is up to date.
+        """
+        with self.log_lock:
+            last = self.log_seq
+            if since >= last:
+                return [], last, 0
+            first = last - len(self.logs) + 1 # sequence number of the oldest line kept
+            skip = max(0, since + 1 - first)
+            if skip > len(self.logs) // 2:
+                # Near the end: walk back from the newest line instead of forward
+                lines = [line for _, line in itertools.islice(reversed(self.logs), last - since)][::-1]
+            else:
+                lines = [line for _, line in itertools.islice(self.logs, skip, None)]
+            return lines, last, max(0, first - since - 1)
 
     def start_cell(self, port: int):
         if port in self.running_cells:
@@ -45,6 +94,7 @@ class CellManager:
         
         self.running_cells[port] = p
         self._log(f"Spawned Cell-{port} (PID: {p.pid})")
+        self._refresh_status()
 
         # Start monitoring thread
         def monitor_output(proc, p_port):
@@ -81,6 +131,10 @@ class CellManager:
             except subprocess.TimeoutExpired:
                 p.kill()
         self.running_cells.clear()
+        with self.stats_lock:
+            self.cell_stats.clear()
+            self.cell_metrics.clear()
+        self._refresh_status()
         self._log("All cells stopped.")
 
     def kill_cell(self, port: int):
@@ -89,6 +143,10 @@ class CellManager:
             self._log(f"CHAOS: Killing Cell-{port} (PID: {p.pid})...")
             p.terminate()
             del self.running_cells[port]
+            with self.stats_lock:
+                self.cell_stats.pop(port, None)
+                self.cell_metrics.pop(port, None)
+            self._refresh_status()
         else:
             self._log(f"Cell-{port} is not running.")
 
@@ -100,9 +158,96 @@ class CellManager:
             self._log(f"Cell-{port} is already alive.")
 
     def get_status(self) -> Dict[str, Any]:
-        return {
+        """The cached cluster view; rebuilt as stats arrive, never computed per request."""
+        return self.status
+
+    def get_cell_metrics(self) -> Dict[int, dict]:
+        """Latest metrics snapshot pushed by each cell."""
+        with self.stats_lock:
+            return dict(self.cell_metrics)
+
+    # --- Telemetry -----------------------------------------------------------
+
+    def start_telemetry(self):
+        if not config.TELEMETRY_PORT:
+            return
+        try:
+            self.telemetry = UDPNetwork(config.TELEMETRY_PORT, default_peer_version=PROTOCOL_VERSION)
+        except OSError as e:
+            self._log(f"Telemetry disabled: port {config.TELEMETRY_PORT} is unavailable ({e})")
+            return
+        t = threading.Thread(target=self.telemetry_loop)
+        t.daemon = True
+        t.start()
+
+    def telemetry_loop(self):
+        """Collect STATS snapshots from the cells and keep the cluster view current."""
+        sock = self.telemetry.socket
+        last_refresh = time.time()
+        while self.telemetry.running:
+            received = False
+            try:
+                ready = select.select([sock], [], [], STATUS_REFRESH)[0]
+            except (OSError, ValueError):
+                return # Socket closed
+            while ready:
+                msg = self.telemetry.receive_message()
+                if msg is not None:
+                    payload, _ = msg
+                    if payload.get('type') == 'STATS':
+                        self._record_stats(payload.get('sender_port'), payload.get('data') or {})
+                        received = True
+                ready = select.select([sock], [], [], 0)[0] # Drain the burst, then rebuild once
+            if received or time.time() - last_refresh >= STATUS_REFRESH:
+                self._refresh_status()
+                last_refresh = time.time()
+
+    def _record_stats(self, port: int, snapshot: dict):
+        now = time.time()
+        metrics = snapshot.pop('metrics', None)
+        with self.stats_lock:
+            if metrics is not None:
+                self.cell_metrics[port] = metrics
+            previous = self.cell_stats.get(port)
+            if previous and now > previous['reported_at']:
+                served = snapshot.get('served', 0) - previous.get('served', 0)
+                snapshot['served_per_sec'] = round(max(0, served) / (now - previous['reported_at']), 1)
+            else:
+                snapshot['served_per_sec'] = 0.0
+            snapshot['reported_at'] = now
+            self.cell_stats[port] = snapshot
+
+    def _refresh_status(self):
+        """Rebuild the cluster view from the latest snapshots (O(cells))."""
+        now = time.time()
+        stale_after = STALE_INTERVALS * config.TELEMETRY_INTERVAL
+        with self.stats_lock:
+            cells = {}
+            for port, snapshot in self.cell_stats.items():
+                age = now - snapshot['reported_at']
+                cells[port] = dict(snapshot, age=round(age, 1), stale=age > stale_after,
+                                   running=port in self.running_cells)
+        fresh = [c for c in cells.values() if not c['stale']]
+        mean_rate = sum(c['served_per_sec'] for c in fresh) / len(fresh) if fresh else 0.0
+        hits = sum(c.get('cache_hits', 0) for c in fresh)
+        lookups = hits + sum(c.get('cache_misses', 0) for c in fresh)
+        self.status = { # Replaced whole, so readers never see a half-built view
             "active_ports": list(self.running_cells.keys()),
-            "total_ports": ALL_PORTS
+            "total_ports": ALL_PORTS,
+            "cells": cells,
+            "cluster": {
+                "reporting": len(fresh),
+                "chunks": sum(c.get('chunks', 0) for c in fresh),
+                "bytes_stored": sum(c.get('bytes_stored', 0) for c in fresh),
+                "under_replicated": sum(c.get('under_replicated', 0) for c in fresh),
+                "cache_hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+                "under_replicated_cells": sorted(p for p, c in cells.items() if c.get('under_replicated')),
+                "hot_cells": sorted(p for p, c in cells.items() if not c['stale'] and c['served_per_sec'] > 1
+                                    and c['served_per_sec'] > HOT_FACTOR * mean_rate),
+                "stale_cells": sorted(p for p, c in cells.items() if c['stale']),
+                "blacklisted": sorted({b for c in fresh for b in c.get('blacklist', [])}),
+            },
+            "updated_at": now,
         }
 
 # Global instance
@@ -0,0 +1,138 @@
+import os
+import json
+import copy
+import time
+import hashlib
+from urllib.parse import quote
+from typing import Dict, List, Optional
+
+def stored_chunks(manifest: dict) -> List[str]:
+    """Hashes of what cells actually store for a manifest: its shards when erasure coded."""
+    if manifest.get('erasure'):
+        return [shard for stripe in manifest['stripes'] for shard in stripe['shards']]
+    return manifest.get('chunks', [])
+
+def version(manifest: dict) -> float:
+    """Upload time of a manifest; the newest manifest of a filename wins (0 for legacy ones)."""
+    return manifest.get('version', 0)
+
+class ManifestStore:
+    """Per-cell store of file manifests (filename -> ordered chunk hashes).
+
+    Chunks are content-addressed, so one chunk can back many files. The
+    store keeps a reference count per chunk hash across all manifests it
+    holds; a chunk is only safe to garbage-collect once its count drops to
+    zero through a manifest being replaced or deleted.
+
+    Deletions leave a tombstone (filename -> version deleted), so a peer
+    still holding the old manifest cannot bring it back through anti-entropy.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifests: Dict[str, dict] = {}
+        self.refcounts: Dict[str, int] = {}
+        self.deleted: Dict[str, float] = {}
+        self.tombstones_path = os.path.join(directory, "deleted.state")
+        self.load()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, f"{quote(filename, safe='')}.json")
+
+    def load(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name), 'r') as f:
+                        manifest = json.load(f)
+                    self.manifests[manifest['filename']] = manifest
+                    self._ref(manifest, 1)
+                except Exception as e:
+                    print(f"Error loading manifest {name}: {e}")
+        if os.path.exists(self.tombstones_path):
+            try:
+                with open(self.tombstones_path, 'r') as f:
+                    self.deleted = json.load(f)
+            except Exception as e:
+                print(f"Error loading manifest tombstones: {e}")
+
+    def _ref(self, manifest: dict, delta: int) -> List[str]:
+        """Adjust reference counts for every chunk in a manifest. Returns hashes that reached zero."""
+        released = []
+        for chunk_hash in stored_chunks(manifest):
+            count = self.refcounts.get(chunk_hash, 0) + delta
+            if count <= 0:
+                self.refcounts.pop(chunk_hash, None)
+                released.append(chunk_hash)
+            else:
+                self.refcounts[chunk_hash] = count
+        return released
+
+    def get(self, filename: str) -> Optional[dict]:
+        return self.manifests.get(filename)
+
+    def is_newer(self, manifest: dict) -> bool:
+        """Whether a received manifest is newer than the one we hold and than its deletion."""
+        filename = manifest.get('filename')
+        held = self.manifests.get(filename)
+        if held is not None and version(held) >= version(manifest):
+            return False
+        return self.deleted.get(filename, -1) < version(manifest)
+
+    def put(self, manifest: dict) -> List[str]:
+        """Store (or replace) a manifest. Returns chunk hashes no longer referenced by anything."""
+        filename = manifest['filename']
+        old = self.manifests.get(filename)
+        if filename in self.deleted and self.deleted[filename] < version(manifest):
+            del self.deleted[filename] # Uploaded again after the deletion
+            self._save_tombstones()
+        self._ref(manifest, 1)
+        released = self._ref(old, -1) if old else []
+        self.manifests[filename] = manifest
+        self._write(self._path(filename), manifest)
+        return [h for h in released if h not in self.refcounts]
+
+    def delete(self, filename: str, deleted_version: Optional[float] = None) -> List[str]:
+        """Remove a manifest. Returns chunk hashes no longer referenced by anything.
+
+        Manifests newer than deleted_version (default: now) are kept.
+        """
+        deleted_version = deleted_version if deleted_version is not None else time.time()
+        if self.deleted.get(filename, -1) < deleted_version:
+            self.deleted[filename] = deleted_version
+            self._save_tombstones()
+        old = self.manifests.get(filename)
+        if old is None or version(old) > deleted_version:
+            return []
+        del self.manifests[filename]
+        path = self._path(filename)
+        if os.path.exists(path):
+            os.remove(path)
+        return self._ref(old, -1)
+
+    def _save_tombstones(self):
+        self._write(self.tombstones_path, self.deleted)
+
+    def _write(self, path: str, obj):
+        """Replace a file atomically: a crash leaves the old version, never a truncated one."""
+        tmp_path = path + ".tmp" # Not *.json, so load() skips leftovers
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def versions(self) -> dict:
+        """What anti-entropy compares: the version of every manifest and of every deletion."""
+        return {'versions': {name: version(m) for name, m in self.manifests.items()}, 'deleted': dict(self.deleted)}
+
+    def digest(self) -> str:
+        return hashlib.sha256(json.dumps(self.versions(), sort_keys=True).encode('utf-8')).hexdigest()
+
+    def erasure_coded(self) -> List[dict]:
+        """Copies of the erasure-coded manifests; edit them and put() them back."""
+        return [copy.deepcopy(m) for m in self.manifests.values() if m.get('erasure')]
+
+    def is_referenced(self, chunk_hash: str) -> bool:
+        return chunk_hash in self.refcounts
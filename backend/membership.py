@@ -0,0 +1,244 @@
+import math
+import time
+import random
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional
+
+import config
+
+# SWIM-style failure detector and membership.
+#
+# Each probe period a cell pings one member (round-robin over a shuffled
+# list). If no ACK arrives within the probe timeout it asks k other members
+# to ping the target on its behalf (PING_REQ). No ACK by the end of the
+# period marks the target SUSPECT; a suspect that does not refute within
+# the suspicion timeout is declared DEAD. Incarnation numbers order the
+# claims: only a member itself can refute a suspicion, by bumping its
+# incarnation. State changes are piggybacked as 'gossip' on outgoing
+# messages instead of being broadcast, so traffic per cell is O(1) per
+# period rather than O(N).
+
+ALIVE = 'ALIVE'
+SUSPECT = 'SUSPECT'
+DEAD = 'DEAD'
+
+# Updates piggybacked per message
+MAX_PIGGYBACK = 8
+
+
+class Member:
+    __slots__ = ('port', 'state', 'incarnation', 'since')
+
+    def __init__(self, port: int, state: str = ALIVE, incarnation: int = 0):
+        self.port = port
+        self.state = state
+        self.incarnation = incarnation
+        self.since = time.time()
+
+
+class Membership:
+    def __init__(self, port: int, seeds: List[int], send: Callable,
+                 on_alive: Callable[[int], None], on_dead: Callable[[int], None],
+                 probe_interval: float = None, probe_timeout: float = None,
+                 indirect_probes: int = None, suspicion_timeout: float = None):
+        self.port = port
+        self.send = send
+        self.on_alive = on_alive
+        self.on_dead = on_dead
+        self.probe_interval = probe_interval if probe_interval is not None else config.SWIM_PROBE_INTERVAL
+        self.probe_timeout = probe_timeout if probe_timeout is not None else config.SWIM_PROBE_TIMEOUT
+        self.indirect_probes = indirect_probes if indirect_probes is not None else config.SWIM_INDIRECT_PROBES
+        self.suspicion_timeout = suspicion_timeout if suspicion_timeout is not None else config.SWIM_SUSPICION_TIMEOUT
+
+        # Wall-clock start time as the first incarnation, so a restarted cell
+        # always outranks the DEAD claim about its previous life
+        self.incarnation = int(time.time())
+        self.members: Dict[int, Member] = {p: Member(p) for p in seeds if p != port}
+        self.updates: Dict[int, list] = {} # port -> [state, incarnation, transmissions left]
+        self.pending: Dict[int, dict] = {} # seq -> outstanding probe we started
+        self.relays: Dict[int, tuple] = {} # seq -> (origin port, origin seq, sent) for PING_REQ
+        self.seq = itertools.count(1)
+        self.probe_order: List[int] = []
+        self.next_probe_at = time.time()
+        self.lock = threading.Lock()
+        # Announce ourselves, so peers that saw our previous life as DEAD take us back
+        self._enqueue(self.port, ALIVE, self.incarnation)
+
+    # --- Views -------------------------------------------------------------
+
+    def alive(self) -> List[int]:
+        with self.lock:
+            return [m.port for m in self.members.values() if m.state != DEAD]
+
+    def snapshot(self) -> Dict[int, dict]:
+        with self.lock:
+            return {m.port: {'state': m.state, 'incarnation': m.incarnation} for m in self.members.values()}
+
+    # --- Dissemination -----------------------------------------------------
+
+    def _enqueue(self, port: int, state: str, incarnation: int):
+        n = len(self.members) + 1
+        self.updates[port] = [state, incarnation, max(1, math.ceil(3 * math.log2(n + 1)))]
+
+    def take_updates(self, target: Optional[int] = None) -> Optional[list]:
+        """Updates to piggyback on the next outgoing message to target (hooked into UDPNetwork).
+
+        Only members get gossip: messages to clients or the manager would
+        spend the transmission budget of updates on ports that never relay them.
+        """
+        with self.lock:
+            if not self.updates or (target is not None and target not in self.members):
+                return None
+            chosen = sorted(self.updates.items(), key=lambda item: -item[1][2])[:MAX_PIGGYBACK]
+            gossip = []
+            for port, entry in chosen:
+                gossip.append([port, entry[0], entry[1]])
+                entry[2] -= 1
+                if entry[2] <= 0:
+                    del self.updates[port]
+            return gossip
+
+    def merge(self, gossip: list):
+        """Apply piggybacked updates using SWIM's incarnation precedence rules."""
+        events = []
+        with self.lock:
+            for port, state, incarnation in gossip:
+                if port == self.port:
+                    if state != ALIVE and incarnation >= self.incarnation:
+                        # Refute: we are alive, with a newer incarnation than the rumour
+                        self.incarnation = incarnation + 1
+                        self._enqueue(self.port, ALIVE, self.incarnation)
+                    continue
+
+                member = self.members.get(port)
+                if member is None:
+                    if state == DEAD:
+                        continue
+                    member = self.members[port] = Member(port, state, incarnation)
+                    self._enqueue(port, state, incarnation)
+                    events.append((self.on_alive, port))
+                    continue
+
+                if state == ALIVE:
+                    applies = incarnation > member.incarnation
+                elif state == SUSPECT:
+                    applies = (incarnation > member.incarnation or
+                               (incarnation == member.incarnation and member.state == ALIVE))
+                else:
+                    applies = incarnation >= member.incarnation and member.state != DEAD
+
+                if not applies:
+                    continue
+                previous = member.state
+                member.state, member.incarnation, member.since = state, incarnation, time.time()
+                self._enqueue(port, state, incarnation)
+                if state == DEAD:
+                    events.append((self.on_dead, port))
+                elif state == ALIVE and previous == DEAD:
+                    events.append((self.on_alive, port))
+        for callback, port in events:
+            callback(port)
+
+    # --- Direct evidence ---------------------------------------------------
+
+    def heard_from(self, port: int, join: bool = False):
+        """Any message from a member proves it is alive. join=True admits unknown ports."""
+        revived = False
+        with self.lock:
+            member = self.members.get(port)
+            if member is None:
+                if not join:
+                    return
+                member = self.members[port] = Member(port)
+                self._enqueue(port, ALIVE, member.incarnation)
+                revived = True
+            elif member.state != ALIVE:
+                revived = member.state == DEAD
+                member.state, member.since = ALIVE, time.time()
+                if revived:
+                    self._enqueue(port, ALIVE, member.incarnation)
+        if revived:
+            self.on_alive(port)
+
+    def handle(self, msg_type: str, sender: int, data: dict) -> bool:
+        """Handle PING / PING_REQ / ACK. Returns False for other message types."""
+        if msg_type == 'PING':
+            self.heard_from(sender, join=True)
+            self.send(sender, 'ACK', {'seq': data.get('seq')})
+        elif msg_type == 'PING_REQ':
+            seq = next(self.seq)
+            with self.lock:
+                self.relays[seq] = (sender, data.get('seq'), time.time())
+            self.send(data.get('target'), 'PING', {'seq': seq})
+        elif msg_type == 'ACK':
+            seq = data.get('seq')
+            with self.lock:
+                probe = self.pending.pop(seq, None)
+                relay = self.relays.pop(seq, None)
+            if relay:
+                origin, origin_seq, _ = relay
+                self.send(origin, 'ACK', {'seq': origin_seq, 'target': sender})
+            target = probe['target'] if probe else sender
+            if probe and data.get('target') not in (None, target):
+                return True # Stale relayed ACK for a different target
+            self.heard_from(target)
+        else:
+            return False
+        return True
+
+    # --- Probing -----------------------------------------------------------
+
+    def _next_target(self) -> Optional[int]:
+        candidates = [m.port for m in self.members.values() if m.state != DEAD]
+        if not candidates:
+            return None
+        self.probe_order = [p for p in self.probe_order if p in candidates]
+        if not self.probe_order:
+            self.probe_order = candidates
+            random.shuffle(self.probe_order)
+        return self.probe_order.pop()
+
+    def tick(self):
+        """Advance probes and suspicion timers. Call often (every few tens of ms)."""
+        now = time.time()
+        sends = []
+        events = []
+        with self.lock:
+            for seq, probe in list(self.pending.items()):
+                elapsed = now - probe['sent']
+                if not probe['indirect'] and elapsed > self.probe_timeout:
+                    probe['indirect'] = True
+                    helpers = [m.port for m in self.members.values()
+                               if m.state == ALIVE and m.port != probe['target']]
+                    for helper in random.sample(helpers, min(self.indirect_probes, len(helpers))):
+                        sends.append((helper, 'PING_REQ', {'target': probe['target'], 'seq': seq}))
+                elif elapsed > self.probe_interval:
+                    del self.pending[seq]
+                    member = self.members.get(probe['target'])
+                    if member and member.state == ALIVE:
+                        member.state, member.since = SUSPECT, now
+                        self._enqueue(member.port, SUSPECT, member.incarnation)
+
+            for member in self.members.values():
+                if member.state == SUSPECT and now - member.since > self.suspicion_timeout:
+                    member.state, member.since = DEAD, now
+                    self._enqueue(member.port, DEAD, member.incarnation)
+                    events.append(member.port)
+
+            for seq, (_, _, sent) in list(self.relays.items()):
+                if now - sent > self.probe_interval:
+                    del self.relays[seq]
+
+            if now >= self.next_probe_at:
+                self.next_probe_at = now + self.probe_interval
+                target = self._next_target()
+                if target is not None:
+                    seq = next(self.seq)
+                    self.pending[seq] = {'target': target, 'sent': now, 'indirect': False}
+                    sends.append((target, 'PING', {'seq': seq}))
+
+        for port, msg_type, data in sends:
+            self.send(port, msg_type, data)
+        for port in events:
+            self.on_dead(port)
@@ -0,0 +1,69 @@
+import hashlib
+from typing import Dict, Iterable, List
+
+# Fixed-shape Merkle tree over a set of chunk ids, used for anti-entropy.
+#
+# Ids are bucketed by their leading hex digits (chunk ids are sha256 hex, so
+# buckets are uniform). With FANOUT 16 a tree of depth d has 16^d leaves; an
+# inner node is addressed by its hex prefix ('' is the root). Two cells
+# compare roots, then descend only into prefixes whose hashes differ, so
+# the bytes exchanged track the size of the difference, not of the set.
+#
+# The depth grows with the set (depth_for), so a differing leaf holds about
+# LEAF_SIZE ids whatever the store size. The cell starting a sync picks it,
+# and both sides build their trees with it.
+
+HEX = "0123456789abcdef"
+DEPTH = 2 # Minimum depth, and the depth assumed when a peer does not say
+MAX_DEPTH = 8
+LEAF_SIZE = 16 # ids per leaf aimed for
+EMPTY = hashlib.sha256(b"").hexdigest()
+
+def depth_for(count: int) -> int:
+    """Smallest depth (DEPTH..MAX_DEPTH) that leaves about LEAF_SIZE ids per leaf."""
+    depth = DEPTH
+    while depth < MAX_DEPTH and count > LEAF_SIZE * 16 ** depth:
+        depth += 1
+    return depth
+
+def bucket(chunk_id: str, depth: int = DEPTH) -> str:
+    prefix = chunk_id[:depth].lower()
+    if len(prefix) == depth and all(c in HEX for c in prefix):
+        return prefix
+    return hashlib.sha256(chunk_id.encode('utf-8')).hexdigest()[:depth]
+
+def children(prefix: str) -> List[str]:
+    return [prefix + c for c in HEX]
+
+class MerkleTree:
+    def __init__(self, chunk_ids: Iterable[str], depth: int = DEPTH):
+        self.depth = depth
+        self.leaves: Dict[str, List[str]] = {}
+        for chunk_id in chunk_ids:
+            self.leaves.setdefault(bucket(chunk_id, depth), []).append(chunk_id)
+
+        self.nodes: Dict[str, str] = {}
+        for prefix, ids in self.leaves.items():
+            ids.sort()
+            self.nodes[prefix] = hashlib.sha256("\n".join(ids).encode('utf-8')).hexdigest()
+        # Fold upwards; subtrees that are entirely empty keep the EMPTY hash
+        level = {p[:depth - 1] for p in self.leaves}
+        for _ in range(depth):
+            for prefix in level:
+                joined = "".join(self.node(child) for child in children(prefix))
+                self.nodes[prefix] = hashlib.sha256(joined.encode('utf-8')).hexdigest()
+            level = {p[:-1] for p in level if p}
+
+    @property
+    def root(self) -> str:
+        return self.node("")
+
+    def node(self, prefix: str) -> str:
+        return self.nodes.get(prefix, EMPTY)
+
+    def leaf_ids(self, prefix: str) -> List[str]:
+        return self.leaves.get(prefix, [])
+
+    def diff(self, remote_nodes: Dict[str, str]) -> List[str]:
+        """Prefixes (from the remote's offer) whose hash differs from ours."""
+        return [prefix for prefix, digest in remote_nodes.items() if self.node(prefix) != digest]
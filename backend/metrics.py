@@ -0,0 +1,185 @@
+import abc
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# In-process metrics: counters, gauges and fixed-bucket histograms, rendered
+# in the Prometheus text exposition format.
+#
+# Each cell owns a Registry (several cells may share a process under the
+# asyncio runtime). Recording is a dict lookup, a lock and an add; a
+# histogram observation adds a bisect over its bucket bounds. Cells ship
+# Registry.snapshot() with their telemetry, and the gateway renders every
+# cell's snapshot, labelled by cell, next to its own.
+
+# Seconds; from a fraction of a millisecond (hashing a small chunk) to seconds (healing)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Counts of things per operation (e.g. chunks re-replicated per heal)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+class Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    @abc.abstractmethod
+    def samples(self) -> List[list]:
+        """[labels, value] per label set (a histogram's value is [bucket counts, sum, count])."""
+
+
+class Counter(Metric):
+    """A value that only goes up (messages, bytes)."""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, labels: Optional[Dict[str, str]] = None):
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[list]:
+        with self.lock:
+            return [[dict(key), value] for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """A value that goes up and down; may be read from a callback when collected."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.values: Dict[LabelKey, float] = {}
+        self.function = function
+
+    def set(self, value: float, labels: Optional[Dict[str, str]] = None):
+        with self.lock:
+            self.values[_key(labels)] = value
+
+    def samples(self) -> List[list]:
+        if self.function is not None:
+            return [[{}, self.function()]]
+        with self.lock:
+            return [[dict(key), value] for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, plus their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.values: Dict[LabelKey, list] = {} # -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None):
+        key = _key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[list]:
+        with self.lock:
+            return [[dict(key), [list(counts), total, count]] for key, (counts, total, count) in self.values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs) -> Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str, function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._get(Gauge, name, help, function=function)
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Plain-data copy of every metric (JSON-safe), e.g. to ship with telemetry."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            entry = {'type': metric.kind, 'help': metric.help, 'samples': metric.samples()}
+            if isinstance(metric, Histogram):
+                entry['buckets'] = list(metric.buckets)
+            snapshot[metric.name] = entry
+        return snapshot
+
+    def expose(self, labels: Optional[Dict[str, str]] = None) -> str:
+        return render([(self.snapshot(), labels or {})])
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render(snapshots: Iterable[Tuple[Dict[str, dict], Dict[str, str]]]) -> str:
+    """Text exposition of several snapshots, each with extra labels (e.g. its cell).
+
+    Samples of the same metric from different snapshots are grouped under
+    one HELP / TYPE header, as the format requires.
+    """
+    grouped: Dict[str, Tuple[dict, List[Tuple[dict, object]]]] = {}
+    for snapshot, extra in snapshots:
+        for name, entry in snapshot.items():
+            _, samples = grouped.setdefault(name, (entry, []))
+            samples.extend((dict(labels, **extra), value) for labels, value in entry['samples'])
+
+    lines = []
+    for name in sorted(grouped):
+        entry, samples = grouped[name]
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['type']}")
+        for labels, value in samples:
+            if entry['type'] != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, n in zip(list(entry['buckets']) + [float('inf')], counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=_number(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
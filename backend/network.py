@@ -1,29 +1,102 @@
 import socket
 import json
+import select
+import itertools
 import threading
-from typing import Any, Tuple, Optional
+from typing import Any, Callable, Dict, Tuple, Optional
+import protocol
+from metrics import Registry
+from protocol import PROTOCOL_JSON, PROTOCOL_VERSION, MAX_DATAGRAM
+
+# Kernel socket buffer size we ask for, so a burst of fragments from one
+# large chunk is not dropped before the listen loop gets to it.
+SOCKET_BUFFER_BYTES = 16 * 1024 * 1024
 
 class UDPNetwork:
-    def __init__(self, port: int, buffer_size: int = 4096):
+    def __init__(self, port: int, buffer_size: int = 65535, default_peer_version: int = PROTOCOL_JSON,
+                 metrics: Optional[Registry] = None):
         self.port = port
         self.buffer_size = buffer_size
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.socket.setsockopt(socket.SOL_SOCKET, opt, SOCKET_BUFFER_BYTES)
+            except OSError:
+                pass # Kernel limits apply; fall back to the default size
         self.socket.bind(('localhost', port))
+        self.port = self.socket.getsockname()[1] # port=0 binds an ephemeral port (clients)
         self.running = True
 
-    def send_message(self, target_port: int, message_type: str, data: Any = None):
-        """Send a JSON message to a target port on localhost."""
+        # Large frames are split into fragments and reassembled on receipt
+        self.message_ids = itertools.count()
+        self.reassembler = protocol.Reassembler()
+
+        # Version negotiation: peers are assumed to speak legacy JSON until they
+        # advertise (or send) something newer, so mixed clusters keep working
+        # during a rolling upgrade.
+        self.protocol_version = PROTOCOL_VERSION
+        self.default_peer_version = default_peer_version
+        self.peer_versions: Dict[int, int] = {}
+
+        # Optional hook returning extra state to piggyback on an outgoing message,
+        # given its target port (membership gossip); sent as the envelope's 'gossip' field
+        self.piggyback: Optional[Callable[[int], Any]] = None
+
+        self.metrics = metrics or Registry()
+        self.messages_sent = self.metrics.counter('cellsync_messages_sent_total', 'Messages sent, by type')
+        self.messages_received = self.metrics.counter('cellsync_messages_received_total', 'Messages received (reassembled), by type')
+        self.bytes_sent = self.metrics.counter('cellsync_bytes_sent_total', 'Encoded message bytes sent')
+        self.bytes_received = self.metrics.counter('cellsync_bytes_received_total', 'Datagram bytes received')
+        self.send_errors = self.metrics.counter('cellsync_send_errors_total', 'Messages that could not be sent')
+
+    def version_for(self, target_port: int) -> int:
+        return min(self.protocol_version, self.peer_versions.get(target_port, self.default_peer_version))
+
+    def send_message(self, target_port: int, message_type: str, data: Any = None, trace: Optional[list] = None):
+        """Send a message to a target port on localhost, in the best format the peer understands.
+
+        trace is a tracing context ([trace id, span id]), sent as the envelope's 'trace' field.
+        """
         payload = {
             'type': message_type,
             'sender_port': self.port,
             'data': data
         }
+        if trace:
+            payload['trace'] = trace
         try:
-            message_bytes = json.dumps(payload).encode('utf-8')
-            self.socket.sendto(message_bytes, ('localhost', target_port))
+            if self.piggyback:
+                gossip = self.piggyback(target_port)
+                if gossip:
+                    payload['gossip'] = gossip
+            version = self.version_for(target_port)
+            if version == PROTOCOL_JSON:
+                # Advertise our version so upgraded peers switch to binary
+                payload['proto'] = self.protocol_version
+            message_bytes = protocol.encode(payload, version)
+            if len(message_bytes) > MAX_DATAGRAM and version == PROTOCOL_JSON:
+                print(f"Error sending message to {target_port}: {len(message_bytes)} bytes is too large for a legacy peer")
+                return
+            for datagram in protocol.fragment(message_bytes, self.port, next(self.message_ids)):
+                self._sendto(datagram, ('localhost', target_port))
+            self.messages_sent.inc(labels={'type': protocol.type_label(message_type)})
+            self.bytes_sent.inc(len(message_bytes))
         except Exception as e:
+            self.send_errors.inc()
             print(f"Error sending message to {target_port}: {e}")
 
+    def _sendto(self, datagram: bytes, addr: tuple, timeout: float = 1.0):
+        """sendto that also works once an event loop has made the socket non-blocking."""
+        while True:
+            try:
+                self.socket.sendto(datagram, addr)
+                return
+            except BlockingIOError:
+                # Send buffer full: wait until the kernel drains it
+                _, writable, _ = select.select([], [self.socket], [], timeout)
+                if not writable:
+                    raise
+
     def broadcast(self, target_ports: list[int], message_type: str, data: Any = None):
         """Send a message to multiple ports."""
         for port in target_ports:
@@ -36,13 +109,34 @@ class UDPNetwork:
             return None
         try:
             data, addr = self.socket.recvfrom(self.buffer_size)
-            payload = json.loads(data.decode('utf-8'))
-            return payload, addr
         except socket.error:
             return None
-        except json.JSONDecodeError:
+        payload = self.process_datagram(data)
+        return (payload, addr) if payload is not None else None
+
+    def process_datagram(self, data: bytes) -> Optional[dict]:
+        """Reassemble and decode one received datagram. None until a whole message is in."""
+        self.bytes_received.inc(len(data))
+        try:
+            frame = self.reassembler.add(data)
+            if frame is None:
+                return None # Waiting for more fragments
+            payload = protocol.decode(frame)
+            self._note_peer(payload)
+            self.messages_received.inc(labels={'type': protocol.type_label(payload.get('type'))})
+            return payload
+        except (json.JSONDecodeError, UnicodeDecodeError):
             print(f"Received invalid JSON")
             return None
+        except protocol.ProtocolError as e:
+            print(f"Received invalid message: {e}")
+            return None
+
+    def _note_peer(self, payload: dict):
+        sender = payload.get('sender_port')
+        version = protocol.peer_version(payload)
+        if isinstance(sender, int) and version is not None:
+            self.peer_versions[sender] = min(version, self.protocol_version)
 
     def close(self):
         self.running = False
@@ -0,0 +1,42 @@
+import hashlib
+from typing import Iterable, List, Optional
+import config
+
+# Rendezvous (highest-random-weight) hashing.
+#
+# Every node gets a pseudo-random score per key and a key lives on the
+# top-scoring nodes. The result depends only on the key and the *set* of
+# nodes (not their order), and adding or removing one node only moves the
+# keys that node wins or held - about 1/N of the data. Uploaders and cells
+# compute replica sets locally with these functions, no lookup needed.
+
+def score(key: str, node: int) -> int:
+    digest = hashlib.blake2b(f"{node}:{key}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def rank(key: str, nodes: Iterable[int]) -> List[int]:
+    """All nodes ordered by preference for this key (best first)."""
+    return sorted(set(nodes), key=lambda node: score(key, node), reverse=True)
+
+def replica_set(key: str, nodes: Iterable[int], replicas: int = None) -> List[int]:
+    """The nodes that should hold a key, primary first."""
+    if replicas is None:
+        replicas = config.REPLICATION_FACTOR
+    return rank(key, nodes)[:replicas]
+
+# Guard sharding: the hash space is cut into one contiguous range per guard
+# (in port order), so each GUARD verifies a fixed share of all chunks.
+
+def _position(key: str) -> int:
+    """32-bit position of a key in hash space (its leading hex digits, for chunk hashes)."""
+    try:
+        return int(key[:8], 16)
+    except ValueError: # Not a hex hash (legacy id)
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=4).digest(), 'big')
+
+def guard_for(key: str, guards: Iterable[int]) -> Optional[int]:
+    """The guard whose hash range contains key, or None without guards."""
+    guards = sorted(set(guards))
+    if not guards:
+        return None
+    return guards[_position(key) * len(guards) >> 32]
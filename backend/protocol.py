@@ -0,0 +1,250 @@
+import json
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Protocol versions
+# v1: legacy JSON envelope, chunk bytes hex-encoded inside 'data'
+# v2: binary frame (fixed header + compact meta + raw chunk bytes)
+PROTOCOL_JSON = 1
+PROTOCOL_BINARY = 2
+PROTOCOL_VERSION = PROTOCOL_BINARY
+
+MAGIC = b"CS"
+FRAGMENT_MAGIC = b"CF"
+
+# magic, version, type code, sender port, flags, id length, meta length, raw sha256
+HEADER = struct.Struct("!2sBBHBBI32s")
+
+# magic, version, sender port, message id, fragment index, fragment count
+FRAGMENT_HEADER = struct.Struct("!2sBHIHH")
+
+# Largest datagram we put on the wire. Frames above this are fragmented, which
+# lets chunks of several MB travel over plain UDP (binary peers only).
+MAX_DATAGRAM = 60000
+FRAGMENT_PAYLOAD = MAX_DATAGRAM - FRAGMENT_HEADER.size
+
+FLAG_CHUNK = 0x01  # 'data' is a chunk dict, raw bytes follow the meta block
+FLAG_HASH = 0x02   # header carries the chunk's sha256 digest
+
+# Wire codes for the known message types. Unknown types are sent with code 0
+# and their name in the meta block, so new message types never need a bump.
+MESSAGE_TYPES = {
+    'HEARTBEAT': 1,
+    'STORE': 2,
+    'REQUEST': 3,
+    'REPLICATE': 4,
+    'ALERT': 5,
+    'SABOTAGE': 6,
+}
+MESSAGE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+# Every message type the cells, clients and manager exchange, the coded ones
+# included. Metrics label any other type 'other', so peers sending made-up
+# types cannot grow the label sets without bound
+KNOWN_TYPES = set(MESSAGE_TYPES) | {
+    'PING', 'PING_REQ', 'ACK', # Membership (SWIM)
+    'STORE_ACK', 'VERIFY', 'VERIFY_RESULT', 'CHUNK', 'HAVE', 'SYNC', 'SYNC_IDS',
+    'MANIFEST', 'MANIFEST_ACK', 'MANIFEST_SYNC', 'GET_MANIFEST', 'MANIFEST_REPLY', 'DELETE', 'STATS',
+}
+
+
+def type_label(msg_type: Any) -> str:
+    """The metrics label for a message type: the type itself if known, else 'other'."""
+    return msg_type if msg_type in KNOWN_TYPES else 'other'
+
+_NO_HASH = b"\x00" * 32
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def is_chunk(data: Any) -> bool:
+    """A chunk is a dict carrying its payload as raw bytes under 'data'."""
+    return isinstance(data, dict) and isinstance(data.get('data'), (bytes, bytearray, memoryview))
+
+
+def encode_binary(payload: Dict[str, Any]) -> bytes:
+    """Encode an envelope dict into a v2 binary frame."""
+    msg_type = payload['type']
+    data = payload.get('data')
+    meta: Dict[str, Any] = {k: v for k, v in payload.items() if k not in ('type', 'sender_port', 'data')}
+
+    code = MESSAGE_TYPES.get(msg_type, 0)
+    if code == 0:
+        meta['t'] = msg_type
+
+    flags = 0
+    chunk_id = b""
+    digest = _NO_HASH
+    body = b""
+    if is_chunk(data):
+        flags |= FLAG_CHUNK
+        chunk_id = str(data.get('id', '')).encode('utf-8')
+        body = data['data']
+        chunk_hash = data.get('hash')
+        rest = {k: v for k, v in data.items() if k not in ('id', 'data', 'hash')}
+        if isinstance(chunk_hash, str) and len(chunk_hash) == 64:
+            try:
+                digest = bytes.fromhex(chunk_hash)
+                flags |= FLAG_HASH
+            except ValueError:
+                rest['hash'] = chunk_hash
+        elif chunk_hash is not None:
+            rest['hash'] = chunk_hash
+        if rest:
+            meta['d'] = rest
+    elif data is not None:
+        meta['d'] = data
+
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8') if meta else b""
+    if len(chunk_id) > 255:
+        raise ProtocolError(f"chunk id too long ({len(chunk_id)} bytes)")
+
+    header = HEADER.pack(MAGIC, PROTOCOL_BINARY, code, payload['sender_port'], flags,
+                         len(chunk_id), len(meta_bytes), digest)
+    return b"".join((header, chunk_id, meta_bytes, body))
+
+
+def decode_binary(frame: bytes) -> Dict[str, Any]:
+    """Decode a v2 binary frame back into an envelope dict."""
+    if len(frame) < HEADER.size:
+        raise ProtocolError("truncated header")
+    magic, version, code, sender, flags, id_len, meta_len, digest = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ProtocolError("bad magic")
+
+    pos = HEADER.size
+    chunk_id = frame[pos:pos + id_len].decode('utf-8')
+    pos += id_len
+    meta = json.loads(frame[pos:pos + meta_len]) if meta_len else {}
+    pos += meta_len
+
+    msg_type = meta.pop('t', None) if code == 0 else MESSAGE_NAMES.get(code)
+    if msg_type is None:
+        raise ProtocolError(f"unknown message type code {code}")
+
+    data = meta.pop('d', None)
+    if flags & FLAG_CHUNK:
+        data = dict(data or {})
+        data['id'] = chunk_id
+        if flags & FLAG_HASH:
+            data['hash'] = digest.hex()
+        data['data'] = frame[pos:]
+
+    payload = {'type': msg_type, 'sender_port': sender, 'data': data, 'proto': version}
+    payload.update(meta)
+    return payload
+
+
+def encode_json(payload: Dict[str, Any]) -> bytes:
+    """Encode an envelope dict as a legacy v1 JSON message (chunk bytes hex-encoded)."""
+    data = payload.get('data')
+    if is_chunk(data):
+        payload = dict(payload, data=dict(data, data=bytes(data['data']).hex()))
+    return json.dumps(payload).encode('utf-8')
+
+
+def decode_json(message: bytes) -> Dict[str, Any]:
+    """Decode a legacy v1 JSON message, turning hex chunk payloads into bytes."""
+    payload = json.loads(message.decode('utf-8'))
+    data = payload.get('data')
+    if isinstance(data, dict) and isinstance(data.get('data'), str) and 'hash' in data:
+        try:
+            payload['data'] = dict(data, data=bytes.fromhex(data['data']))
+        except ValueError:
+            raise ProtocolError("chunk payload is not valid hex")
+    return payload
+
+
+def encode(payload: Dict[str, Any], version: int) -> bytes:
+    if version >= PROTOCOL_BINARY:
+        return encode_binary(payload)
+    return encode_json(payload)
+
+
+def decode(message: bytes) -> Dict[str, Any]:
+    """Decode either wire format; binary frames are recognised by their magic."""
+    if message[:2] == MAGIC:
+        return decode_binary(message)
+    return decode_json(message)
+
+
+def peer_version(payload: Dict[str, Any]) -> Optional[int]:
+    """Protocol version a peer advertised in a received envelope, if any."""
+    version = payload.get('proto')
+    return version if isinstance(version, int) else None
+
+
+def fragment(frame: bytes, sender_port: int, message_id: int) -> List[bytes]:
+    """Split an encoded frame into datagrams of at most MAX_DATAGRAM bytes."""
+    if len(frame) <= MAX_DATAGRAM:
+        return [frame]
+    count = -(-len(frame) // FRAGMENT_PAYLOAD)
+    if count > 0xFFFF:
+        raise ProtocolError(f"message too large to fragment ({len(frame)} bytes)")
+    view = memoryview(frame)
+    return [
+        FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, PROTOCOL_BINARY, sender_port, message_id & 0xFFFFFFFF, i, count)
+        + view[i * FRAGMENT_PAYLOAD:(i + 1) * FRAGMENT_PAYLOAD]
+        for i in range(count)
+    ]
+
+
+class Reassembler:
+    """Collects fragments per (sender, message id) and yields whole frames.
+
+    Incomplete messages are dropped after `timeout` seconds, and the total
+    amount of buffered fragment data is capped at `max_bytes` (oldest
+    partial messages are evicted first).
+    """
+
+    def __init__(self, timeout: float = 5.0, max_bytes: int = 256 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.buffered_bytes = 0
+        self.dropped = 0
+        self.pending: Dict[Tuple[int, int], dict] = {}
+
+    def add(self, datagram: bytes) -> Optional[bytes]:
+        """Feed one datagram. Returns a complete frame, or None if more fragments are needed."""
+        if datagram[:2] != FRAGMENT_MAGIC:
+            return datagram
+        if len(datagram) < FRAGMENT_HEADER.size:
+            raise ProtocolError("truncated fragment header")
+        _, _, sender, message_id, index, count = FRAGMENT_HEADER.unpack_from(datagram)
+        if index >= count:
+            raise ProtocolError("fragment index out of range")
+
+        now = time.time()
+        key = (sender, message_id)
+        entry = self.pending.get(key)
+        if entry is None:
+            self._expire(now)
+            entry = self.pending[key] = {'count': count, 'parts': {}, 'size': 0, 'first_seen': now}
+        if index in entry['parts']:
+            return None
+
+        part = datagram[FRAGMENT_HEADER.size:]
+        entry['parts'][index] = part
+        entry['size'] += len(part)
+        self.buffered_bytes += len(part)
+
+        if len(entry['parts']) == entry['count']:
+            del self.pending[key]
+            self.buffered_bytes -= entry['size']
+            return b"".join(entry['parts'][i] for i in range(entry['count']))
+
+        while self.buffered_bytes > self.max_bytes and self.pending:
+            self._drop(next(iter(self.pending)))
+        return None
+
+    def _expire(self, now: float):
+        for key in [k for k, e in self.pending.items() if now - e['first_seen'] > self.timeout]:
+            self._drop(key)
+
+    def _drop(self, key: Tuple[int, int]):
+        entry = self.pending.pop(key)
+        self.buffered_bytes -= entry['size']
+        self.dropped += 1
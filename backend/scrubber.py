@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Callable, Deque, Optional, Set
+
+import codec
+import config
+from metrics import Registry
+from segment_store import SegmentStore
+
+# Seconds between scrubber ticks; each tick spends the bytes earned since the last
+TICK_INTERVAL = 0.1
+
+# Seconds between saves of the scrub cursor
+SAVE_INTERVAL = 5.0
+
+
+class Scrubber:
+    """Re-verifies stored chunks against their hashes in the background.
+
+    - walks the store in chunk id order, one pass after another (SCRUB_INTERVAL
+      seconds apart)
+    - token bucket: reads at most `bytes_per_sec` (bursts up to one second's
+      worth), so foreground I/O keeps priority
+    - the cursor is saved to `state_path`, so a restarted cell resumes its
+      pass instead of starting over
+    - a mismatch is handed to `on_corrupt`, which repairs the chunk from a
+      healthy replica
+    """
+
+    def __init__(self, store: SegmentStore, state_path: str, on_corrupt: Callable[[str], None],
+                 bytes_per_sec: int = None, interval: float = None, metrics: Optional[Registry] = None):
+        self.store = store
+        self.state_path = state_path
+        self.on_corrupt = on_corrupt
+        self.rate = bytes_per_sec if bytes_per_sec is not None else config.SCRUB_BYTES_PER_SEC
+        self.interval = interval if interval is not None else config.SCRUB_INTERVAL
+
+        self.cursor = '' # Last chunk id verified in the current pass
+        self.passes = 0
+        self.bytes_scrubbed = 0
+        self.chunks_scrubbed = 0
+        self.mismatches = 0
+        self.repaired = 0
+        self.active_seconds = 0.0 # Time spent inside passes, for the scrub rate
+        self.repairing: Set[str] = set() # Chunks whose replacement must check out before it is stored
+        self.repair_lock = threading.Lock() # Repairs are noted from the scrub, receive and verifier threads
+        self.load()
+
+        self.queue: Deque[str] = deque()
+        self.in_pass = False
+        self.tokens = 0.0
+        self.last_tick = time.time()
+        self.last_save = self.last_tick
+        self.next_pass_at = self.last_tick
+
+        metrics = metrics or Registry()
+        metrics.gauge('cellsync_scrub_bytes', 'Bytes re-verified by the scrubber (all passes)', lambda: self.bytes_scrubbed)
+        metrics.gauge('cellsync_scrub_chunks', 'Chunks re-verified by the scrubber (all passes)', lambda: self.chunks_scrubbed)
+        metrics.gauge('cellsync_scrub_bytes_per_second', 'Scrub rate while a pass runs', self.bytes_per_sec)
+        metrics.gauge('cellsync_scrub_mismatches', 'Stored chunks the scrubber found corrupt', lambda: self.mismatches)
+
+    # --- State -------------------------------------------------------------
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            self.cursor = state.get('cursor', '')
+            self.passes = state.get('passes', 0)
+            self.bytes_scrubbed = state.get('bytes_scrubbed', 0)
+            self.chunks_scrubbed = state.get('chunks_scrubbed', 0)
+            self.mismatches = state.get('mismatches', 0)
+            self.repaired = state.get('repaired', 0)
+            self.active_seconds = state.get('active_seconds', 0.0)
+        except Exception as e:
+            print(f"Error loading scrub state {self.state_path}: {e}")
+
+    def save(self):
+        state = {
+            'cursor': self.cursor,
+            'passes': self.passes,
+            'bytes_scrubbed': self.bytes_scrubbed,
+            'chunks_scrubbed': self.chunks_scrubbed,
+            'mismatches': self.mismatches,
+            'repaired': self.repaired,
+            'active_seconds': self.active_seconds,
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+        self.last_save = time.time()
+
+    # --- Scrubbing ---------------------------------------------------------
+
+    def tick(self):
+        """Verify as many chunks as the byte budget allows. Call every TICK_INTERVAL."""
+        now = time.time()
+        elapsed, self.last_tick = now - self.last_tick, now
+        if self.rate <= 0 or now < self.next_pass_at:
+            return
+        if not self.in_pass:
+            # Resume after the saved cursor; chunks added meanwhile wait for the next pass
+            self.queue = deque(sorted(i for i in self.store.ids() if i > self.cursor))
+            self.in_pass = True
+        self.active_seconds += elapsed
+        self.tokens = min(self.rate, self.tokens + elapsed * self.rate)
+
+        while self.tokens > 0 and self.queue:
+            chunk_id = self.queue.popleft()
+            entry = self.store.entry(chunk_id)
+            if entry is None:
+                continue # Deleted since the pass started
+            self.tokens -= entry.length # May go negative: big chunks are paid off over later ticks
+            self.verify(chunk_id, entry.hash, codec.from_flags(entry.flags))
+            self.cursor = chunk_id
+
+        if not self.queue:
+            self.passes += 1
+            self.cursor = ''
+            self.in_pass = False
+            self.next_pass_at = now + self.interval
+            self.save()
+        elif now - self.last_save > SAVE_INTERVAL:
+            self.save()
+
+    def verify(self, chunk_id: str, expected_hash: Optional[str], chunk_codec: str = codec.NONE):
+        data = self.store.get(chunk_id)
+        if data is None or not expected_hash:
+            return # Gone, or a legacy chunk without a hash to check against
+        self.bytes_scrubbed += len(data)
+        self.chunks_scrubbed += 1
+        if not codec.matches(data, chunk_codec, expected_hash):
+            self.mismatches += 1
+            self.expect_repair(chunk_id)
+            self.on_corrupt(chunk_id)
+
+    def expect_repair(self, chunk_id: str):
+        """Mark a chunk found corrupt (here, or by a GUARD) as waiting for an intact replacement."""
+        with self.repair_lock:
+            self.repairing.add(chunk_id)
+
+    def is_repairing(self, chunk_id: str) -> bool:
+        with self.repair_lock:
+            return chunk_id in self.repairing
+
+    def note_stored(self, chunk_id: str):
+        """Called when a chunk is stored; completes a pending repair."""
+        with self.repair_lock:
+            if chunk_id in self.repairing:
+                self.repairing.discard(chunk_id)
+                self.repaired += 1
+
+    def bytes_per_sec(self) -> int:
+        return int(self.bytes_scrubbed / self.active_seconds) if self.active_seconds else 0
+
+    def stats(self) -> dict:
+        return {
+            'passes': self.passes,
+            'chunks_scrubbed': self.chunks_scrubbed,
+            'bytes_scrubbed': self.bytes_scrubbed,
+            'bytes_per_sec': self.bytes_per_sec(),
+            'budget_bytes_per_sec': self.rate,
+            'mismatches': self.mismatches,
+            'repairing': len(self.repairing),
+            'repaired': self.repaired,
+            'pass_remaining': len(self.queue),
+        }
+
+    def close(self):
+        try:
+            self.save()
+        except OSError as e:
+            print(f"Error saving scrub state {self.state_path}: {e}")
@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import struct
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from metrics import Registry
+
+# Segment record: magic, id length, data length, then id bytes and raw data.
+# The segment is self-describing so the index can be rebuilt from it if lost.
+RECORD = struct.Struct("!2sBI")
+RECORD_MAGIC = b"CR"
+
+# Index record: op, flags, segment, offset (of the data), length, sha256, id length, then id bytes
+INDEX_RECORD = struct.Struct("!BBIQI32sB")
+OP_PUT = 1
+OP_DELETE = 2
+
+# Index record flags
+FLAG_SHARD = 0x01 # An erasure-coded shard: one copy by design, never replicated
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+FSYNC_INTERVAL = 0.2      # seconds between batched fsyncs
+COMPACT_INTERVAL = 30.0   # seconds between compaction passes
+COMPACT_LIVE_RATIO = 0.5  # sealed segments below this live/total ratio get rewritten
+
+_NO_HASH = b"\x00" * 32
+
+
+class IndexEntry:
+    __slots__ = ('segment', 'offset', 'length', 'hash', 'flags')
+
+    def __init__(self, segment: int, offset: int, length: int, hash: str, flags: int = 0):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.hash = hash
+        self.flags = flags
+
+
+class SegmentStore:
+    """Log-structured chunk store: raw bytes in append-only segments plus a compact index.
+
+    - Writes append to the active segment and the index log; fsync is batched
+      by a background thread (group commit every FSYNC_INTERVAL seconds).
+    - Startup replays only the index log, never the segment data.
+    - A background compactor rewrites sealed segments whose live data has
+      dropped below COMPACT_LIVE_RATIO, and snapshots the index when it is
+      mostly dead records.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = SEGMENT_MAX_BYTES, background: bool = True,
+                 metrics: Optional[Registry] = None):
+        self.directory = directory
+        self.segment_dir = os.path.join(directory, "segments")
+        self.index_path = os.path.join(directory, "index.log")
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(self.segment_dir, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.index: Dict[str, IndexEntry] = {}
+        self.segment_sizes: Dict[int, int] = {}  # segment -> bytes appended
+        self.segment_live: Dict[int, int] = {}   # segment -> bytes still referenced
+        self.index_records = 0
+        self.dirty = False
+        self.durable_waiters: List[Callable[[], None]] = [] # run after the next group commit
+        self.running = True
+
+        metrics = metrics or Registry()
+        self.bytes_written = metrics.counter('cellsync_store_bytes_written_total', 'Chunk bytes appended to segments')
+        self.fsync_seconds = metrics.histogram('cellsync_store_fsync_seconds', 'Time of a group commit (segment and index fsync)')
+
+        self._load_index()
+        existing = sorted(self._list_segments())
+        self.active_segment = existing[-1] if existing else 1
+        self.active_file = open(self._segment_path(self.active_segment), 'ab')
+        self.segment_sizes.setdefault(self.active_segment, self.active_file.tell())
+        self.index_file = open(self.index_path, 'ab')
+        self.readers: Dict[int, object] = {}
+
+        # With background=False the owner calls sync() and compact() itself
+        self.threads = []
+        if background:
+            self.threads = [
+                threading.Thread(target=self._fsync_loop, daemon=True),
+                threading.Thread(target=self._compact_loop, daemon=True),
+            ]
+        for t in self.threads:
+            t.start()
+
+    # --- Paths & startup ---------------------------------------------------
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.segment_dir, f"seg_{segment:08d}.dat")
+
+    def _list_segments(self) -> List[int]:
+        return [int(name[4:12]) for name in os.listdir(self.segment_dir)
+                if name.startswith("seg_") and name.endswith(".dat")]
+
+    def _load_index(self):
+        """Replay the index log. Only metadata is read; segment data stays on disk."""
+        for segment in self._list_segments():
+            self.segment_sizes[segment] = os.path.getsize(self._segment_path(segment))
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            blob = f.read()
+        pos = 0
+        while pos + INDEX_RECORD.size <= len(blob):
+            op, flags, segment, offset, length, digest, id_len = INDEX_RECORD.unpack_from(blob, pos)
+            end = pos + INDEX_RECORD.size + id_len
+            if end > len(blob):
+                break
+            chunk_id = blob[pos + INDEX_RECORD.size:end].decode('utf-8')
+            pos = end
+            self.index_records += 1
+            self._apply(op, chunk_id, IndexEntry(segment, offset, length,
+                                                 digest.hex() if digest != _NO_HASH else None, flags))
+        if pos < len(blob):
+            # Torn tail from a crash before fsync: cut it off so new records append cleanly
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(pos)
+
+    def _apply(self, op: int, chunk_id: str, entry: IndexEntry):
+        old = self.index.pop(chunk_id, None)
+        if old is not None:
+            self.segment_live[old.segment] = self.segment_live.get(old.segment, 0) - old.length
+        if op == OP_PUT:
+            self.index[chunk_id] = entry
+            self.segment_live[entry.segment] = self.segment_live.get(entry.segment, 0) + entry.length
+
+    def _append_index(self, op: int, chunk_id: str, entry: IndexEntry):
+        id_bytes = chunk_id.encode('utf-8')
+        digest = _NO_HASH
+        if entry.hash and len(entry.hash) == 64:
+            try:
+                digest = bytes.fromhex(entry.hash)
+            except ValueError:
+                pass
+        self.index_file.write(INDEX_RECORD.pack(op, entry.flags, entry.segment, entry.offset,
+                                                entry.length, digest, len(id_bytes)) + id_bytes)
+        self.index_records += 1
+
+    # --- Public API --------------------------------------------------------
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def ids(self) -> List[str]:
+        with self.lock:
+            return list(self.index.keys())
+
+    def entries(self) -> Iterator[Tuple[str, IndexEntry]]:
+        with self.lock:
+            items = list(self.index.items())
+        return iter(items)
+
+    def entry(self, chunk_id: str) -> Optional[IndexEntry]:
+        return self.index.get(chunk_id)
+
+    def put(self, chunk_id: str, data: bytes, hash: Optional[str] = None, flags: int = 0):
+        """Append a chunk. Durable after the next batched fsync (or an explicit sync())."""
+        id_bytes = chunk_id.encode('utf-8')
+        with self.lock:
+            if self.segment_sizes[self.active_segment] >= self.segment_max_bytes:
+                self._roll_segment()
+            header = RECORD.pack(RECORD_MAGIC, len(id_bytes), len(data))
+            record_start = self.segment_sizes[self.active_segment]
+            self.active_file.write(header + id_bytes)
+            self.active_file.write(data)
+            offset = record_start + RECORD.size + len(id_bytes)
+            self.segment_sizes[self.active_segment] = offset + len(data)
+            self.bytes_written.inc(len(data))
+
+            entry = IndexEntry(self.active_segment, offset, len(data), hash, flags)
+            self._append_index(OP_PUT, chunk_id, entry)
+            self._apply(OP_PUT, chunk_id, entry)
+            self.dirty = True
+
+    def get(self, chunk_id: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.index.get(chunk_id)
+            if entry is None:
+                return None
+            if entry.segment == self.active_segment:
+                self.active_file.flush()
+            reader = self.readers.get(entry.segment)
+            if reader is None:
+                reader = self.readers[entry.segment] = open(self._segment_path(entry.segment), 'rb')
+            reader.seek(entry.offset)
+            return reader.read(entry.length)
+
+    def delete(self, chunk_id: str):
+        with self.lock:
+            entry = self.index.get(chunk_id)
+            if entry is None:
+                return
+            self._append_index(OP_DELETE, chunk_id, entry)
+            self._apply(OP_DELETE, chunk_id, entry)
+            self.dirty = True
+
+    def sync(self):
+        """Flush and fsync the active segment and the index (one group commit)."""
+        with self.lock:
+            if not self.dirty:
+                return
+            started = time.perf_counter()
+            self.active_file.flush()
+            os.fsync(self.active_file.fileno())
+            self.index_file.flush()
+            os.fsync(self.index_file.fileno())
+            self.dirty = False
+            self.fsync_seconds.observe(time.perf_counter() - started)
+            waiters, self.durable_waiters = self.durable_waiters, []
+        for callback in waiters:
+            callback()
+
+    def when_durable(self, callback: Callable[[], None]):
+        """Run callback once everything written so far is fsynced (at once if it already is)."""
+        with self.lock:
+            if self.dirty:
+                self.durable_waiters.append(callback)
+                return
+        callback()
+
+    def bytes_stored(self) -> int:
+        with self.lock:
+            return sum(entry.length for entry in self.index.values())
+
+    def close(self):
+        self.running = False
+        self.sync()
+        with self.lock:
+            for f in [self.active_file, self.index_file] + list(self.readers.values()):
+                f.close()
+            self.readers.clear()
+
+    # --- Background work ---------------------------------------------------
+
+    def _roll_segment(self):
+        self.active_file.flush()
+        os.fsync(self.active_file.fileno())
+        self.active_file.close()
+        self.active_segment += 1
+        self.active_file = open(self._segment_path(self.active_segment), 'ab')
+        self.segment_sizes[self.active_segment] = 0
+
+    def _fsync_loop(self):
+        while self.running:
+            time.sleep(FSYNC_INTERVAL)
+            try:
+                self.sync()
+            except (OSError, ValueError):
+                pass # Store closed underneath us
+
+    def _compact_loop(self):
+        while self.running:
+            time.sleep(COMPACT_INTERVAL)
+            try:
+                self.compact()
+            except (OSError, ValueError) as e:
+                print(f"Error compacting {self.directory}: {e}")
+
+    def compact(self):
+        """Rewrite mostly-dead sealed segments and snapshot the index if it is mostly dead records."""
+        with self.lock:
+            sealed = [s for s in self.segment_sizes if s != self.active_segment]
+        for segment in sealed:
+            with self.lock:
+                size = self.segment_sizes.get(segment, 0)
+                live = self.segment_live.get(segment, 0)
+                if size and live / size >= COMPACT_LIVE_RATIO:
+                    continue
+                moving = [(cid, e) for cid, e in self.index.items() if e.segment == segment]
+            for chunk_id, entry in moving:
+                with self.lock:
+                    if self.index.get(chunk_id) is not entry:
+                        continue # Overwritten or deleted meanwhile
+                    data = self.get(chunk_id)
+                    self.put(chunk_id, data, entry.hash, entry.flags)
+            with self.lock:
+                self.sync()
+                reader = self.readers.pop(segment, None)
+                if reader:
+                    reader.close()
+                os.remove(self._segment_path(segment))
+                self.segment_sizes.pop(segment, None)
+                self.segment_live.pop(segment, None)
+
+        with self.lock:
+            # Replaying old index records re-creates counts for segments removed long ago
+            for segment in [s for s in self.segment_live if s not in self.segment_sizes]:
+                del self.segment_live[segment]
+            if self.index_records > 2 * len(self.index) + 1024:
+                self._snapshot_index()
+
+    def _snapshot_index(self):
+        """Replace the index log with one PUT record per live chunk."""
+        self.sync()
+        tmp_path = self.index_path + ".tmp"
+        self.index_file.close()
+        with open(tmp_path, 'wb') as f:
+            self.index_file = f
+            self.index_records = 0
+            for chunk_id, entry in self.index.items():
+                self._append_index(OP_PUT, chunk_id, entry)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self.index_file = open(self.index_path, 'ab')
+
+    # --- Migration ---------------------------------------------------------
+
+    def migrate_json_dir(self, json_dir: str) -> int:
+        """Import legacy one-JSON-file-per-chunk storage, removing each file once imported."""
+        migrated = []
+        for filename in os.listdir(json_dir):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(json_dir, filename)
+            try:
+                with open(path, 'r') as f:
+                    record = json.load(f)
+                data = bytes.fromhex(record.get('data', ''))
+                chunk_id = record.get('hash') or record.get('id')
+                if chunk_id not in self.index:
+                    self.put(chunk_id, data, record.get('hash'))
+                migrated.append(path)
+            except Exception as e:
+                print(f"Error migrating {filename}: {e}")
+        self.sync()
+        for path in migrated:
+            os.remove(path)
+        return len(migrated)
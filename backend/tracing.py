@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import glob
+import time
+import secrets
+import threading
+import argparse
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import config
+
+# End-to-end tracing of uploads. An uploader that traces a file starts a
+# trace and sends its context, [trace id, span id], in the 'trace' field of
+# the message envelope (UDPNetwork.send_message(..., trace=...)). A cell that
+# receives a traced message records its own spans as children of that
+# context, and passes the context on with the messages it sends on the
+# chunk's behalf: STORE_ACK, VERIFY, and later heal, REPLICATE and
+# anti-entropy copies of the chunk. Untraced messages record nothing.
+#
+# Each process appends its spans to its own file in TRACE_DIR, in the Chrome
+# trace event format (chrome://tracing, Perfetto): a JSON array of complete
+# ("X") events. Timestamps are wall-clock microseconds, so the files of all
+# the processes on a host line up on one timeline.
+
+# Chunks a cell remembers the trace of, so later copies join the same trace
+TRACED_CHUNKS = 4096
+
+
+def new_id() -> str:
+    return secrets.token_hex(8)
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start', 'args')
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str], args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.args = args
+
+    def context(self) -> List[str]:
+        """What travels in the envelope: [trace id, this span's id]."""
+        return [self.trace_id, self.span_id]
+
+    def end(self, **args):
+        self.args.update(args)
+        self.tracer.record(self, time.time())
+
+
+class Tracer:
+    """Records the spans of one process into TRACE_DIR/<name>.json."""
+
+    def __init__(self, name: str, directory: str = None, pid: int = None):
+        self.name = name
+        self.directory = directory if directory is not None else config.TRACE_DIR
+        self.path = os.path.join(self.directory, f"{name}.json")
+        self.pid = pid if pid is not None else os.getpid()
+        self.file = None # Opened on the first span
+        self.lock = threading.Lock()
+        self.chunks: "OrderedDict[str, List[str]]" = OrderedDict() # chunk id -> context it arrived with
+
+    def start(self, name: str, context: Optional[List[str]] = None, **args) -> Span:
+        """A span under a received context, or the root span of a new trace."""
+        if context:
+            trace_id, parent_id = context[0], context[1]
+        else:
+            trace_id, parent_id = new_id(), None
+        return Span(self, name, trace_id, parent_id, args)
+
+    def remember(self, chunk_id: str, context: List[str]):
+        with self.lock:
+            self.chunks[chunk_id] = context
+            self.chunks.move_to_end(chunk_id)
+            while len(self.chunks) > TRACED_CHUNKS:
+                self.chunks.popitem(last=False)
+
+    def context_of(self, chunk_id: str) -> Optional[List[str]]:
+        """The context a traced chunk arrived with; None for untraced chunks."""
+        return self.chunks.get(chunk_id)
+
+    def record(self, span: Span, end: float):
+        event = {
+            'name': span.name,
+            'cat': 'cellsync',
+            'ph': 'X',
+            'ts': int(span.start * 1e6),
+            'dur': max(0, int((end - span.start) * 1e6)),
+            'pid': self.pid,
+            'tid': threading.get_native_id(),
+            'args': dict(span.args, trace_id=span.trace_id, span_id=span.span_id, parent_id=span.parent_id),
+        }
+        with self.lock:
+            try:
+                if self.file is None:
+                    self._open()
+                self.file.write(json.dumps(event, separators=(',', ':')) + ",\n")
+                self.file.flush()
+            except OSError as e:
+                print(f"Error writing trace {self.path}: {e}")
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fresh = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, 'a')
+        if fresh:
+            # The closing bracket is optional in this format, so spans can be appended forever
+            self.file.write("[\n")
+        # Process label in the viewer
+        self.file.write(json.dumps({'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                                    'args': {'name': self.name}}) + ",\n")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+_tracers: Dict[str, Tracer] = {}
+_tracers_lock = threading.Lock()
+
+
+def get_tracer(name: str, pid: int = None) -> Tracer:
+    """The tracer writing <name>.json, shared by everything in this process using that name."""
+    with _tracers_lock:
+        tracer = _tracers.get(name)
+        if tracer is None:
+            tracer = _tracers[name] = Tracer(name, pid=pid)
+        return tracer
+
+
+# --- Analysis -------------------------------------------------------------
+
+def load(paths: Iterable[str]) -> List[dict]:
+    """Span events from trace files (unterminated arrays included)."""
+    events = []
+    for path in paths:
+        with open(path) as f:
+            text = f.read().strip().rstrip(',')
+        if not text:
+            continue
+        if not text.endswith(']'):
+            text += ']'
+        events.extend(e for e in json.loads(text) if e.get('ph') == 'X')
+    return events
+
+
+def replica_times(events: List[dict], trace_id: Optional[str] = None) -> Dict[str, Dict[str, List[float]]]:
+    """trace id -> chunk id -> seconds from the chunk's first send to each durable copy, sorted.
+
+    The uploader's 'chunk' span marks the first send; every cell's 'durable'
+    span ends when its copy was fsynced, whether it came from the upload or
+    from a later heal, REPLICATE or anti-entropy round.
+    """
+    sent: Dict[tuple, int] = {}
+    durable: Dict[tuple, Dict[int, int]] = {} # -> cell (pid) -> first durable time
+    for event in events:
+        args = event.get('args', {})
+        if trace_id and args.get('trace_id') != trace_id:
+            continue
+        key = (args.get('trace_id'), args.get('chunk'))
+        if event['name'] == 'chunk':
+            sent[key] = event['ts']
+        elif event['name'] == 'durable':
+            # A retransmitted STORE finds the chunk already stored: count each cell once
+            cells = durable.setdefault(key, {})
+            end = event['ts'] + event['dur']
+            cells[event['pid']] = min(end, cells.get(event['pid'], end))
+    times: Dict[str, Dict[str, List[float]]] = {}
+    for (trace, chunk_id), started in sent.items():
+        copies = sorted((end - started) / 1e6 for end in durable.get((trace, chunk_id), {}).values())
+        times.setdefault(trace, {})[chunk_id] = copies
+    return times
+
+
+def time_to_replicas(copies: Dict[str, List[float]], replicas: int) -> Dict[str, Optional[float]]:
+    """chunk id -> seconds until `replicas` durable copies existed (None if never)."""
+    return {chunk_id: times[replicas - 1] if len(times) >= replicas else None
+            for chunk_id, times in copies.items()}
+
+
+def _percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Time for the chunks of traced uploads to reach N durable replicas")
+    parser.add_argument("files", nargs="*", help=f"trace files (default: {config.TRACE_DIR}/*.json)")
+    parser.add_argument("--trace", help="only this trace id")
+    parser.add_argument("--replicas", type=int, default=config.REPLICATION_FACTOR, help="durable copies wanted")
+    parser.add_argument("--chunks", action="store_true", help="list every chunk")
+    args = parser.parse_args(argv)
+
+    events = load(args.files or glob.glob(os.path.join(config.TRACE_DIR, "*.json")))
+    uploads = {e['args']['trace_id']: e['args'] for e in events if e['name'] == 'upload'}
+    for trace, copies in replica_times(events, args.trace).items():
+        reached = time_to_replicas(copies, args.replicas)
+        done = sorted(t for t in reached.values() if t is not None)
+        filename = uploads.get(trace, {}).get('filename', '?')
+        print(f"trace {trace} ({filename}): {len(done)}/{len(reached)} chunks reached {args.replicas} durable replicas")
+        if done:
+            print(f"  p50 {_percentile(done, 0.5) * 1000:.1f} ms  p90 {_percentile(done, 0.9) * 1000:.1f} ms  "
+                  f"max {done[-1] * 1000:.1f} ms")
+        if args.chunks:
+            for chunk_id, copies_at in copies.items():
+                print(f"  {chunk_id[:16]}  " + " ".join(f"{t * 1000:.1f}" for t in copies_at))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,335 @@
+import os
+import time
+import random
+import select
+import hashlib
+from collections import Counter, deque
+from typing import BinaryIO, Deque, Dict, List, Optional, Set, Tuple
+
+import codec
+import config
+import erasure
+import placement
+import tracing
+from file_manager import FileManager
+from network import UDPNetwork
+from protocol import PROTOCOL_VERSION
+
+# Bounds of the retransmission timeout, in seconds
+MIN_RTO = 0.05
+MAX_RTO = 2.0
+INITIAL_RTO = 0.5
+
+# The window never shrinks below this many STOREs in flight
+MIN_WINDOW = 4
+
+# Acks drained per receive pass before the send side gets another turn
+MAX_ACKS_PER_PASS = 1024
+
+
+class UploadClient:
+    """Uploads files with a sliding window of acknowledged STOREs.
+
+    Each chunk is sent to all of its replica targets at once, and every cell
+    answers with STORE_ACK once the chunk is in its store. A STORE that is not
+    acknowledged within the retransmission timeout (smoothed RTT plus four
+    deviations, as in TCP) is sent again, up to `retries` attempts per copy.
+    The window grows per ack and halves on loss (slow start, then AIMD), and
+    is also capped in unacknowledged bytes. Sending is therefore paced by the
+    cells and the socket buffers, not by fixed sleeps.
+
+    With `erasure=(k, m)` each chunk is stored as k data + m parity shards,
+    one shard per cell (best rendezvous ranks first), instead of as full
+    replicas.
+
+    Chunks are cut by `chunking` (CHUNKING by default; see
+    FileManager.iter_chunks) and compressed with `compression`
+    (COMPRESSION_CODEC by default) where that pays off, before being sent or
+    erasure-coded.
+
+    A traced upload (`trace`, or a TRACE_SAMPLE_RATE share of uploads) sends
+    its trace context with every STORE and records an 'upload' span and one
+    'chunk' span per stored unit, from its first send to its last ack; the
+    cells add their verify, store and durable spans (see tracing.py).
+    """
+
+    def __init__(self, cell_ports: List[int], port: int = 0, window: int = None,
+                 max_window: int = None, window_bytes: int = None, retries: int = None,
+                 erasure: Optional[Tuple[int, int]] = None, compression: str = None, chunking: str = None,
+                 trace: bool = None):
+        self.cell_ports = list(cell_ports)
+        self.erasure = erasure
+        self.compression = compression if compression is not None else config.COMPRESSION_CODEC
+        self.chunking = chunking if chunking is not None else config.CHUNKING
+        self.network = UDPNetwork(port, default_peer_version=PROTOCOL_VERSION)
+        if trace is None:
+            trace = random.random() < config.TRACE_SAMPLE_RATE
+        self.tracer = tracing.get_tracer(f"upload-{os.getpid()}") if trace else None
+        self.window = float(window if window is not None else config.UPLOAD_WINDOW)
+        self.max_window = max_window if max_window is not None else config.UPLOAD_MAX_WINDOW
+        self.window_bytes = window_bytes if window_bytes is not None else config.UPLOAD_WINDOW_BYTES
+        self.retries = retries if retries is not None else config.UPLOAD_RETRIES
+        self.ssthresh = float(self.max_window)
+
+        # Round-trip estimate (RFC 6298)
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = INITIAL_RTO
+        self.last_backoff = 0.0
+
+    # --- Pacing ------------------------------------------------------------
+
+    def _sample_rtt(self, rtt: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    def _grow(self):
+        if self.window < self.ssthresh:
+            self.window += 1 # Slow start: doubles every round trip
+        else:
+            self.window += 1 / self.window # Additive increase: +1 per round trip
+        self.window = min(self.window, self.max_window)
+
+    def _backoff(self, now: float):
+        # One reduction per timeout period, however many STOREs of that round were lost
+        if now - self.last_backoff < self.rto:
+            return
+        self.last_backoff = now
+        self.ssthresh = max(MIN_WINDOW, self.window / 2)
+        self.window = self.ssthresh
+        self.rto = min(MAX_RTO, self.rto * 2)
+
+    # --- Upload ------------------------------------------------------------
+
+    def upload(self, filepath: str, chunk_size: int = 1024) -> dict:
+        """Upload a file from disk. See upload_stream for the report returned."""
+        with open(filepath, 'rb') as f:
+            return self.upload_stream(f, os.path.basename(filepath), os.path.getsize(filepath), chunk_size)
+
+    def upload_stream(self, stream: BinaryIO, filename: str, file_size: int, chunk_size: int = 1024) -> dict:
+        """Chunk a stream, store every chunk on its replica set and publish the manifest.
+
+        Returns a report; 'replicas' is the number of confirmed copies of the
+        least replicated chunk, 'replica_counts' the full distribution.
+        """
+        if not self.cell_ports:
+            raise ValueError("no cells to upload to")
+        if self.erasure and len(self.cell_ports) < sum(self.erasure):
+            print(f"Warning: {len(self.cell_ports)} cells for {self.erasure[0]}+{self.erasure[1]} shards; "
+                  f"some cells will hold several shards of a stripe")
+        started = time.time()
+        # Copies wanted of every stored unit: a full chunk, or one erasure-coded shard
+        target = 1 if self.erasure else min(config.REPLICATION_FACTOR, len(self.cell_ports))
+        chunks = FileManager.iter_stream(stream, filename, file_size, chunk_size, self.compression, self.chunking)
+        manifest = FileManager.new_manifest(filename, self.erasure)
+        stripes: Dict[str, tuple] = {} # chunk id -> add_stripe arguments
+        shard_holders: Dict[str, int] = {}
+
+        buffered: Dict[str, dict] = {}          # chunk id -> chunk, until every copy is resolved
+        outstanding: Dict[str, Set[int]] = {}   # chunk id -> targets not yet acked or given up
+        acked: Dict[str, Set[int]] = {}         # chunk id -> cells that confirmed a copy
+        queue: Deque[Tuple[str, int, int]] = deque() # (chunk id, port, attempt) ready to send
+        inflight: Dict[Tuple[str, int], Tuple[float, int, int]] = {} # -> (sent at, attempt, size)
+        inflight_bytes = 0
+        stored_bytes = compressed = 0 # per unique chunk
+        known = 0 # copies a cell already had
+        retransmits = rejected = 0
+        exhausted = False
+        root = self.tracer.start('upload', filename=filename, size=file_size) if self.tracer else None
+        spans: Dict[str, tracing.Span] = {} # chunk id -> span from its first send to its last ack
+
+        def resolve(chunk_id: str, port: int):
+            ports = outstanding.get(chunk_id)
+            if ports is None or port not in ports:
+                return
+            ports.discard(port)
+            if not ports:
+                del outstanding[chunk_id]
+                del buffered[chunk_id]
+                if chunk_id in spans:
+                    spans.pop(chunk_id).end(acked=len(acked[chunk_id]))
+
+        while True:
+            # Read ahead only as far as the window can use
+            while not exhausted and len(queue) < self.window:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                FileManager.add_to_manifest(manifest, chunk)
+                if self.erasure:
+                    if chunk['id'] in stripes:
+                        FileManager.add_stripe(manifest, *stripes[chunk['id']])
+                        continue
+                    units = self.shards(chunk, shard_holders)
+                    stripes[chunk['id']] = ([u['id'] for u in units], [u['replicas'][0] for u in units],
+                                            chunk.get('codec', codec.NONE), len(chunk['data']))
+                    FileManager.add_stripe(manifest, *stripes[chunk['id']])
+                    compressed += 'codec' in chunk
+                else:
+                    chunk['replicas'] = placement.replica_set(chunk['id'], self.cell_ports, target)
+                    units = [chunk]
+                for unit in units:
+                    unit_id = unit['id']
+                    if unit_id in acked:
+                        continue # Repeated content within the file is stored once
+                    if not self.erasure:
+                        compressed += 'codec' in unit
+                    stored_bytes += len(unit['data'])
+                    unit['ack'] = True
+                    buffered[unit_id] = unit
+                    outstanding[unit_id] = set(unit['replicas'])
+                    acked[unit_id] = set()
+                    queue.extend((unit_id, port, 1) for port in unit['replicas'])
+
+            # Send while the window has room, in messages and in bytes
+            while queue and len(inflight) < int(self.window):
+                chunk_id, port, attempt = queue[0]
+                if port not in outstanding.get(chunk_id, ()):
+                    queue.popleft() # Acked late while waiting for its retry
+                    continue
+                size = len(buffered[chunk_id]['data'])
+                if inflight and inflight_bytes + size > self.window_bytes:
+                    break
+                queue.popleft()
+                trace = None
+                if root:
+                    span = spans.get(chunk_id)
+                    if span is None:
+                        span = spans[chunk_id] = self.tracer.start('chunk', root.context(), chunk=chunk_id, size=size)
+                    trace = span.context()
+                self.network.send_message(port, 'STORE', buffered[chunk_id], trace=trace)
+                inflight[(chunk_id, port)] = (time.time(), attempt, size)
+                inflight_bytes += size
+
+            if exhausted and not queue and not inflight:
+                break
+
+            # Wait for acks until the oldest STORE in flight times out
+            now = time.time()
+            wait = min((sent_at + self.rto for sent_at, _, _ in inflight.values()), default=now) - now
+            for chunk_id, port, ok, was_known in self._receive_acks(max(0.0, wait)):
+                sent = inflight.pop((chunk_id, port), None)
+                if sent is not None:
+                    sent_at, attempt, size = sent
+                    inflight_bytes -= size
+                    if attempt == 1:
+                        self._sample_rtt(time.time() - sent_at) # Karn: skip ambiguous retries
+                if chunk_id not in acked:
+                    continue # Not part of this upload
+                if ok:
+                    acked[chunk_id].add(port)
+                    known += was_known
+                    self._grow()
+                else:
+                    rejected += 1
+                resolve(chunk_id, port)
+
+            # Retry STOREs whose ack did not arrive in time
+            now = time.time()
+            for key, (sent_at, attempt, size) in list(inflight.items()):
+                if now - sent_at < self.rto:
+                    continue
+                del inflight[key]
+                inflight_bytes -= size
+                self._backoff(now)
+                chunk_id, port = key
+                if attempt >= self.retries:
+                    resolve(chunk_id, port) # Give up on this copy; healing may restore it
+                else:
+                    queue.appendleft((chunk_id, port, attempt + 1))
+                    retransmits += 1
+
+        # Every cell keeps the (small) manifest so it can reference-count chunks
+        manifest_acks = self.publish_manifest(manifest)
+
+        elapsed = time.time() - started
+        counts = Counter(len(ports) for ports in acked.values())
+        report = {
+            'filename': filename,
+            'size': manifest['size'],
+            'chunks': len(manifest['chunks']),
+            'unique_chunks': len(acked),
+            'target_replicas': target,
+            'replicas': min(counts) if counts else target,
+            'replica_counts': dict(counts),
+            'under_replicated': sum(n for replicas, n in counts.items() if replicas < target),
+            'compressed_chunks': compressed,
+            'stored_bytes': stored_bytes, # one copy of everything, after compression (and parity)
+            'already_stored': known, # copies the cells had before, e.g. unchanged chunks of a new version
+            'retransmits': retransmits,
+            'rejected': rejected,
+            'manifest_acks': manifest_acks, # cells that confirmed the manifest (anti-entropy brings it to the rest)
+            'seconds': round(elapsed, 3),
+            'bytes_per_sec': int(manifest['size'] / elapsed) if elapsed > 0 else 0,
+        }
+        if self.erasure:
+            report['erasure'] = manifest['erasure']
+        if root:
+            root.end(chunks=report['chunks'], unique_chunks=report['unique_chunks'], retransmits=retransmits)
+            report['trace_id'] = root.trace_id
+        return report
+
+    def shards(self, chunk: dict, shard_holders: Dict[str, int]) -> List[dict]:
+        """Erasure-code a chunk into k+m shard chunks, each addressed to one cell."""
+        k, m = self.erasure
+        ranked = placement.rank(chunk['id'], self.cell_ports)
+        shards = []
+        for index, data in enumerate(erasure.encode(chunk['data'], k, m)):
+            shard_id = hashlib.sha256(data).hexdigest()
+            # Identical shards (e.g. of zero-filled chunks) are stored once, on their first holder
+            holder = shard_holders.setdefault(shard_id, ranked[index % len(ranked)])
+            shards.append({'id': shard_id, 'hash': shard_id, 'data': data, 'replicas': [holder], 'shard': True})
+        return shards
+
+    def publish_manifest(self, manifest: dict) -> int:
+        """Send the manifest to every cell, again to those that do not ack it in time. Returns the acks."""
+        waiting = set(self.cell_ports)
+        timeout = self.rto
+        for _ in range(self.retries):
+            for port in waiting:
+                self.network.send_message(port, 'MANIFEST', manifest)
+            deadline = time.time() + timeout
+            while waiting:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not select.select([self.network.socket], [], [], remaining)[0]:
+                    break
+                msg = self.network.receive_message()
+                if msg is None:
+                    continue
+                payload, _ = msg
+                data = payload.get('data') or {}
+                if payload.get('type') == 'MANIFEST_ACK' and data.get('filename') == manifest['filename']:
+                    waiting.discard(payload.get('sender_port'))
+            if not waiting:
+                break
+            timeout = min(MAX_RTO, timeout * 2)
+        return len(self.cell_ports) - len(waiting)
+
+    def _receive_acks(self, timeout: float) -> List[Tuple[str, int, bool, bool]]:
+        """Wait up to timeout for STORE_ACKs, then drain whatever else is queued."""
+        acks = []
+        sock = self.network.socket
+        while len(acks) < MAX_ACKS_PER_PASS and select.select([sock], [], [], timeout)[0]:
+            timeout = 0
+            msg = self.network.receive_message()
+            if msg is None:
+                continue
+            payload, _ = msg
+            if payload.get('type') == 'STORE_ACK':
+                data = payload.get('data') or {}
+                acks.append((data.get('id'), payload.get('sender_port'), data.get('ok', True), data.get('known', False)))
+        return acks
+
+    def close(self):
+        self.network.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,126 @@
+import time
+import queue
+import threading
+from typing import Callable, List, Optional
+
+import codec
+import config
+from metrics import Registry
+
+
+class Verifier:
+    """Checks chunk bytes against their sha256 on a pool of worker threads.
+
+    Callers submit (chunk id, expected hash, bytes, callback) and return at
+    once; the callback gets True or False from a worker. Workers take up to
+    `batch_size` chunks per wake-up, and hashlib releases the GIL while
+    hashing large buffers, so the pool scales across cores.
+
+    Every chunk gets the full sha256: a cheaper fingerprint of a copy seen
+    before could be forged to match. Callers skip chunks they already hold
+    instead (a GUARD discards the bytes of a duplicate STORE anyway).
+
+    Compressed chunks are inflated before hashing, since hashes are defined
+    on the uncompressed content.
+
+    The worker threads start with the first chunk submitted (or start()), so
+    cells that never verify (STORAGE role) do not run an idle pool.
+    """
+
+    def __init__(self, workers: int = None, batch_size: int = None,
+                 queue_size: int = None, metrics: Optional[Registry] = None):
+        self.batch_size = batch_size if batch_size is not None else config.VERIFY_BATCH_SIZE
+        self.queue: "queue.Queue[Optional[tuple]]" = queue.Queue(
+            queue_size if queue_size is not None else config.VERIFY_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.verified = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        metrics = metrics or Registry()
+        self.check_seconds = metrics.histogram('cellsync_verify_seconds', 'Time to verify one chunk')
+        self.checks = metrics.counter('cellsync_verify_total', 'Chunks verified, by result (ok, failed)')
+
+        self.threads = [threading.Thread(target=self._worker, daemon=True)
+                        for _ in range(workers if workers is not None else config.VERIFY_WORKERS)]
+        self.started = False
+
+    def start(self):
+        """Start the worker threads (once)."""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for t in self.threads:
+            t.start()
+
+    def submit(self, chunk_id: str, expected_hash: str, data: bytes, callback: Callable[[bool], None],
+               chunk_codec: Optional[str] = None):
+        """Queue a chunk for verification. Blocks only when the queue is full (backpressure)."""
+        if not self.started:
+            self.start()
+        self.queue.put((chunk_id, expected_hash, data, callback, chunk_codec))
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def _take_batch(self) -> List[tuple]:
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _check(self, expected_hash: str, data: bytes, chunk_codec: Optional[str]) -> bool:
+        if not isinstance(data, (bytes, bytearray)) or not expected_hash:
+            return False
+        return codec.matches(data, chunk_codec, expected_hash)
+
+    def _worker(self):
+        while True:
+            batch = self._take_batch()
+            stopping = None in batch # Shutdown sentinel; finish the rest of the batch first
+            results = []
+            for item in batch:
+                if item is None:
+                    continue
+                _, expected_hash, data, callback, chunk_codec = item
+                started = time.perf_counter()
+                ok = self._check(expected_hash, data, chunk_codec)
+                self.check_seconds.observe(time.perf_counter() - started)
+                self.checks.inc(labels={'result': 'ok' if ok else 'failed'})
+                results.append((callback, ok))
+
+            with self.lock:
+                self.batches += 1
+                self.verified += sum(ok for _, ok in results)
+                self.failed += sum(not ok for _, ok in results)
+
+            for callback, ok in results:
+                try:
+                    callback(ok)
+                except Exception as e:
+                    print(f"Error after verifying chunk: {e}")
+            if stopping:
+                return
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'verified': self.verified,
+                'failed': self.failed,
+                'batches': self.batches,
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+    def close(self):
+        if not self.started:
+            return
+        for _ in self.threads:
+            self.queue.put(None)
@@ -2,6 +2,7 @@ import { useState, useEffect, useRef } from 'react'
 import './index.css'
 
 const API_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
+const MAX_LOGS = 1000;
 
 function App() {
   const [status, setStatus] = useState({ active_ports: [], total_ports: [] });
@@ -18,6 +19,17 @@ function App() {
     return () => clearInterval(interval);
   }, []);
 
+  // Logs are pushed as they happen (server-sent events); the browser
+  // reconnects on its own and resumes after the last line it received
+  useEffect(() => {
+    const source = new EventSource(`${API_URL}/logs/stream`);
+    source.onmessage = (event) => {
+      const { logs: lines } = JSON.parse(event.data);
+      setLogs(prev => [...prev, ...lines].slice(-MAX_LOGS));
+    };
+    return () => source.close();
+  }, []);
+
   useEffect(() => {
     logsEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [logs]);
@@ -27,10 +39,6 @@ function App() {
       const statusRes = await fetch(`${API_URL}/status`);
       const statusData = await statusRes.json();
       setStatus(statusData);
-
-      const logsRes = await fetch(`${API_URL}/logs`);
-      const logsData = await logsRes.json();
-      setLogs(logsData.logs);
     } catch (e) {
       console.error("Error fetching status:", e);
     }
@@ -8,6 +8,7 @@ import threading
 import subprocess
 from file_manager import FileManager
 from network import UDPNetwork
+from upload_client import UploadClient
 from colorama import init, Fore, Style
 
 init(autoreset=True)
@@ -43,24 +44,17 @@ def stop_cluster():
 
 def demo_upload(filepath):
     print(f"\n{Fore.YELLOW}📤 Uploading {filepath}...{Style.RESET_ALL}")
-    chunks = FileManager.chunk_file(filepath)
     # Distribute to currently running cells
     active_ports = list(running_cells.keys())
     if not active_ports:
         print(f"{Fore.RED}❌ No active cells to upload to!{Style.RESET_ALL}")
         return
 
-    dist = FileManager.distribute_chunks(chunks, active_ports)
-    
-    net = UDPNetwork(4999) 
+    with UploadClient(active_ports) as client:
+        report = client.upload(filepath)
     
-    for port, cell_chunks in dist.items():
-        for chunk in cell_chunks:
-            net.send_message(port, 'STORE', chunk)
-            time.sleep(0.05) 
-            
-    print(f"{Fore.GREEN}- File distributed across {len(active_ports)} cells.{Style.RESET_ALL}")
-    net.close()
+    print(f"{Fore.GREEN}- File distributed across {len(active_ports)} cells "
+          f"({report['replicas']}/{report['target_replicas']} replicas, {report['seconds']}s).{Style.RESET_ALL}")
 
 def kill_random_cell():
     if not running_cells:
@@ -83,7 +77,7 @@ def corrupt_random_chunk(filepath):
     print(f"\n{Fore.MAGENTA}- CHAOS: Injecting CORRUPTED data...{Style.RESET_ALL}")
     chunks = FileManager.chunk_file(filepath)
     bad_chunk = chunks[0]
-    bad_chunk['data'] = "deadbeef" * 10 
+    bad_chunk['data'] = b"\xde\xad\xbe\xef" * 10
     
     net = UDPNetwork(4999)
     active_ports = list(running_cells.keys())
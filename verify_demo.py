@@ -4,8 +4,8 @@ import time
 import os
 import signal
 import shutil
-from file_manager import FileManager
 from network import UDPNetwork
+from upload_client import UploadClient
 from colorama import init, Fore, Style
 
 init(autoreset=True)
@@ -39,15 +39,10 @@ def stop_cluster():
 
 def demo_upload(filepath):
     print(f"\n{Fore.YELLOW}- Uploading {filepath}...{Style.RESET_ALL}")
-    chunks = FileManager.chunk_file(filepath)
-    dist = FileManager.distribute_chunks(chunks, ALL_PORTS)
-    net = UDPNetwork(4999) 
-    for port, cell_chunks in dist.items():
-        for chunk in cell_chunks:
-            net.send_message(port, 'STORE', chunk)
-            time.sleep(0.05) 
-    print(f"{Fore.GREEN}- File distributed across {len(ALL_PORTS)} cells.{Style.RESET_ALL}")
-    net.close()
+    with UploadClient(ALL_PORTS) as client:
+        report = client.upload(filepath)
+    print(f"{Fore.GREEN}- File distributed across {len(ALL_PORTS)} cells "
+          f"({report['replicas']}/{report['target_replicas']} replicas, {report['seconds']}s).{Style.RESET_ALL}")
 
 def main():
     with open("demo_test.txt", "w") as f: